@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import io
+import json
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+from datetime import datetime
+import bot
+import headless
+
+# Times the game's hot paths on rosters of several sizes against the headless transport and saves the numbers as
+# json, so two versions can be compared with --compare. Rosters bigger than any gamemode use a synthetic
+# `roles` gamemode (see synthetic_gamemode) and lift MAX_PLAYERS.
+#
+#   python benchmark.py --sizes 4 12 24 100 500 --output bench.json --compare old_bench.json
+
+BENCH_MIN_TIME = 0.5 # seconds each benchmark runs for at least
+BENCH_MIN_CALLS = 5
+BENCH_ALLOC_SAMPLES = 3
+REGRESSION_THRESHOLD = 0.1 # --compare flags anything this much slower
+
+ROLE_LEVELS = ['role', 'templates', 'team', 'actualteam', 'seen', 'seenoracle', 'death', 'deathstats']
+
+def synthetic_gamemode(size):
+    # roughly the shape of default at 24 players, scaled up
+    role_counts = [('wolf', size // 8), ('werecrow', size // 24), ('wolf cub', size // 24), ('traitor', size // 24),
+                   ('seer', size // 24), ('shaman', size // 12), ('harlot', size // 24), ('hunter', size // 24),
+                   ('matchmaker', size // 24), ('crazed shaman', size // 24), ('cursed villager', size // 12), ('gunner', size // 12)]
+    return 'roles ' + ','.join('{}:{}'.format(role, max(1, count)) for role, count in role_counts)
+
+def gamemode_for(size):
+    if bot.gamemodes['default']['min_players'] <= size <= bot.gamemodes['default']['max_players']:
+        return 'default'
+    return synthetic_gamemode(size)
+
+async def make_roster(transport, size, seed):
+    random.seed(seed)
+    bot.session[0] = True
+    bot.session[1] = bot.PlayerDict()
+    for i in range(1, size + 1):
+        member = transport.server.get_member(str(i)) or transport.add_member(str(i), 'player{}'.format(i), '{:04d}'.format(i))
+        bot.session[1][member.id] = [True, '', '', [], []]
+    bot.session[2] = False
+    bot.session[6] = gamemode_for(size)
+    await bot.assign_roles(bot.session[6])
+    for player in bot.session[1]:
+        bot.session[1][player][2] = random.choice(list(bot.session[1]))
+
+async def measure(func, setup=None):
+    # func may return how many operations one call did (anything but an int counts as one), so cheap lookups
+    # can be batched without the timer overhead swamping them
+    ops = 0
+    elapsed = 0
+    calls = 0
+    while elapsed < BENCH_MIN_TIME or calls < BENCH_MIN_CALLS:
+        if setup:
+            setup()
+        start = time.perf_counter()
+        done = func()
+        if asyncio.iscoroutine(done):
+            done = await done
+        elapsed += time.perf_counter() - start
+        ops += done if type(done) is int else 1
+        calls += 1
+    peaks = []
+    tracemalloc.start()
+    for i in range(BENCH_ALLOC_SAMPLES):
+        if setup:
+            setup()
+        tracemalloc.clear_traces()
+        done = func()
+        if asyncio.iscoroutine(done):
+            done = await done
+        peaks.append(tracemalloc.get_traced_memory()[1] / (done if type(done) is int else 1))
+    tracemalloc.stop()
+    return {'ops_per_sec' : ops / elapsed, 'mean_us' : elapsed / ops * 10 ** 6, 'peak_alloc_bytes' : sorted(peaks)[len(peaks) // 2]}
+
+async def bench_size(transport, size, seed):
+    await make_roster(transport, size, seed)
+    players = list(bot.session[1])
+    names = [bot.get_name(x) for x in players]
+    saved = bot.GameSnapshot.dump()
+
+    def restore():
+        bot.GameSnapshot.load(saved)
+
+    def get_role():
+        for player in players:
+            for level in ROLE_LEVELS:
+                bot.get_role(player, level)
+        return len(players) * len(ROLE_LEVELS)
+
+    def get_player():
+        for player, name in zip(players, names):
+            bot.get_player(player)
+            bot.get_player(name)
+            bot.get_player(name[:len(name) - 1])
+        return len(players) * 3
+
+    vote_round = 0
+
+    def vote_refresh():
+        # every player moves their vote, like a day of lynch and retract commands, and the ledger follows each one
+        nonlocal vote_round
+        vote_round += 1
+        for i, player in enumerate(players):
+            bot.session[1][player][2] = players[(i + vote_round) % len(players)]
+            bot.vote_ledger.refresh(player)
+        return len(players)
+
+    def balance_roles():
+        bot.balance_roles(['wolf'] * size + ['seer'] * size + ['shaman'] * size, num_players=size)
+
+    async def assign_roles():
+        await bot.assign_roles(bot.session[6])
+
+    async def player_deaths():
+        await bot.player_deaths({random.choice(players) : ('lynch', 'village')})
+
+    results = {}
+    results['get_role'] = await measure(get_role)
+    results['get_player'] = await measure(get_player)
+    bot.vote_ledger.start()
+    results['vote_refresh'] = await measure(vote_refresh)
+    results['vote_dict'] = await measure(bot.vote_ledger.vote_dict)
+    bot.vote_ledger.stop()
+    restore()
+    results['win_condition'] = await measure(bot.win_condition)
+    results['end_game_stats'] = await measure(bot.end_game_stats)
+    results['balance_roles'] = await measure(balance_roles)
+    results['assign_roles'] = await measure(assign_roles, restore)
+    results['player_deaths'] = await measure(player_deaths, restore)
+    restore()
+    bot.session[0] = False
+    bot.session[1] = bot.PlayerDict()
+    await bot.flush_messages()
+    return results
+
+async def bench_game(transport, size, seed):
+    # one headless game with the heuristic agent; only cpu time counts, since the rest is waiting on phase timers
+    start = time.process_time()
+    result = await headless.HeadlessGame(transport, size, gamemode_for(size), rng=random.Random(seed),
+                                         agent=headless.HeuristicAgent(random.Random(seed))).play()
+    cpu = time.process_time() - start
+    cycles = max(1, result['nights'] if result else 1)
+    return {'ops_per_sec' : cycles / cpu, 'mean_us' : cpu / cycles * 10 ** 6, 'nights' : cycles}
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+async def run(sizes, seed, games):
+    transport = headless.install()
+    bot.MAX_PLAYERS = max(sizes + [bot.MAX_PLAYERS])
+    with redirect_stdout(io.StringIO()):
+        await bot.on_ready()
+    results = []
+    for size in sizes:
+        for name, numbers in (await bench_size(transport, size, seed)).items():
+            results.append(dict(name=name, players=size, **numbers))
+        if games:
+            with redirect_stdout(io.StringIO()):
+                numbers = await bench_game(transport, size, seed)
+            results.append(dict(name='night_day_cycle', players=size, **numbers))
+    return results
+
+def compare(results, old_results):
+    old = {(x['name'], x['players']) : x for x in old_results}
+    lines = []
+    for result in results:
+        key = (result['name'], result['players'])
+        if key in old:
+            ratio = old[key]['ops_per_sec'] / result['ops_per_sec']
+            flag = '  REGRESSION' if ratio > 1 + REGRESSION_THRESHOLD else ''
+            lines.append('{:<16} {:>5} {:>8.2f}x slower{}'.format(key[0], key[1], ratio, flag) if ratio >= 1 else\
+                         '{:<16} {:>5} {:>8.2f}x faster'.format(key[0], key[1], 1 / ratio))
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmarks the game's hot paths at several roster sizes.")
+    parser.add_argument('--sizes', nargs='+', type=int, default=[4, 12, 24, 100])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-games', action='store_true', help="skip the full night and day cycle")
+    parser.add_argument('--output', help="write the results to this json file")
+    parser.add_argument('--compare', help="json file from an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    results = asyncio.get_event_loop().run_until_complete(run(args.sizes, args.seed, not args.no_games))
+    for result in results:
+        print('{:<16} {:>5} {:>14.1f} ops/s {:>12.2f} us/op {:>10} B peak/op'.format(result['name'], result['players'], result['ops_per_sec'],
+              result['mean_us'], int(result.get('peak_alloc_bytes', 0))))
+    report = {'revision' : git_revision(), 'python' : platform.python_version(), 'time' : datetime.now().isoformat(), 'results' : results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            print()
+            print(compare(results, json.load(f)['results']))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -5,24 +5,290 @@ import os
 import random
 import traceback
 import sys
+import time
 from datetime import datetime, timedelta
 from io import BytesIO, StringIO
 from config import *
 from settings import *
 import json
+import heapq
 import urllib.request
-from collections import OrderedDict
+from collections import OrderedDict, Counter, deque
 from itertools import chain
+from bisect import bisect_left
+from transport import DiscordTransport
 
 ################## START INIT #####################
+PLAYER_FIELDS = ('alive', 'role', 'action', 'templates', 'other')
+SESSION_FIELDS = ('playing', 'players', 'day', 'phase_start', 'phase_elapsed', 'first_join', 'gamemode', 'original_roles')
+class FlagList(list):
+    # list of flag strings that also counts its entries and indexes "key:value" flags by key,
+    # so `in`, count() and lookups like all "lover:" values don't scan the list
+    __slots__ = ('_counts', '_keyed', 'version', '_owner')
+
+    def __init__(self, iterable=()):
+        list.__init__(self, iterable)
+        self.version = 0
+        self._owner = None
+        self._reindex()
+
+    def _changed(self):
+        self.version += 1
+        if self._owner is not None:
+            self._owner._touch()
+
+    def _reindex(self):
+        self._changed()
+        self._counts = {}
+        self._keyed = {}
+        for flag in self:
+            self._add(flag)
+
+    def _add(self, flag):
+        self._changed()
+        self._counts[flag] = self._counts.get(flag, 0) + 1
+        key, sep, value = str(flag).partition(':')
+        if sep:
+            self._keyed.setdefault(key, []).append(value)
+
+    def _discard(self, flag):
+        self._changed()
+        self._counts[flag] -= 1
+        if not self._counts[flag]:
+            del self._counts[flag]
+        key, sep, value = str(flag).partition(':')
+        if sep:
+            self._keyed[key].remove(value)
+            if not self._keyed[key]:
+                del self._keyed[key]
+
+    def values(self, key):
+        # values of all "key:value" flags, in order
+        return list(self._keyed.get(key, []))
+
+    def remove_prefix(self, key):
+        if key in self._keyed:
+            self[:] = [x for x in self if not str(x).startswith(key + ':')]
+
+    def remove_all(self, flag):
+        if flag in self._counts:
+            self[:] = [x for x in self if x != flag]
+
+    def age(self, expiring, aged):
+        # single pass for the sunrise transition: drops flags in `expiring` (or whose "key:" is in it) and
+        # replaces flags in `aged` with their next form, appended after the untouched flags
+        kept = []
+        added = []
+        for flag in self:
+            if flag in expiring or str(flag).partition(':')[0] + ':' in expiring:
+                continue
+            elif flag in aged:
+                added.extend(aged[flag])
+            else:
+                kept.append(flag)
+        self[:] = kept + added
+
+    def __contains__(self, flag):
+        return flag in self._counts
+
+    def count(self, flag):
+        return self._counts.get(flag, 0)
+
+    def append(self, flag):
+        list.append(self, flag)
+        self._add(flag)
+
+    def insert(self, index, flag):
+        list.insert(self, index, flag)
+        self._add(flag)
+
+    def extend(self, iterable):
+        for flag in iterable:
+            self.append(flag)
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    def remove(self, flag):
+        list.remove(self, flag)
+        self._discard(flag)
+
+    def pop(self, index=-1):
+        flag = list.pop(self, index)
+        self._discard(flag)
+        return flag
+
+    def clear(self):
+        list.clear(self)
+        self._reindex()
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._reindex()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._reindex()
+
+class PlayerState:
+    # [alive, role, action, templates, other]; indexable like the old list so existing code keeps working
+    __slots__ = ('_alive', '_role', 'action', '_templates', '_other', '_views', '_views_version', '_id', '_dirty')
+
+    def __init__(self, alive=True, role='', action='', templates=(), other=()):
+        self._views = None
+        self._id = None
+        self._dirty = None
+        self.alive = alive
+        self.role = role
+        self.action = action
+        self.templates = templates
+        self.other = other
+
+    def _touch(self):
+        # tells the PlayerDict holding this player that its alive/role/other flags changed
+        if self._dirty is not None:
+            self._dirty.add(self._id)
+
+    @property
+    def alive(self):
+        return self._alive
+
+    @alive.setter
+    def alive(self, value):
+        self._alive = value
+        self._touch()
+
+    @property
+    def role(self):
+        return self._role
+
+    @role.setter
+    def role(self, value):
+        self._role = value
+        self._views = None
+        self._touch()
+
+    @property
+    def templates(self):
+        return self._templates
+
+    @templates.setter
+    def templates(self, value):
+        self._templates = value if isinstance(value, FlagList) else FlagList(value)
+        self._views = None
+
+    def role_views(self):
+        # get_role() results for this player, thrown away whenever the role or templates change
+        if self._views is None or self._views_version != self._templates.version:
+            self._views = {}
+            self._views_version = self._templates.version
+        return self._views
+
+    @property
+    def other(self):
+        return self._other
+
+    @other.setter
+    def other(self, value):
+        self._other = value if isinstance(value, FlagList) else FlagList(value)
+        self._other._owner = self
+        self._touch()
+
+    @property
+    def lovers(self):
+        return self._other.values('lover')
+
+    @property
+    def assassinate_target(self):
+        return next(iter(self._other.values('assassinate')), None)
+
+    @property
+    def totem(self):
+        return next(iter(self._other.values('totem')), None)
+
+    @property
+    def execute_target(self):
+        return next(iter(self._other.values('execute')), None)
+
+    @property
+    def doom(self):
+        return next(iter(self._other.values('doom')), None)
+
+    def __getitem__(self, index):
+        return getattr(self, PLAYER_FIELDS[index])
+
+    def __setitem__(self, index, value):
+        setattr(self, PLAYER_FIELDS[index], value)
+
+    def __iter__(self):
+        return (getattr(self, x) for x in PLAYER_FIELDS)
+
+    def __len__(self):
+        return len(PLAYER_FIELDS)
+
+    def __repr__(self):
+        return repr(list(self))
+
+class PlayerDict(OrderedDict):
+    # wraps the [alive, role, action, templates, other] lists used by join/fjoin into PlayerState,
+    # and collects the ids of players that were added, removed or changed in `dirty`
+    def __init__(self, *args, **kwargs):
+        self.dirty = set()
+        self.roster_version = 0
+        OrderedDict.__init__(self, *args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if not isinstance(value, PlayerState):
+            value = PlayerState(*value)
+        self.roster_version += 1
+        value._id = key
+        value._dirty = self.dirty
+        self.dirty.add(key)
+        OrderedDict.__setitem__(self, key, value)
+
+    def __delitem__(self, key):
+        self[key]._dirty = None
+        self.dirty.add(key)
+        self.roster_version += 1
+        OrderedDict.__delitem__(self, key)
+
+class Session:
+    # [playing?, {players dict}, day?, [night start, day start], [night elapsed, day elapsed], first join, gamemode, {original roles amount}]
+    __slots__ = SESSION_FIELDS
+
+    def __init__(self, *values):
+        for index, value in enumerate(values):
+            self[index] = value
+
+    def __getitem__(self, index):
+        return getattr(self, SESSION_FIELDS[index])
+
+    def __setitem__(self, index, value):
+        if SESSION_FIELDS[index] == 'players' and not isinstance(value, PlayerDict):
+            value = PlayerDict(value)
+        setattr(self, SESSION_FIELDS[index], value)
+
+    def __iter__(self):
+        return (getattr(self, x) for x in SESSION_FIELDS)
+
+    def __len__(self):
+        return len(SESSION_FIELDS)
+
+    def __repr__(self):
+        return repr(list(self))
+
 client = discord.Client()
-# [playing?, {players dict}, day?, [night start, day start], [night elapsed, day elapsed], first join, gamemode, {original roles amount}]
-session = [False, OrderedDict(), False, [0, 0], [timedelta(0), timedelta(0)], 0, '', {}]
+transport = DiscordTransport(client, WEREWOLF_SERVER)
+session = Session(False, PlayerDict(), False, [0, 0], [timedelta(0), timedelta(0)], 0, '', {})
 PLAYERS_ROLE = None
 ADMINS_ROLE = None
 WEREWOLF_NOTIFY_ROLE = None
-ratelimit_dict = {}
+ratelimit_buckets = OrderedDict() # user id -> [tokens, time of last refill], least recently used first
+IGNORE_LIST = set(IGNORE_LIST)
 pingif_dict = {}
+last_activity = {} # player id -> time.monotonic() of their last message in the lobby channel this game
+idle_warned = {} # player id -> when they were warned for idling
 notify_me = []
 stasis = {}
 commands = {}
@@ -33,21 +299,136 @@ day_warning = DEFAULT_DAY_WARNING
 day_timeout = DEFAULT_DAY_TIMEOUT
 night_warning = DEFAULT_NIGHT_WARNING
 night_timeout = DEFAULT_NIGHT_TIMEOUT
+night = 1 # nights started this game, kept in the snapshot along with sunset_done and sunrise_done
+sunset_done = False # totems, dooms, charms and role info were handed out for the current night
+sunrise_done = False # injuries and dooms were settled and the current day announced
 
 MAX_MESSAGE_LEN = 2000
+# outbound message priorities, lowest goes first
+PRIORITY_PHASE = 0
+PRIORITY_GAME = 1
+PRIORITY_CHATTER = 2
+outboxes = {}
 
 faftergame = None
 starttime = None
-with open(NOTIFY_FILE, 'a+') as notify_file:
-    notify_file.seek(0)
-    notify_me = notify_file.read().split(',')
+# set whenever game state may have changed; the phase loops wait on it instead of polling
+phase_event = asyncio.Event()
+
+def _replace_file(filename, text):
+    # write to a temp file and rename over the original so a crash never leaves a half-written file
+    with open(filename + '.tmp', 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(filename + '.tmp', filename)
+
+def _append_journal(text):
+    with open(JOURNAL_FILE, 'a') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+class StateJournal:
+    # Stasis and notify changes are appended to JOURNAL_FILE as one json record per line, batched every
+    # JOURNAL_FLUSH_INTERVAL seconds off the event loop. compact() periodically folds them into NOTIFY_FILE
+    # and STASIS_FILE and empties the journal; at startup the journal is replayed on top of those files.
+    # Records hold the new value rather than a delta, so replaying one twice is harmless.
+    def __init__(self):
+        self.pending = []
+        # whether stasis or notify changed since the last compact
+        self.dirty = False
+        self.lock = asyncio.Lock()
+        self.worker = None
+
+    def put(self, kind, player, value):
+        self.pending.append(json.dumps({'type' : kind, 'id' : player, 'value' : value}) + '\n')
+        self.dirty = True
+        if not self.worker or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while self.pending:
+            await asyncio.sleep(JOURNAL_FLUSH_INTERVAL)
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            await self._write_pending()
+
+    async def _write_pending(self):
+        if self.pending:
+            text = ''.join(self.pending)
+            self.pending = []
+            await client.loop.run_in_executor(None, _append_journal, text)
+
+    async def compact(self):
+        async with self.lock:
+            if not self.dirty:
+                return False
+            self.dirty = False
+            await self._write_pending()
+            for player in [x for x in stasis if stasis[x] <= 0]:
+                del stasis[player]
+            notify_list = [x for x in notify_me if x != '']
+            await client.loop.run_in_executor(None, self._write_snapshot, notify_list, dict(stasis))
+            return True
+
+    @staticmethod
+    def _write_snapshot(notify_list, stasis_copy):
+        _replace_file(NOTIFY_FILE, ','.join(notify_list))
+        _replace_file(STASIS_FILE, json.dumps(stasis_copy))
+        _replace_file(JOURNAL_FILE, '')
+
+    @staticmethod
+    def replay():
+        if not os.path.isfile(JOURNAL_FILE):
+            return 0
+        count = 0
+        with open(JOURNAL_FILE, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # only the last line can be torn by a crash mid-write
+                    continue
+                if record['type'] == 'stasis':
+                    stasis[record['id']] = record['value']
+                elif record['type'] == 'notify':
+                    if record['value'] and record['id'] not in notify_me:
+                        notify_me.append(record['id'])
+                    elif not record['value'] and record['id'] in notify_me:
+                        notify_me.remove(record['id'])
+                count += 1
+        return count
+
+state_journal = StateJournal()
+
+def set_stasis(player, amount):
+    stasis[player] = amount
+    state_journal.put('stasis', player, amount)
+
+def add_stasis(player, amount):
+    set_stasis(player, stasis.get(player, 0) + amount)
+
+def set_notify(player, notify):
+    if notify and player not in notify_me:
+        notify_me.append(player)
+    elif not notify and player in notify_me:
+        notify_me.remove(player)
+    state_journal.put('notify', player, notify)
+
+if os.path.isfile(NOTIFY_FILE):
+    with open(NOTIFY_FILE, 'r') as notify_file:
+        notify_me = notify_file.read().split(',')
 
 if os.path.isfile(STASIS_FILE):
     with open(STASIS_FILE, 'r') as stasis_file:
         stasis = json.load(stasis_file)
-else:
-    with open(STASIS_FILE, 'a+') as stasis_file:
-        stasis_file.write('{}')
+
+if StateJournal.replay():
+    print("Replayed stasis/notify journal")
+    state_journal.dirty = True
 
 random.seed(datetime.now())
 
@@ -86,17 +467,17 @@ def cmd(name, perms, description, *aliases):
 async def on_ready():
     global starttime
     print('Logged in as')
-    print(client.user.name)
-    print(client.user.id)
+    print(transport.user.name)
+    print(transport.user.id)
     print('------')
     if starttime:
         await log(1, 'on_ready triggered again!')
         if PLAYING_MESSAGE:
-            await client.change_presence(status=discord.Status.online, game=discord.Game(name=PLAYING_MESSAGE))
+            await transport.change_presence(status=discord.Status.online, game=discord.Game(name=PLAYING_MESSAGE))
         return
     await log(1, 'on_ready triggered!')
     # [playing : True | False, players : {player id : [alive, role, action, template, other]}, day?, [datetime night, datetime day], [elapsed night, elapsed day], first join time, gamemode]
-    for role in client.get_server(WEREWOLF_SERVER).role_hierarchy:
+    for role in transport.server.role_hierarchy:
         if role.name == PLAYERS_ROLE_NAME:
             global PLAYERS_ROLE
             PLAYERS_ROLE = role
@@ -118,8 +499,10 @@ async def on_ready():
         await log(0, "Werewolf Notify role id: " + WEREWOLF_NOTIFY_ROLE.id)
     else:
         await log(2, "Could not find Werewolf Notify role " + WEREWOLF_NOTIFY_ROLE_NAME)
-    if PLAYING_MESSAGE:
-        await client.change_presence(status=discord.Status.online, game=discord.Game(name=PLAYING_MESSAGE))
+    if game_snapshot.restore():
+        client.loop.create_task(resume_game())
+    elif PLAYING_MESSAGE:
+        await transport.change_presence(status=discord.Status.online, game=discord.Game(name=PLAYING_MESSAGE))
     starttime = datetime.now()
 
 @client.event
@@ -131,14 +514,15 @@ async def on_resume():
 async def on_message(message):
     if not starttime:
         return
-    if message.author.id in [client.user.id] + IGNORE_LIST or not client.get_server(WEREWOLF_SERVER).get_member(message.author.id):
+    note_activity(message)
+    if message.author.id == transport.user.id or message.author.id in IGNORE_LIST or not transport.server.get_member(message.author.id):
         if not (message.author.id in ADMINS or message.author.id == OWNER_ID):
             return
     if await rate_limit(message):
         return
 
     if message.channel.is_private:
-        await log(0, 'pm from ' + message.author.name + ' (' + message.author.id + '): ' + message.content)
+        await log(0, "pm from {} ({}): {}", message.author.name, message.author.id, message.content, user=message.author.id)
         if session[0] and message.author.id in session[1]:
             if session[1][message.author.id][1] in WOLFCHAT_ROLES and session[1][message.author.id][0]:
                 if not message.content.strip().startswith(BOT_PREFIX):
@@ -155,11 +539,17 @@ async def on_message(message):
         parameters = ' '.join(message.content.strip().lower().split(' ')[1:])
         await parse_command(command, message, parameters)
 
+@client.event
+async def on_member_update(before, after):
+    if after.id in session[1] and (before.name, before.display_name, before.discriminator) != (after.name, after.display_name, after.discriminator):
+        player_index.invalidate()
+
 @client.event
 async def on_member_remove(member):
     member_id = member.id
     member_name = member.name
     if member_id in session[1]:
+        player_index.invalidate()
         leave_msg = ""
         if session[0] and session[1][member_id][0]:
             await player_deaths({member_id: ('fleave', "bot")})
@@ -167,10 +557,7 @@ async def on_member_remove(member):
                 leave_msg += "**" + member_name + "** left the server. Farewell.\n"
             else:
                 leave_msg += "**" + member_name + "** left the server. Farewell **" + get_role(member_id, 'death') + "**.\n"
-            if member_id in stasis:
-                stasis[member_id] += QUIT_GAME_STASIS
-            else:
-                stasis[member_id] = QUIT_GAME_STASIS
+            add_stasis(member_id, QUIT_GAME_STASIS)
             await send_lobby(leave_msg)
             await log(2, "{} ({}) was FLEAVED for leaving the server IN GAME".format(member_name, member_id))
             if win_condition() == None:
@@ -181,7 +568,7 @@ async def on_member_remove(member):
             await send_lobby(leave_msg)
             await log(2, "{} ({}) was FLEAVED for leaving the server OUT OF GAME".format(member_name, member_id))
         if len(session[1]) == 0:
-            await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.online)
+            await transport.change_presence(game=transport.server.me.game, status=discord.Status.online)
 
 ############# COMMANDS #############
 @cmd('shutdown', [2, 2], "```\n{0}shutdown takes no arguments\n\nShuts down the bot. Owner-only.```")
@@ -193,12 +580,16 @@ async def cmd_shutdown(message, parameters):
     elif parameters.startswith("-fleave"):
         await cmd_fleave(message, 'all')
     await reply(message, "Shutting down...")
+    await flush_messages()
+    await game_snapshot.save()
+    await backup_settings()
+    await flush_log()
     await client.logout()
 
 @cmd('ping', [0, 0], "```\n{0}ping takes no arguments\n\nTests the bot\'s responsiveness.```")
 async def cmd_ping(message, parameters):
     msg = random.choice(lang['ping']).format(
-        bot_nick=client.user.display_name, author=message.author.name, p=BOT_PREFIX)
+        bot_nick=transport.user.display_name, author=message.author.name, p=BOT_PREFIX)
     await reply(message, msg)
 
 @cmd('eval', [2, 2], "```\n{0}eval <evaluation string>\n\nEvaluates <evaluation string> using Python\'s eval() function and returns a result. Owner-only.```")
@@ -236,7 +627,7 @@ async def cmd_exec(message, parameters):
     output = str(redirected_output.getvalue())
     if output == '':
         output = ":thumbsup:"
-    await client.send_message(message.channel, output)
+    await transport.send_message(message.channel, output)
 
 @cmd('async', [2, 2], "```\n{0}async <code>\n\nExecutes <code> as a coroutine.```")
 async def cmd_async(message, parameters, recursion=0):
@@ -275,7 +666,7 @@ async def cmd_async(message, parameters, recursion=0):
             result = traceback.format_exc()
     finally:
         sys.stdout = old_stdout
-    await client.send_message(message.channel, "```py\n{}\n```".format(result))
+    await transport.send_message(message.channel, "```py\n{}\n```".format(result))
 
 @cmd('help', [0, 0], "```\n{0}help <command>\n\nReturns hopefully helpful information on <command>. Try {0}list for a listing of commands.```")
 async def cmd_help(message, parameters):
@@ -320,32 +711,31 @@ async def cmd_join(message, parameters):
             wait_timer = datetime.now() + timedelta(seconds=WAIT_AFTER_JOIN)
             client.loop.create_task(game_start_timeout_loop())
             client.loop.create_task(wait_timer_loop())
-            await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.idle)
+            await transport.change_presence(game=transport.server.me.game, status=discord.Status.idle)
             await send_lobby(random.choice(lang['gamestart']).format(
                                             message.author.name, p=BOT_PREFIX))
         else:
-            await client.send_message(message.channel, "**{}** joined the game and raised the number of players to **{}**.".format(
+            await transport.send_message(message.channel, "**{}** joined the game and raised the number of players to **{}**.".format(
                                                         message.author.name, len(session[1])))
         if parameters:
             await cmd_vote(message, parameters)
         #                            alive, role, action, [templates], [other]
-        await client.add_roles(client.get_server(WEREWOLF_SERVER).get_member(message.author.id), PLAYERS_ROLE)
+        await transport.add_roles(transport.server.get_member(message.author.id), PLAYERS_ROLE)
         wait_timer = datetime.now() + timedelta(seconds=WAIT_AFTER_JOIN)
-        client.loop.create_task(player_idle(message))
 
 @cmd('leave', [0, 1], "```\n{0}leave takes no arguments\n\nLeaves the current game. If you need to leave, please do it before the game starts.```", 'q')
 async def cmd_leave(message, parameters):
     if session[0] and message.author.id in session[1] and session[1][message.author.id][0]:
         if parameters != '-force':
-            msg = await client.send_message(message.channel, "Are you sure you want to quit during game? Doing "
+            msg = await transport.send_message(message.channel, "Are you sure you want to quit during game? Doing "
                                                              "so will result in {} games of stasis. You may bypass "
                                                              "this confirmation by using `{}leave -force`.".format(
                                                                  QUIT_GAME_STASIS, BOT_PREFIX))
             def check(m):
                 c = m.content.lower()
                 return c in ['yes', 'y', 'no', 'n']
-            response = await client.wait_for_message(author=message.author, channel=message.channel, timeout=5, check=check)
-            await client.delete_message(msg)
+            response = await transport.wait_for_message(author=message.author, channel=message.channel, timeout=5, check=check)
+            await transport.delete_message(msg)
             if not response or response.content.lower() not in ['yes', 'y']:
                 return
         if not session[1][message.author.id][0]:
@@ -357,10 +747,7 @@ async def cmd_leave(message, parameters):
             await send_lobby(random.choice(lang['leavedeath']).format(
                 message.author.name, get_role(message.author.id, 'death')))
         await player_deaths({message.author.id : ('leave', "bot")})
-        if message.author.id in stasis:
-            stasis[message.author.id] += QUIT_GAME_STASIS
-        else:
-            stasis[message.author.id] = QUIT_GAME_STASIS
+        add_stasis(message.author.id, QUIT_GAME_STASIS)
         if session[0] and win_condition() == None:
             await check_traitor()
         await log(1, "{} ({}) QUIT DURING GAME".format(message.author.display_name, message.author.id))
@@ -372,7 +759,7 @@ async def cmd_leave(message, parameters):
             await player_deaths({message.author.id : ('leave', "bot")})
             await send_lobby(random.choice(lang['leavelobby']).format(message.author.name, len(session[1])))
             if len(session[1]) == 0:
-                await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.online)
+                await transport.change_presence(game=transport.server.me.game, status=discord.Status.online)
         else:
             await reply(message, random.choice(lang['notplayingleave']))
 
@@ -414,12 +801,12 @@ async def cmd_fjoin(message, parameters):
     for member in sort_players(join_list):
         session[1][member] = [True, '', '', [], []]
         join_msg += "**" + get_name(member) + "** was forced to join the game.\n"
-        if client.get_server(WEREWOLF_SERVER).get_member(member):
-            await client.add_roles(client.get_server(WEREWOLF_SERVER).get_member(member), PLAYERS_ROLE)
+        if transport.server.get_member(member):
+            await transport.add_roles(transport.server.get_member(member), PLAYERS_ROLE)
     join_msg += "New player count: **{}**".format(len(session[1]))
     if len(session[1]) > 0:
-        await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.idle)
-    await client.send_message(message.channel, join_msg)
+        await transport.change_presence(game=transport.server.me.game, status=discord.Status.idle)
+    await transport.send_message(message.channel, join_msg)
     await log(2, "{0} ({1}) used FJOIN {2}".format(message.author.name, message.author.id, parameters))
 
 @cmd('fleave', [1, 1], "```\n{0}fleave <mentions of users | all>\n\nForces each <mention> to leave the game. If the parameter is all, removes all players from the game.```")
@@ -465,7 +852,7 @@ async def cmd_fleave(message, parameters):
     if session[0] and win_condition() == None:
         await check_traitor()
     if len(session[1]) == 0:
-        await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.online)
+        await transport.change_presence(game=transport.server.me.game, status=discord.Status.online)
 
 @cmd('refresh', [1, 1], "```\n{0}refresh [<language file>]\n\nRefreshes the current language's language file from GitHub. Admin only.```")
 async def cmd_refresh(message, parameters):
@@ -533,9 +920,13 @@ async def cmd_fstop(message, parameters):
             return
         msg += ". Here is some debugging info:\n```py\n{0}\n```".format(str(session))
         session[0] = False
-        perms = client.get_channel(GAME_CHANNEL).overwrites_for(client.get_server(WEREWOLF_SERVER).default_role)
+        vote_ledger.stop()
+        scheduler.cancel('game')
+        phase_bus.clear()
+        await game_snapshot.clear()
+        perms = transport.get_channel(GAME_CHANNEL).overwrites_for(transport.server.default_role)
         perms.send_messages = True
-        await client.edit_channel_permissions(client.get_channel(GAME_CHANNEL), client.get_server(WEREWOLF_SERVER).default_role, perms)
+        await transport.edit_channel_permissions(transport.get_channel(GAME_CHANNEL), transport.server.default_role, perms)
         session[3] = [datetime.now(), datetime.now()]
         session[4] = [timedelta(0), timedelta(0)]
         session[6] = ''
@@ -558,46 +949,44 @@ async def cmd_fstop(message, parameters):
 
 @cmd('sync', [1, 1], "```\n{0}sync takes no arguments\n\nSynchronizes all player roles and channel permissions with session.```")
 async def cmd_sync(message, parameters):
-    for member in client.get_server(WEREWOLF_SERVER).members:
-        if member.id in session[1] and session[1][member.id][0]:
-            if not PLAYERS_ROLE in member.roles:
-                await client.add_roles(member, PLAYERS_ROLE)
-        else:
-            if PLAYERS_ROLE in member.roles:
-                await client.remove_roles(member, PLAYERS_ROLE)
-    perms = client.get_channel(GAME_CHANNEL).overwrites_for(client.get_server(WEREWOLF_SERVER).default_role)
+    added, removed, changed = await sync_players_role()
+    perms = transport.get_channel(GAME_CHANNEL).overwrites_for(transport.server.default_role)
     if session[0]:
         perms.send_messages = False
     else:
         perms.send_messages = True
-    await client.edit_channel_permissions(client.get_channel(GAME_CHANNEL), client.get_server(WEREWOLF_SERVER).default_role, perms)
-    await log(2, "{0} ({1}) SYNC".format(message.author.name, message.author.id))
-    await reply(message, "Sync successful.")
+    await transport.edit_channel_permissions(transport.get_channel(GAME_CHANNEL), transport.server.default_role, perms)
+    await log(2, "{0} ({1}) SYNC: {2} added, {3} removed, {4} failed".format(message.author.name, message.author.id, added, removed,
+              added + removed - changed))
+    if changed < added + removed:
+        await reply(message, "Sync finished, but {} of {} role changes failed. Check the log.".format(added + removed - changed, added + removed))
+    else:
+        await reply(message, "Sync successful: {} given and {} removed the {} role.".format(added, removed, PLAYERS_ROLE_NAME))
 
 @cmd('op', [1, 1], "```\n{0}op takes no arguments\n\nOps yourself if you are an admin```")
 async def cmd_op(message, parameters):
     await log(2, "{0} ({1}) OP {2}".format(message.author.name, message.author.id, parameters))
     if parameters == "":
-        await client.add_roles(client.get_server(WEREWOLF_SERVER).get_member(message.author.id), ADMINS_ROLE)
+        await transport.add_roles(transport.server.get_member(message.author.id), ADMINS_ROLE)
         await reply(message, ":thumbsup:")
     else:
-        member = client.get_server(WEREWOLF_SERVER).get_member(parameters.strip("<!@>"))
+        member = transport.server.get_member(parameters.strip("<!@>"))
         if member:
             if member.id in ADMINS:
-                await client.add_roles(member, ADMINS_ROLE)
+                await transport.add_roles(member, ADMINS_ROLE)
                 await reply(message, ":thumbsup:")
 
 @cmd('deop', [1, 1], "```\n{0}deop takes no arguments\n\nDeops yourself so you can play with the players ;)```")
 async def cmd_deop(message, parameters):
     await log(2, "{0} ({1}) DEOP {2}".format(message.author.name, message.author.id, parameters))
     if parameters == "":
-        await client.remove_roles(client.get_server(WEREWOLF_SERVER).get_member(message.author.id), ADMINS_ROLE)
+        await transport.remove_roles(transport.server.get_member(message.author.id), ADMINS_ROLE)
         await reply(message, ":thumbsup:")
     else:
-        member = client.get_server(WEREWOLF_SERVER).get_member(parameters.strip("<!@>"))
+        member = transport.server.get_member(parameters.strip("<!@>"))
         if member:
             if member.id in ADMINS:
-                await client.remove_roles(member, ADMINS_ROLE)
+                await transport.remove_roles(member, ADMINS_ROLE)
                 await reply(message, ":thumbsup:")
 
 @cmd('role', [0, 0], "```\n{0}role [<role | number of players | gamemode>] [<number of players>]\n\nIf a <role> is given, "
@@ -720,14 +1109,14 @@ async def cmd_role(message, parameters):
 
 async def _send_role_info(player, sendrole=True):
     if session[0] and player in session[1]:
-        member = client.get_server(WEREWOLF_SERVER).get_member(player)
+        member = transport.server.get_member(player)
         if member and session[1][player][0]:
             role = get_role(player, 'role') if get_role(player, 'role') not in ['amnesiac', 'vengeful ghost', 'time lord'] else "villager"
             templates = get_role(player, 'templates')
             if member and session[1][player][0]:
                 try:
                     if sendrole:
-                        await client.send_message(member, "Your role is **" + role + "**. " + roles[role][2] + '\n')
+                        await transport.send_message(member, "Your role is **" + role + "**. " + roles[role][2] + '\n')
                     msg = []
                     living_players = [x for x in session[1] if session[1][x][0]]
                     living_players_string = ['{} ({})'.format(get_name(x), x) for x in living_players]
@@ -771,8 +1160,8 @@ async def _send_role_info(player, sendrole=True):
                             living_players_string.append("{} ({}){}".format(get_name(plr), plr,
                             ' ({})'.format(' '.join(role_string)) if role_string else ''))
                     if role == 'executioner':
-                        if [x for x in session[1][player][4] if x.startswith('execute:')]:
-                            exe_target = [x for x in session[1][player][4] if x.startswith('execute:')][0].strip('execute:')
+                        if session[1][player][4].values('execute'):
+                            exe_target = session[1][player][4].values('execute')[0]
                             if 'win' in session[1][player][4]:
                                 msg.append('Your target was **{}**. This player was lynched, so you won.'.format(get_name(exe_target)))
                             else:
@@ -785,10 +1174,10 @@ async def _send_role_info(player, sendrole=True):
                             else:
                                 session[1][player][1] = 'jester'
                                 session[1][player][4].append('executioner')
-                                member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                                member = transport.server.get_member(player)
                                 if member:
                                     try:
-                                        await client.send_message(member, 'There are no available targets. You have now become a **jester**.')
+                                        await transport.send_message(member, 'There are no available targets. You have now become a **jester**.')
                                         await _send_role_info(player)
                                     except discord.Forbidden:
                                         pass
@@ -797,8 +1186,8 @@ async def _send_role_info(player, sendrole=True):
                         totem = ''
                         if session[1][player][2] in totems:
                             totem = session[1][player][2]
-                        elif [x for x in session[1][player][4] if x.startswith("totem:")]:
-                            totem = [x.split(':')[1] for x in session[1][player][4] if x.startswith("totem:")].pop()
+                        elif session[1][player][4].values('totem'):
+                            totem = session[1][player][4].values('totem').pop()
                         if totem:
                             msg.append("You have the **{}**. {}\n".format(totem.replace('_', ' '), totems[totem]))
                     if role in ['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'werekitten', 'wolf shaman', 'wolf mystic', 'traitor', 'sorcerer', 'seer',
@@ -814,9 +1203,9 @@ async def _send_role_info(player, sendrole=True):
                         try:
                             if member:
                                 if "silence_totem2" in session[1][player][4]:
-                                    await client.send_message(member, "You are silenced and unable to sense anything of significance.".format(wolfcount))
+                                    await transport.send_message(member, "You are silenced and unable to sense anything of significance.".format(wolfcount))
                                 else:
-                                    await client.send_message(member, "You sense that there are **{}** wolves.".format(wolfcount))
+                                    await transport.send_message(member, "You sense that there are **{}** wolves.".format(wolfcount))
                         except discord.Forbidden:
                             pass
                     if role == 'wolf mystic':
@@ -827,14 +1216,14 @@ async def _send_role_info(player, sendrole=True):
                         try:
                             if member:
                                 if "silence_totem2" in session[1][player][4]:
-                                    await client.send_message(member, "You are silenced and unable to sense anything of significance.".format(wolfcount))
+                                    await transport.send_message(member, "You are silenced and unable to sense anything of significance.".format(wolfcount))
                                 else:
-                                    await client.send_message(member, "You sense that there are **{}** villagers.".format(vilcount))
+                                    await transport.send_message(member, "You sense that there are **{}** villagers.".format(vilcount))
                         except discord.Forbidden:
                             pass
                     #turncoat being told when they can turn
                     if role == 'turncoat' and 'sided2' not in session[1][player][4]:
-                        await client.send_message(member, "You can switch sides tonight.")
+                        await transport.send_message(member, "You can switch sides tonight.")
                     if 'gunner' in templates:
                         msg.append("You have a gun and **{}** bullet{}. Use the command "
                                    "`{}role gunner` for more information.".format(
@@ -863,18 +1252,18 @@ async def _send_role_info(player, sendrole=True):
                     if role == 'minion' and str(session[4][1]) == "0:00:00":
                         msg.append("Living players: ```basic\n" + '\n'.join(living_players_string) + '\n```')
                     if msg:
-                        await client.send_message(member, '\n'.join(msg))
+                        await transport.send_message(member, '\n'.join(msg))
                 except discord.Forbidden:
                     await send_lobby(member.mention + ", you cannot play the game if you block me")
-        elif member and get_role(player, 'role') == 'vengeful ghost' and [x for x in session[1][player][4] if x.startswith("vengeance:")]:
+        elif member and get_role(player, 'role') == 'vengeful ghost' and session[1][player][4].values('vengeance'):
             try:
                 against = 'wolf'
-                if [x for x in session[1][player][4] if x.startswith("vengeance:")]:
-                    against = [x.split(':')[1] for x in session[1][player][4] if x.startswith('vengeance:')].pop()
-                await client.send_message(member, "You are a **vengeful ghost**, sworn to take revenge on the {0} that you believe killed you. You must kill one of them with `kill <player>` tonight. If you do not, one of them will be selected at random.".format('wolves' if against == 'wolf' else 'villagers'))
+                if session[1][player][4].values('vengeance'):
+                    against = session[1][player][4].values('vengeance').pop()
+                await transport.send_message(member, "You are a **vengeful ghost**, sworn to take revenge on the {0} that you believe killed you. You must kill one of them with `kill <player>` tonight. If you do not, one of them will be selected at random.".format('wolves' if against == 'wolf' else 'villagers'))
                 living_players = [x for x in session[1] if session[1][x][0] if roles[get_role(x, "role")][0] == against]
                 living_players_string = ['{} ({})'.format(get_name(x), x) for x in living_players]
-                await client.send_message(member, "Living players: ```basic\n" + '\n'.join(living_players_string) + '\n```')
+                await transport.send_message(member, "Living players: ```basic\n" + '\n'.join(living_players_string) + '\n```')
             except discord.Forbidden:
                 pass
         
@@ -911,8 +1300,8 @@ async def cmd_stats(message, parameters):
             # [min, max] for traitor and similar roles
         for player in session[1]:
             # Get maximum numbers for all roles
-            role_dict[get_role(player, 'role') if not [x for x in session[1][player][4] if x.startswith('turned:')] else [x for x in session[1][player][4] if x.startswith('turned:')].pop().split(':')[1]][0] += 1
-            role_dict[get_role(player, 'role') if not [x for x in session[1][player][4] if x.startswith('turned:')] else [x for x in session[1][player][4] if x.startswith('turned:')].pop().split(':')[1]][1] += 1
+            role_dict[get_role(player, 'role') if not session[1][player][4].values('turned') else session[1][player][4].values('turned').pop()][0] += 1
+            role_dict[get_role(player, 'role') if not session[1][player][4].values('turned') else session[1][player][4].values('turned').pop()][1] += 1
             if get_role(player, 'role') in ['villager', 'traitor'] or 'turned:villager' in session[1][player][4]:
                 traitorvill += 1
                 
@@ -966,7 +1355,7 @@ async def cmd_stats(message, parameters):
                     role_dict[reveal][1] = max(0, role_dict[reveal][1] - 1)
             
         for clone in session[1]:
-            if [x for x in session[1][clone][4] if x.startswith('clone:')]:
+            if session[1][clone][4].values('clone'):
                 role = get_role(clone, 'role')
                 if (not session[1][clone][0] and role != 'clone' and orig_roles[role] > 1 and role_dict[role] != 0) or (session[1][clone][0] and role != 'clone'):
                     #first part - if the clone's dead but whether or not the corpse is them or a real their role, call them alive
@@ -1008,9 +1397,9 @@ async def cmd_stats(message, parameters):
         players = ["{} ({})".format(get_name(x), x) for x in session[1]]
         num_players = len(session[1])
         if num_players == 0:
-            await client.send_message(message.channel, "There is currently no active game. Try {}join to start a new game!".format(BOT_PREFIX))
+            await transport.send_message(message.channel, "There is currently no active game. Try {}join to start a new game!".format(BOT_PREFIX))
         else:
-            await client.send_message(message.channel, "{} players in lobby: ```\n{}\n```".format(num_players, '\n'.join(players)))
+            await transport.send_message(message.channel, "{} players in lobby: ```\n{}\n```".format(num_players, '\n'.join(players)))
 
 @cmd('revealroles', [1, 1], "```\n{0}revealroles takes no arguments\n\nDisplays what each user's roles are and sends it in pm.```", 'rr')
 async def cmd_revealroles(message, parameters):
@@ -1020,7 +1409,7 @@ async def cmd_revealroles(message, parameters):
             '+' if session[1][player][0] else '-', get_name(player), player, get_role(player, 'actual'),
             session[1][player][2], ' '.join(session[1][player][4])))
     msg.append("```")
-    await client.send_message(message.channel, '\n'.join(msg))
+    await transport.send_message(message.channel, '\n'.join(msg))
     await log(2, "{0} ({1}) REVEALROLES".format(message.author.name, message.author.id))
 
 @cmd('see', [2, 0], "```\n{0}see <player>\n\nIf you are a seer, uses your power to detect <player>'s role. If you are a doomsayer, dooms <player> with either sickness, lycanthropy or death.```")
@@ -1036,7 +1425,7 @@ async def cmd_see(message, parameters):
     if "silence_totem2" in session[1][message.author.id][4]:
         await reply(message, "You have been silenced, and are unable to use any special powers.")
         return
-    if (session[1][message.author.id][2] and role != 'doomsayer') or (role == 'doomsayer' and not [x for x in session[1][message.author.id][4] if x.startswith('doom:')]):
+    if (session[1][message.author.id][2] and role != 'doomsayer') or (role == 'doomsayer' and not session[1][message.author.id][4].values('doom')):
         await reply(message, "You have already used your power.")
         return
     else:
@@ -1080,7 +1469,7 @@ async def cmd_see(message, parameters):
                         elif role == 'augur':
                             seen_role = get_role(player, 'actualteam')
                             if get_role(player, 'role') == 'amnesiac':
-                                seen_role = roles[[x.split(':')[1].replace("_", " ") for x in session[1][player][4] if x.startswith("role:")].pop()][1]
+                                seen_role = roles[[x.replace("_", " ") for x in session[1][player][4].values('role')].pop()][1]
                             reply_msg = "exudes a **{}** aura".format(
                                 'red' if seen_role == 'wolf' else 'blue' if seen_role == 'village' else 'grey')
                         await reply(message, "You have a vision... in your vision you see that **{}** {}!".format(
@@ -1105,8 +1494,8 @@ async def cmd_see(message, parameters):
                         elif 'luck_totem2' in session[1][player][4]:
                             player = misdirect(player, alive_players=[x for x in session[1] if session[1][x][0] and x != message.author.id and get_role(x, 'role') not in WOLFCHAT_ROLES and not (get_role(x, 'role') == 'succubus' and 'entranced' in session[1][message.author.id][4])])
                     doom = 'lycan'
-                    if [x for x in session[1][message.author.id][4] if x.startswith('doom:')]:
-                        doom = [x.split(':')[1] for x in session[1][message.author.id][4] if x.startswith('doom:')].pop()
+                    if session[1][message.author.id][4].values('doom'):
+                        doom = session[1][message.author.id][4].values('doom').pop()
                     if doom == 'lycan':
                         await reply(message, "You have a vision that **{0}** is transforming into a savage beast tomorrow night.".format(get_name(player)))
                         session[1][player][4].append('lycanthropy')
@@ -1159,10 +1548,10 @@ async def cmd_bless(message, parameters):
                         player = misdirect(player, alive_players=[x for x in session[1] if session[1][x][0] and x != message.author.id and not (get_role(x, 'role') == 'succubus' and 'entranced' in session[1][message.author.id][4])])
                     await reply(message, "You have given a blessing to **{0}**.".format(get_name(player)))
                     session[1][player][3].append('blessed')
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if member:
                         try:
-                            await client.send_message(member, "You suddenly feel very safe.")
+                            await transport.send_message(member, "You suddenly feel very safe.")
                         except discord.Forbidden:
                             pass
                     await log(1, "{} ({}) BLESS {} ({})".format(get_name(message.author.id), message.author.id,
@@ -1200,6 +1589,7 @@ async def cmd_consecrate(message, parameters):
                     session[1][message.author.id][4].append('consecrated')
                     session[1][message.author.id][4].append('injured')
                     session[1][message.author.id][2] = ''
+                    vote_ledger.refresh(message.author.id)
                     await log(1, "{} ({}) CONSECRATE {} ({})".format(get_name(message.author.id), message.author.id,
                         get_name(player), player))
 
@@ -1239,7 +1629,8 @@ async def cmd_hex(message, parameters):
                     await reply(message, "You have cast a hex on **{0}**.".format(get_name(player)))
                     await wolfchat("**{0}** has cast a hex on **{1}**.".format(get_name(message.author.id), get_name(player)))
                     session[1][message.author.id][2] = player
-                    session[1][message.author.id][4] = [x for x in session[1][message.author.id][4] if not x.startswith('lasttarget:')] + ['lasttarget:{}'.format(player)]
+                    session[1][message.author.id][4].remove_prefix('lasttarget')
+                    session[1][message.author.id][4].append('lasttarget:{}'.format(player))
                     await log(1, "{} ({}) HEX {} ({})".format(get_name(message.author.id), message.author.id,
                         get_name(player), player))
 
@@ -1299,16 +1690,16 @@ async def cmd_choose(message, parameters):
                 await log(1, "{} ({}) CHOOSE {} ({}) AND {} ({})".format(get_name(message.author.id), message.author.id,
                     get_name(player1), player1, get_name(player2), player2))
                 love_msg = "You are in love with **{}**. If that player dies for any reason, the pain will be too much for you to bear and you will commit suicide."
-                member1 = client.get_server(WEREWOLF_SERVER).get_member(player1)
-                member2 = client.get_server(WEREWOLF_SERVER).get_member(player2)
+                member1 = transport.server.get_member(player1)
+                member2 = transport.server.get_member(player2)
                 if member1:
                     try:
-                        await client.send_message(member1, love_msg.format(get_name(player2)))
+                        await transport.send_message(member1, love_msg.format(get_name(player2)))
                     except discord.Forbidden:
                         pass
                 if member2:
                     try:
-                        await client.send_message(member2, love_msg.format(get_name(player1)))
+                        await transport.send_message(member2, love_msg.format(get_name(player1)))
                     except discord.Forbidden:
                         pass
             else:
@@ -1343,7 +1734,7 @@ async def cmd_kill(message, parameters):
     if not session[0] or message.author.id not in session[1] or get_role(message.author.id, 'role') not in COMMANDS_FOR_ROLE['kill']:
         return
     if get_role(message.author.id, 'role') == "vengeful ghost":
-        if session[1][message.author.id][0] or not [x for x in session[1][message.author.id][4] if x.startswith("vengeance:")]:
+        if session[1][message.author.id][0] or not session[1][message.author.id][4].values('vengeance'):
             return
     if session[2]:
         await reply(message, "You may only kill someone during the night.")
@@ -1470,8 +1861,8 @@ async def cmd_kill(message, parameters):
                     return
                 player = get_player(parameters)
                 against = 'wolf'
-                if [x for x in session[1][message.author.id][4] if x.startswith("vengeance:")]:
-                    against = [x.split(":")[1] for x in session[1][message.author.id][4] if x.startswith("vengeance:")].pop()
+                if session[1][message.author.id][4].values('vengeance'):
+                    against = session[1][message.author.id][4].values('vengeance').pop()
                 if player:
                     if player == message.author.id:
                         return
@@ -1527,7 +1918,7 @@ async def cmd_lynch(message, parameters):
             return
         if 'illness' in session[1][message.author.id][4]:
             try:
-                await client.send_message(message.author, "You are staying home due to your illness and cannot participate in the vote.")
+                await transport.send_message(message.author, "You are staying home due to your illness and cannot participate in the vote.")
             except discord.Forbidden:
                 pass
             return
@@ -1542,12 +1933,13 @@ async def cmd_lynch(message, parameters):
                 await reply(message, "Player **" + get_name(to_lynch) + "** is dead!")
             else:
                 session[1][message.author.id][2] = to_lynch
+                vote_ledger.refresh(message.author.id)
                 await reply(message, "You have voted to lynch **" + get_name(to_lynch) + "**.")
-                vote_list = list(chain.from_iterable([[int(i.split(':')[1]) for i in session[1][x][4] if i.startswith("vote:")] for x in session[1]]))
+                vote_list = list(chain.from_iterable([[int(i) for i in session[1][x][4].values('vote')] for x in session[1]]))
                 if len(vote_list) == 0:
                     session[1][message.author.id][4].append("vote:1")
                 else:
-                    session[1][message.author.id][4] = [x for x in session[1][message.author.id][4] if not x.startswith('vote:')]
+                    session[1][message.author.id][4].remove_prefix('vote')
                     session[1][message.author.id][4].append("vote:{}".format(max(vote_list) + 1))
                 await log(1, "{0} ({1}) LYNCH {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(to_lynch), to_lynch))
         else:
@@ -1589,7 +1981,7 @@ async def cmd_votes(message, parameters):
             len(alive_players), len(able_voters) // 2 + 1, len(able_voters), len(abstainers), '' if len(abstainers) == 1 else 's')
 
         if len(vote_dict) == 1 and vote_dict['abstain'] == []:
-            reply_msg += "No one has cast a vote yet. Do `{}lynch <player>` in #{} to lynch <player>. ".format(BOT_PREFIX, client.get_channel(GAME_CHANNEL).name)
+            reply_msg += "No one has cast a vote yet. Do `{}lynch <player>` in #{} to lynch <player>. ".format(BOT_PREFIX, transport.get_channel(GAME_CHANNEL).name)
         else:
             reply_msg += "Current votes: ```\n"
             for voted in [x for x in vote_dict if x != 'abstain']:
@@ -1619,13 +2011,14 @@ async def cmd_retract(message, parameters):
         session[1][message.author.id][2] = ''
         session[1][message.author.id][1] = ''
         await reply(message, "You retracted your vote.")
-        session[1][message.author.id][4] = [x for x in session[1][message.author.id][4] if not x.startswith("vote:")]
+        session[1][message.author.id][4].remove_prefix('vote')
     elif session[0] and session[1][message.author.id][0]:
         if session[2]:
             if message.channel.is_private:
                 await reply(message, "Please use retract in channel.")
                 return
             session[1][message.author.id][2] = ''
+            vote_ledger.refresh(message.author.id)
             await reply(message, "You retracted your vote.")
             await log(1, "{0} ({1}) RETRACT VOTE".format(get_name(message.author.id), message.author.id))
         else:
@@ -1636,7 +2029,7 @@ async def cmd_retract(message, parameters):
                     # Sent in public channel 
                     if not message.channel.is_private:
                         try:
-                            await client.send_message(message.author, "Please use retract in pm.")
+                            await transport.send_message(message.author, "Please use retract in pm.")
                         except discord.Forbidden:
                             pass
                         return
@@ -1662,6 +2055,7 @@ async def cmd_abstain(message, parameters):
         await reply(message, "You are injured and unable to vote.")
         return
     session[1][message.author.id][2] = 'abstain'
+    vote_ledger.refresh(message.author.id)
     await log(1, "{0} ({1}) ABSTAIN".format(get_name(message.author.id), message.author.id))
     await send_lobby("**{}** votes to not lynch anyone today.".format(get_name(message.author.id)))
 
@@ -1672,7 +2066,7 @@ async def cmd_coin(message, parameters):
     if value == 1:
         reply_msg = 'its side'
     elif value == 100:
-        reply_msg = client.user.name
+        reply_msg = transport.user.name
     elif value < 50:
         reply_msg = 'heads'
     else:
@@ -1694,6 +2088,7 @@ async def cmd_fday(message, parameters):
 async def cmd_fnight(message, parameters):
     if session[0] and session[2]:
         session[2] = False
+        vote_ledger.wake()
         await reply(message, ":thumbsup:")
         await log(2, "{0} ({1}) FNIGHT".format(message.author.name, message.author.id))
 
@@ -1741,6 +2136,7 @@ async def cmd_force(message, parameters):
     temp_player = get_player(player)
     if temp_player:
         session[1][temp_player][2] = target
+        vote_ledger.refresh(temp_player)
         await reply(message, "Successfully set **{}**'s target to **{}**.".format(get_name(temp_player), target))
     else:
         await reply(message, "Cannot find player named **" + player + "**")
@@ -1748,7 +2144,7 @@ async def cmd_force(message, parameters):
 
 @cmd('session', [1, 1], "```\n{0}session takes no arguments\n\nReplies with the contents of the session variable in pm for debugging purposes. Admin only.```")
 async def cmd_session(message, parameters):
-    await client.send_message(message.author, "```py\n{}\n```".format(str(session)))
+    await transport.send_message(message.author, "```py\n{}\n```".format(str(session)))
     await log(2, "{0} ({1}) SESSION".format(message.author.name, message.author.id))
 
 @cmd('time', [0, 0], "```\n{0}time takes no arguments\n\nChecks in-game time.```", 't')
@@ -1786,8 +2182,8 @@ async def cmd_give(message, parameters):
     if session[1][message.author.id][2] not in totems and session[1][message.author.id][1] != 'wolf shaman':
         await reply(message, "You have already given your totem to **" + get_name(session[1][message.author.id][2]) + "**.")
         return
-    elif session[1][message.author.id][1] == 'wolf shaman' and not [x for x in session[1][message.author.id][4] if x.startswith('totem:')]:
-        given_to = [x.split(":")[1] for x in session[1][message.author.id][4] if x.startswith('lasttarget:')]
+    elif session[1][message.author.id][1] == 'wolf shaman' and not session[1][message.author.id][4].values('totem'):
+        given_to = session[1][message.author.id][4].values('lasttarget')
         if given_to:
             await reply(message, "You have already given your totem to **{}**.".format(get_name(given_to[0])))
             return
@@ -1806,7 +2202,7 @@ async def cmd_give(message, parameters):
                     if session[1][message.author.id][1] in ["shaman", "crazed shaman"]:
                         totem = session[1][message.author.id][2]
                     else:
-                        totem = [x for x in session[1][message.author.id][4] if x.startswith("totem:")][0].split(':')[1]
+                        totem = session[1][message.author.id][4].values('totem')[0]
                     if 'misdirection_totem2' in session[1][message.author.id][4]:
                         player = misdirect(message.author.id, alive_players=[x for x in session[1] if session[1][x][0] and not (get_role(x, 'role') == 'succubus' and 'entranced' in session[1][message.author.id][4])])
                     elif 'luck_totem2' in session[1][player][4]:
@@ -1820,7 +2216,8 @@ async def cmd_give(message, parameters):
                             await reply(message, "You may not give a succubus.")
                             return
                         session[1][message.author.id][2] = player
-                        session[1][message.author.id][4] = [x for x in session[1][message.author.id][4] if not x.startswith('lasttarget:')] + ['lasttarget:{}'.format(player)]
+                        session[1][message.author.id][4].remove_prefix('lasttarget')
+                        session[1][message.author.id][4].append('lasttarget:{}'.format(player))
                     await reply(message, "You have given your totem to **" + get_name(player) + "**.")
                     if session[1][message.author.id][1] == 'wolf shaman':
                         await wolfchat("**{0}** has given a totem to **{1}**.".format(get_name(message.author.id), get_name(player)))
@@ -1846,7 +2243,7 @@ async def cmd_notify_role(message, parameters):
     if not WEREWOLF_NOTIFY_ROLE:
         await reply(message, "Error: A " + WEREWOLF_NOTIFY_ROLE_NAME + " role does not exist. Please let an admin know.")
         return
-    member = client.get_server(WEREWOLF_SERVER).get_member(message.author.id)
+    member = transport.server.get_member(message.author.id)
     if not member:
         await reply(message, "You are not in the server!")
     has_role = WEREWOLF_NOTIFY_ROLE in member.roles
@@ -1860,10 +2257,10 @@ async def cmd_notify_role(message, parameters):
         await reply(message, commands['notify_role'][2].format(BOT_PREFIX))
         return
     if has_role:
-        await client.add_roles(member, WEREWOLF_NOTIFY_ROLE)
+        await transport.add_roles(member, WEREWOLF_NOTIFY_ROLE)
         await reply(message, "You will be notified by @" + WEREWOLF_NOTIFY_ROLE.name + ".")
     else:
-        await client.remove_roles(member, WEREWOLF_NOTIFY_ROLE)
+        await transport.remove_roles(member, WEREWOLF_NOTIFY_ROLE)
         await reply(message, "You will not be notified by @" + WEREWOLF_NOTIFY_ROLE.name + ".")
 
 @cmd('ignore', [1, 1], "```\n{0}ignore <add|remove|list> <user>\n\nAdds or removes <user> from the ignore list, or outputs the ignore list.```")
@@ -1876,8 +2273,8 @@ async def cmd_ignore(message, parameters):
     else:
         action = parameters.split(' ')[0].lower()
         target = ' '.join(parameters.split(' ')[1:])
-        member_by_id = client.get_server(WEREWOLF_SERVER).get_member(target.strip('<@!>'))
-        member_by_name = client.get_server(WEREWOLF_SERVER).get_member_named(target)
+        member_by_id = transport.server.get_member(target.strip('<@!>'))
+        member_by_name = transport.server.get_member_named(target)
         member = None
         if member_by_id:
             member = member_by_id
@@ -1893,7 +2290,7 @@ async def cmd_ignore(message, parameters):
             if member.id in IGNORE_LIST:
                 await reply(message, member.name + " is already in the ignore list!")
             else:
-                IGNORE_LIST.append(member.id)
+                IGNORE_LIST.add(member.id)
                 await reply(message, member.name + " was added to the ignore list.")
         elif action in ['-', 'remove']:
             if member.id in IGNORE_LIST:
@@ -1906,14 +2303,35 @@ async def cmd_ignore(message, parameters):
                 await reply(message, "The ignore list is empty.")
             else:
                 msg_dict = {}
-                for ignored in IGNORE_LIST:
-                    member = client.get_server(WEREWOLF_SERVER).get_member(ignored)
+                for ignored in sorted(IGNORE_LIST):
+                    member = transport.server.get_member(ignored)
                     msg_dict[ignored] = member.name if member else "<user not in server with id " + ignored + ">"
                 await reply(message, str(len(IGNORE_LIST)) + " ignored users:\n```\n" + '\n'.join([x + " (" + msg_dict[x] + ")" for x in msg_dict]) + "```")
         else:
             await reply(message, commands['ignore'][2].format(BOT_PREFIX))
         await log(2, "{0} ({1}) IGNORE {2}".format(message.author.name, message.author.id, parameters))
 
+@cmd('metrics', [1, 1], "```\n{0}metrics [<reset|dump|command1 [command2 ...]>]\n\nShows how often each command was used since the bot started or the last "
+                        "reset and how long it took, and how much of that was spent waiting on discord. dump writes them to METRICS_FILE.```")
+async def cmd_metrics(message, parameters):
+    if parameters == 'reset':
+        command_metrics.reset()
+        await reply(message, "Command metrics reset.")
+    elif parameters == 'dump':
+        if not METRICS_FILE:
+            await reply(message, "METRICS_FILE is not set.")
+            return
+        try:
+            await client.loop.run_in_executor(None, dump_metrics)
+            await reply(message, "Command metrics written to " + METRICS_FILE + ".")
+        except OSError as e:
+            await reply(message, "Could not write command metrics: " + str(e))
+    else:
+        # the handler we are in isn't done yet, so it doesn't show up until the next call
+        requested = [x for x in parameters.split(' ') if x]
+        await reply(message, "Command metrics since {}:\n```\n{}\n```".format(command_metrics.since.strftime('%Y-%m-%d %H:%M:%S'),
+                    command_metrics.format(requested or None)))
+
 # TODO
 async def cmd_pingif(message, parameters):
     global pingif_dict
@@ -1951,13 +2369,13 @@ async def cmd_notify(message, parameters):
         if notify:
             await reply(message, "You are already in the notify list.")
             return
-        notify_me.append(message.author.id)
+        set_notify(message.author.id, True)
         await reply(message, "You will be notified by `{}notify`.".format(BOT_PREFIX))
     elif parameters in ['false', '-', 'no']:
         if not notify:
             await reply(message, "You are not in the notify list.")
             return
-        notify_me.remove(message.author.id)
+        set_notify(message.author.id, False)
         await reply(message, "You will not be notified by `{}notify`.".format(BOT_PREFIX))
     else:
         await reply(message, commands['notify'][2].format(BOT_PREFIX))
@@ -2011,13 +2429,13 @@ async def cmd_entrance(message, parameters):
                     elif 'luck_totem2' in session[1][player][4]:
                         player = misdirect(player, alive_players=[x for x in session[1] if session[1][x][0] and x != message.author.id])
                     if 'entranced' not in session[1][player][4]:
-                        member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                        member = transport.server.get_member(player)
                         if 'bishop' in session[1][player][3]:
                             await reply(message, "The holiness of **{}** deters you from approaching. Your entrance is unsuccessful.".format(get_name(player)))
                             session[1][message.author.id][2] = message.author.id
                             if member:
                                 try:
-                                    await client.send_message(member, "You smell the strange scent of a succubus for a fleeting moment. The succubus came near you, but it left you untouched.")
+                                    await transport.send_message(member, "You smell the strange scent of a succubus for a fleeting moment. The succubus came near you, but it left you untouched.")
                                 except discord.Forbidden:
                                     pass
                             await log(1, "{0} ({1}) FAILED TO ENTRANCE {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(player), player))
@@ -2044,10 +2462,10 @@ async def cmd_entrance(message, parameters):
                                 session[1][player][4].append('charm')
                             if role in COMMANDS_FOR_ROLE['give']:
                                 totem = ''
-                                if role == 'wolf shaman' and not [x for x in session[1][player][4] if x.startswith('totem:')] and 'lasttarget:{}'.format(message.author.id) in session[1][player][4]:
-                                    totem = [x.split(':')[1] for x in session[1][player][4] if x.startswith('given:')].pop()
+                                if role == 'wolf shaman' and not session[1][player][4].values('totem') and 'lasttarget:{}'.format(message.author.id) in session[1][player][4]:
+                                    totem = session[1][player][4].values('given').pop()
                                 elif message.author.id == session[1][player][2]:
-                                    totem = [x.split(':')[1] for x in session[1][player][4] if x.startswith('given:')].pop()
+                                    totem = session[1][player][4].values('given').pop()
                                 if totem not in ["protection_totem", "revealing_totem", "desperation_totem", "influence_totem", "luck_totem", "pestilence_totem", "retribution_totem", '']:
                                     succubus_message += " You discover that **{0}** is a succubus and have retracted your totem as a result."
                                     session[1][message.author.id][4].remove(totem)
@@ -2059,7 +2477,7 @@ async def cmd_entrance(message, parameters):
                                         session[1][player][2] == totem
                             if member:
                                 try:
-                                    await client.send_message(member, succubus_message.format(get_name(message.author.id)))
+                                    await transport.send_message(member, succubus_message.format(get_name(message.author.id)))
                                 except discord.Forbidden:
                                     pass
                             await log(1, "{0} ({1}) ENTRANCE {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(player), player))
@@ -2165,20 +2583,20 @@ async def cmd_charm(message, parameters):
                 await reply(message, "You have charmed **{}** and **{}**.".format(*map(get_name, redirected_targets)))
                 await log(1, "{} ({}) CHARM {} ({}) AND {} ({})".format(get_name(message.author.id), message.author.id, get_name(redirected_targets[0]), redirected_targets[0], get_name(redirected_targets[1]), redirected_targets[1]))
                 for piper in [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'piper' and x != message.author.id]:
-                    member = client.get_server(WEREWOLF_SERVER).get_member(piper)
+                    member = transport.server.get_member(piper)
                     if member:
                         try:
-                            await client.send_message(member, "Another piper has charmed **{}** and **{}**!".format(*map(get_name, redirected_targets)))
+                            await transport.send_message(member, "Another piper has charmed **{}** and **{}**!".format(*map(get_name, redirected_targets)))
                         except discord.Forbidden:
                             pass
             elif len(valid_targets) == 1:
                 await reply(message, "You have charmed **{}**.".format(*map(get_name, redirected_targets)))
                 await log(1, "{} ({}) CHARM {} ({})".format(get_name(message.author.id), message.author.id, get_name(redirected_targets[0]), redirected_targets[0]))
                 for piper in [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'piper' and x != message.author.id]:
-                    member = client.get_server(WEREWOLF_SERVER).get_member(piper)
+                    member = transport.server.get_member(piper)
                     if member:
                         try:
-                            await client.send_message(member, "Another piper has charmed **{}**!".format(*map(get_name, redirected_targets)))
+                            await transport.send_message(member, "Another piper has charmed **{}**!".format(*map(get_name, redirected_targets)))
                         except discord.Forbidden:
                             pass
             session[1][message.author.id][4].remove('charm')
@@ -2292,10 +2710,10 @@ async def cmd_visit(message, parameters):
                         player = misdirect(player, alive_players=[x for x in session[1] if session[1][x][0] and x != message.author.id and not (get_role(x, 'role') == 'succubus' and 'entranced' in session[1][message.author.id][4])])
                     await reply(message, "You are spending the night with **{}**. Have a good time!".format(get_name(player)))
                     session[1][message.author.id][2] = player
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if member:
                         try:
-                            await client.send_message(member, "You are spending the night with **{}**. Have a good time!".format(get_name(message.author.id)))
+                            await transport.send_message(member, "You are spending the night with **{}**. Have a good time!".format(get_name(message.author.id)))
                         except discord.Forbidden:
                             pass
                     await log(1, "{0} ({1}) VISIT {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(player), player))
@@ -2425,6 +2843,7 @@ async def cmd_fother(message, parameters):
             reply_msg += "set **{1}**'s other flag to **{0}**."
         else:
             reply_msg = "**{1}**'s other flag: " + ', '.join(session[1][player][4])
+        vote_ledger.refresh(player)
     else:
         reply_msg = "Could not find player {1}."
 
@@ -2469,7 +2888,7 @@ async def cmd_fstasis(message, parameters):
         return
     params = parameters.split(' ')
     player = params[0].strip('<!@>')
-    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+    member = transport.server.get_member(player)
     name = "user not in server with id " + player
     if member:
         name = member.display_name
@@ -2488,18 +2907,16 @@ async def cmd_fstasis(message, parameters):
     if player.isdigit():
         if action and amount >= -1:
             if amount >= 0:
-                if player not in stasis:
-                    stasis[player] = 0
                 reply_msg = "Successfully "
                 if action in ['+', 'add', 'give']:
-                    stasis[player] += amount
+                    add_stasis(player, amount)
                     reply_msg += "increased **{0}** ({1})'s stasis by **{2}**."
                 elif action in ['-', 'remove', 'del']:
-                    amount = min(amount, stasis[player])
-                    stasis[player] -= amount
+                    amount = min(amount, stasis.get(player, 0))
+                    add_stasis(player, -amount)
                     reply_msg += "decreased **{0}** ({1})'s stasis by **{2}**."
                 elif action in ['=', 'set']:
-                    stasis[player] = amount
+                    set_stasis(player, amount)
                     reply_msg += "set **{0}** ({1})'s stasis to **{2}**."
                 else:
                     if player not in stasis:
@@ -2551,19 +2968,19 @@ async def cmd_shoot(message, parameters):
         return
     if ('gunner' not in get_role(message.author.id, 'templates') and 'sharpshooter' not in get_role(message.author.id, 'templates')):
         try:
-            await client.send_message(message.author, "You don't have a gun.")
+            await transport.send_message(message.author, "You don't have a gun.")
         except discord.Forbidden:
             pass
         return
     if not session[2]:
         try:
-            await client.send_message(message.author, "You may only shoot players during the day.")
+            await transport.send_message(message.author, "You may only shoot players during the day.")
         except discord.Forbidden:
             pass
         return
     if "silence_totem2" in session[1][message.author.id][4]:
         try:
-            await client.send_message(message.author, "You have been silenced, and are unable to use any special powers.")
+            await transport.send_message(message.author, "You have been silenced, and are unable to use any special powers.")
         except discord.Forbidden:
             pass
         return
@@ -2646,6 +3063,7 @@ async def cmd_shoot(message, parameters):
                     msg += "**{}** is a villager and was injured. Luckily the injury is minor and will heal after a day of rest.".format(
                             get_name(target))
                     session[1][target][4].append('injured')
+                    vote_ledger.refresh(target)
                 else:
                     msg += "wtf? (this is an error, please report to an admin)"
 
@@ -2655,9 +3073,9 @@ async def cmd_shoot(message, parameters):
     if pm:
         target = message.author
     else:
-        target = client.get_channel(GAME_CHANNEL)
+        target = transport.get_channel(GAME_CHANNEL)
     try:
-        await client.send_message(target, msg)
+        await transport.send_message(target, msg)
     except discord.Forbidden:
         pass
 
@@ -2674,7 +3092,7 @@ async def cmd_target(message, parameters):
     if session[2]:
         await reply(message, "You may only target a player during the night.")
         return
-    if [x for x in session[1][message.author.id][4] if x.startswith("assassinate:")]:
+    if session[1][message.author.id][4].values('assassinate'):
         await reply(message, "You have already targeted someone. You must wait until they die to target again.")
     else:
         if parameters == "":
@@ -2747,22 +3165,22 @@ async def cmd_observe(message, parameters):
                                             "return after collecting your observations when day begins.".format(get_name(player)))
                         await wolfchat("**{}** is observing **{}**.".format(get_name(message.author.id), get_name(player)))
                         await log(1, "{0} ({1}) OBSERVE {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(player), player))
-                        while not session[2] and win_condition() == None and session[0]:
-                            await asyncio.sleep(0.1)
-                        if 'observe' in session[1][message.author.id][4]:
-                            session[1][message.author.id][4].remove('observe')
-                        if get_role(player, 'role') in ['seer', 'oracle', 'harlot', 'hunter', 'augur', 'bodyguard', 'guardian angel', 'succubus', 'serial killer']\
-                            and session[1][player][2] in set(session[1]) - set(player)\
-                            or get_role(player, 'role') in ['shaman', 'crazed shaman', 'piper', ]\
-                            and session[1][player][2] in session[1]:
-                                msg = "not in bed all night"
-                        else:
-                                msg = "sleeping all night long"
-                        try:
-                            await client.send_message(message.author, "As the sun rises, you conclude that **{}** was {}, and you fly back to your house.".format(
+                        # settled at sunrise, before the night's actions are cleared, or when the game ends first;
+                        # the 'observe' flag itself is dropped with the other EXPIRING_FLAGS
+                        def observed(*args, observer=message.author, player=player):
+                            phase_bus.unsubscribe('sunrise', observed)
+                            phase_bus.unsubscribe('game_end', observed)
+                            if get_role(player, 'role') in ['seer', 'oracle', 'harlot', 'hunter', 'augur', 'bodyguard', 'guardian angel', 'succubus', 'serial killer']\
+                                and session[1][player][2] in set(session[1]) - set(player)\
+                                or get_role(player, 'role') in ['shaman', 'crazed shaman', 'piper', ]\
+                                and session[1][player][2] in session[1]:
+                                    msg = "not in bed all night"
+                            else:
+                                    msg = "sleeping all night long"
+                            return transport.send_message(observer, "As the sun rises, you conclude that **{}** was {}, and you fly back to your house.".format(
                                 get_name(player), msg))
-                        except discord.Forbidden:
-                            pass
+                        phase_bus.subscribe('sunrise', observed)
+                        phase_bus.subscribe('game_end', observed)
                 else:
                     await reply(message, "Could not find player " + parameters)
     elif get_role(message.author.id, 'role') == 'sorcerer':
@@ -2789,7 +3207,7 @@ async def cmd_observe(message, parameters):
                     session[1][message.author.id][2] = player
                     target_role = get_role(player, 'role')
                     if target_role == 'amnesiac':
-                        target_role = [x.split(':')[1].replace("_", " ") for x in session[1][player][4] if x.startswith("role:")].pop()
+                        target_role = [x.replace("_", " ") for x in session[1][player][4].values('role')].pop()
                     if target_role in ['seer', 'oracle', 'augur']:
                         debug_msg = target_role
                         msg = "**{}** is a **{}**!".format(get_name(player), get_role(player, 'role'))
@@ -2832,16 +3250,12 @@ async def cmd_id(message, parameters):
                     elif 'luck_totem2' in session[1][player][4]:
                         player = misdirect(player, alive_players=[x for x in session[1] if session[1][x][0] and x != message.author.id])
                     await reply(message, "The results of your investigation have returned. **{}** is a **{}**!".format(
-                        get_name(player), get_role(player, 'role') if not get_role(player, 'role') == 'amnesiac' else [x.split(':')[1].replace("_", " ") for x in session[1][player][4] if x.startswith("role:")].pop()))
+                        get_name(player), get_role(player, 'role') if not get_role(player, 'role') == 'amnesiac' else [x.replace("_", " ") for x in session[1][player][4].values('role')].pop()))
                     await log(1, "{0} ({1}) INVESTIGATE {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(player), player))
                     if random.random() < DETECTIVE_REVEAL_CHANCE:
                         await wolfchat("Someone accidentally drops a paper. The paper reveals that **{}** ({}) is the detective!".format(
                             get_name(message.author.id), message.author.id))
                         await log(1, "{0} ({1}) DETECTIVE REVEAL".format(get_name(message.author.id), message.author.id))
-                    while session[2] and win_condition() == None and session[0]:
-                        await asyncio.sleep(0.1)
-                    if 'investigate' in session[1][message.author.id][4]:
-                        session[1][message.author.id][4].remove('investigate')
             else:
                 await reply(message, "Could not find player " + parameters)
 
@@ -2858,6 +3272,7 @@ async def cmd_frevive(message, parameters):
                 await reply(message, "Player **{}** is already alive!".format(player))
             else:
                 session[1][player][0] = True
+                vote_ledger.refresh(player)
                 await reply(message, ":thumbsup:")
         else:
             await reply(message, "Could not find player {}".format(parameters))
@@ -2940,7 +3355,7 @@ async def cmd_guard(message, parameters):
                 if 'lasttarget:' + player in session[1][message.author.id][4]: # so hacky but whaterver
                     await reply(message, "You already guarded **{}** last night. You may not guard the same player two nights in a row.".format(get_name(player)))
                     return
-                session[1][message.author.id][4][:] = [x for x in session[1][message.author.id][4] if not x.startswith('lasttarget:')]
+                session[1][message.author.id][4].remove_prefix('lasttarget')
                 if not session[1][player][0]:
                     await reply(message, "Player **" + get_name(player) + "** is dead!")
                     return
@@ -2972,10 +3387,10 @@ async def cmd_guard(message, parameters):
                         session[1][player][4].append("guarded")
                     elif get_role(message.author.id, 'role') == 'bodyguard':
                         session[1][player][4].append("bodyguard:{}".format(message.author.id))
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if member:
                         try:
-                            await client.send_message(member, "You can sleep well tonight, for you are being protected.")
+                            await transport.send_message(member, "You can sleep well tonight, for you are being protected.")
                         except discord.Forbidden:
                             pass
                     await log(1, "{0} ({1}) GUARD {2} ({3})".format(get_name(message.author.id), message.author.id, get_name(player), player))
@@ -3001,47 +3416,380 @@ def has_privileges(level, message):
     else:
         return False
 
+class Scheduler:
+    # Everything that waits for a deadline or for the game to reach some state waits here instead of polling.
+    # Deadlines sit in one heap with a single loop timer armed for the earliest of them, and conditions are only
+    # checked again when notify() is called, which happens after every command, death and phase change. Waits can
+    # be tagged with a group ('lobby' or 'game') and torn down together with cancel().
+    def __init__(self):
+        self.deadlines = [] # heap of (deadline, sequence, waiter)
+        self.waiters = set() # (future, until, group)
+        self.sequence = 0
+        self.timer = None
+        self.timer_deadline = None
+
+    async def wait(self, until=None, timeout=None, group=None):
+        # True once until() holds, False after timeout seconds, None if the group was cancelled
+        if until and until():
+            return True
+        loop = asyncio.get_event_loop()
+        waiter = (loop.create_future(), until, group)
+        self.waiters.add(waiter)
+        if timeout is not None:
+            heapq.heappush(self.deadlines, (loop.time() + max(timeout, 0), self.sequence, waiter))
+            self.sequence += 1
+            self.arm()
+        try:
+            return await waiter[0]
+        finally:
+            self.waiters.discard(waiter)
+
+    def arm(self):
+        while self.deadlines and self.deadlines[0][2][0].done():
+            heapq.heappop(self.deadlines)
+        if not self.deadlines:
+            return
+        deadline = self.deadlines[0][0]
+        if self.timer and self.timer_deadline <= deadline:
+            return
+        if self.timer:
+            self.timer.cancel()
+        self.timer = asyncio.get_event_loop().call_at(deadline, self.expire)
+        self.timer_deadline = deadline
+
+    def expire(self):
+        self.timer = None
+        now = asyncio.get_event_loop().time()
+        # the loop may run a timer a hair early
+        while self.deadlines and self.deadlines[0][0] <= now + 0.001:
+            future = heapq.heappop(self.deadlines)[2][0]
+            if not future.done():
+                future.set_result(False)
+        self.arm()
+
+    def notify(self):
+        for future, until, group in list(self.waiters):
+            if until and not future.done() and until():
+                future.set_result(True)
+
+    def cancel(self, group):
+        for future, until, waiter_group in list(self.waiters):
+            if waiter_group == group and not future.done():
+                future.set_result(None)
+
+scheduler = Scheduler()
+
+class PhaseBus:
+    # Effects that are settled at a later point of the game subscribe to it instead of waiting for session[2] to
+    # flip: 'sunrise' and 'sunset', 'death' (player, reason, kill_team), 'lynch' (player, kill_team) and 'game_end'
+    # (reason, winners). publish() calls the subscribers in the order they subscribed; coroutines they return are
+    # run together through fan_out. once subscribers only hear the next publish, and end_game drops everything.
+    def __init__(self):
+        self.subscribers = {} # event -> [(callback, once)]
+
+    def subscribe(self, event, callback, once=True):
+        self.subscribers.setdefault(event, []).append((callback, once))
+
+    def unsubscribe(self, event, callback):
+        self.subscribers[event] = [x for x in self.subscribers.get(event, []) if x[0] != callback]
+
+    def clear(self):
+        self.subscribers = {}
+
+    async def publish(self, event, *args):
+        subscribers = self.subscribers.get(event, [])
+        self.subscribers[event] = [x for x in subscribers if not x[1]]
+        coros = [x for x in (callback(*args) for callback, once in subscribers) if asyncio.iscoroutine(x)]
+        scheduler.notify()
+        if coros:
+            await fan_out(coros)
+
+phase_bus = PhaseBus()
+
+def signal_phase_event():
+    phase_event.set()
+    scheduler.notify()
+
+async def wait_phase_event(timeout):
+    # wakes up on signal_phase_event() or after timeout seconds, whichever comes first
+    await scheduler.wait(phase_event.is_set, timeout, 'game')
+    phase_event.clear()
+
+class ChannelOutbox:
+    # Queue of posts waiting to go out to one channel. Consecutive queued messages of the same priority are merged
+    # into as few posts of up to MAX_MESSAGE_LEN as possible, lower priority numbers are sent first, and sends are
+    # paced to CHANNEL_RATE_LIMIT posts per CHANNEL_RATE_PERIOD seconds.
+    def __init__(self, channel):
+        self.channel = channel
+        self.pending = [] # heap of (priority, sequence, text)
+        self.sequence = 0
+        self.sent = deque() # times of recent sends
+        self.worker = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def put(self, text, priority):
+        for i in range(0, len(text), MAX_MESSAGE_LEN):
+            heapq.heappush(self.pending, (priority, self.sequence, text[i:i + MAX_MESSAGE_LEN]))
+            self.sequence += 1
+        if self.pending:
+            self.idle.clear()
+            if not self.worker or self.worker.done():
+                self.worker = asyncio.ensure_future(self.run())
+
+    def next_post(self):
+        priority, _, post = heapq.heappop(self.pending)
+        while self.pending and self.pending[0][0] == priority and len(post) + 1 + len(self.pending[0][2]) <= MAX_MESSAGE_LEN:
+            post += '\n' + heapq.heappop(self.pending)[2]
+        return post
+
+    async def wait_for_rate_limit(self):
+        while len(self.sent) >= CHANNEL_RATE_LIMIT:
+            wait = self.sent[0] + CHANNEL_RATE_PERIOD - client.loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                self.sent.popleft()
+
+    async def run(self):
+        # idle is set however this ends, or flush_messages() would wait on this channel forever
+        try:
+            while self.pending:
+                await self.wait_for_rate_limit()
+                post = self.next_post()
+                for i in range(3):
+                    try:
+                        await transport.send_message(self.channel, post)
+                        break
+                    except discord.Forbidden:
+                        break
+                    except Exception as e:
+                        # connection errors and timeouts as well as discord's own
+                        await log(3, "Error in sending message `{}` to {}: ```py\n{}\n```".format(post, self.channel, traceback.format_exc()))
+                        if i < 2:
+                            await asyncio.sleep(getattr(e, 'retry_after', 5))
+                else:
+                    await log(3, "Unable to send message `{}` to {}".format(post, self.channel))
+                self.sent.append(client.loop.time())
+        finally:
+            self.idle.set()
+
+def queue_message(channel, text, priority=PRIORITY_GAME):
+    if channel.id not in outboxes:
+        outboxes[channel.id] = ChannelOutbox(channel)
+    outboxes[channel.id].put(str(text), priority)
+
+async def flush_messages(channel=None):
+    # waits until everything queued for channel (or for every channel) has been sent
+    if channel:
+        if channel.id in outboxes:
+            await outboxes[channel.id].idle.wait()
+    else:
+        for outbox in list(outboxes.values()):
+            await outbox.idle.wait()
+
+async def fan_out(coros):
+    # runs the (usually DM) coroutines concurrently, at most FAN_OUT_LIMIT at a time;
+    # a recipient who blocks the bot doesn't hold up or break delivery to the others
+    semaphore = asyncio.Semaphore(FAN_OUT_LIMIT)
+    async def deliver(coro):
+        async with semaphore:
+            try:
+                return await coro
+            except discord.Forbidden:
+                pass
+    return await asyncio.gather(*[deliver(x) for x in coros])
+
+async def apply_role_changes(role, add=(), remove=()):
+    # gives role to the members in add and takes it from those in remove, at most ROLE_SYNC_LIMIT calls at a time;
+    # a call that hit a rate limit or a server error is tried up to ROLE_SYNC_RETRIES times with a doubling backoff,
+    # anything else is given up on right away. Returns how many changes went through.
+    if not role:
+        return 0
+    semaphore = asyncio.Semaphore(ROLE_SYNC_LIMIT)
+    async def change(method, member):
+        async with semaphore:
+            for i in range(ROLE_SYNC_RETRIES):
+                try:
+                    await method(member, role)
+                    return True
+                except discord.Forbidden:
+                    break
+                except discord.HTTPException as e:
+                    status = e.response.status
+                    if (status != 429 and status < 500) or i == ROLE_SYNC_RETRIES - 1:
+                        break
+                    await asyncio.sleep(2 ** i)
+            await log(2, "Could not {} role {} for {} ({})", 'add' if method == transport.add_roles else 'remove', role.name,
+                      member.name, member.id, user=member.id)
+            return False
+    results = await asyncio.gather(*([change(transport.add_roles, x) for x in add] + [change(transport.remove_roles, x) for x in remove]))
+    return results.count(True)
+
+async def sync_players_role():
+    # PLAYERS_ROLE belongs to exactly the living players; only the members whose role is wrong are touched
+    should_have = set(x for x in session[1] if session[1][x][0])
+    add = []
+    remove = []
+    for member in transport.server.members:
+        has = PLAYERS_ROLE in member.roles
+        if member.id in should_have:
+            if not has:
+                add.append(member)
+        elif has:
+            remove.append(member)
+    changed = await apply_role_changes(PLAYERS_ROLE, add, remove)
+    return len(add), len(remove), changed
+
 async def send_long_post(channel, post):
     if len(post) <= MAX_MESSAGE_LEN:
-        await client.send_message(channel, post)
+        await transport.send_message(channel, post)
         return
     else:
-        await client.send_message(channel, post[:MAX_MESSAGE_LEN])
+        await transport.send_message(channel, post[:MAX_MESSAGE_LEN])
         await send_long_post(channel, post[MAX_MESSAGE_LEN:])
 
 async def reply(message, text, cleanmessage=True):
     if cleanmessage:
         text = text.replace('@', '@\u200b')
-    await send_long_post(message.channel, message.author.mention + ', ' + str(text))
+    queue_message(message.channel, message.author.mention + ', ' + str(text), PRIORITY_CHATTER)
+
+async def send_lobby(text, priority=PRIORITY_GAME):
+    queue_message(transport.get_channel(GAME_CHANNEL), text, priority)
+
+# asyncio.Task.current_task went away in python 3.9
+current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+# upper bounds in seconds of the latency histogram buckets; anything slower lands in a last, unbounded bucket
+METRICS_BUCKETS = [0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+class LatencyHistogram:
+    def __init__(self):
+        self.buckets = [0] * (len(METRICS_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, seconds):
+        self.buckets[bisect_left(METRICS_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        # upper bound of the bucket the percentile falls in, or the slowest sample for the last bucket
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= fraction * self.count:
+                return min(METRICS_BUCKETS[i], self.max) if i < len(METRICS_BUCKETS) else self.max
+        return 0
+
+    def dump(self):
+        return {'count' : self.count, 'total' : self.total, 'max' : self.max, 'p50' : self.percentile(0.5),
+                'p99' : self.percentile(0.99), 'buckets' : self.buckets}
+
+class CommandMetrics:
+    # Per-command calls, errors and latency histograms for the time spent in each handler and, of that, the time
+    # spent awaiting discord. Transport calls are charged to the command the calling task is running, so a
+    # message queued for the outbox costs its command nothing but a direct transport.send_message does.
+    def __init__(self):
+        self.running = {} # task -> [command, seconds awaiting discord]
+        self.reset()
+
+    def reset(self):
+        self.since = datetime.now()
+        self.calls = Counter()
+        self.errors = Counter()
+        self.handler = {}
+        self.io = {}
+        self.io_calls = Counter()
+
+    def begin(self, command):
+        task = current_task()
+        entry = [command, 0]
+        previous = self.running.get(task)
+        self.running[task] = entry
+        return task, entry, previous, time.perf_counter()
+
+    def end(self, token, failed=False):
+        task, entry, previous, start = token
+        command = entry[0]
+        if previous:
+            self.running[task] = previous
+        else:
+            self.running.pop(task, None)
+        self.calls[command] += 1
+        if failed:
+            self.errors[command] += 1
+        self.handler.setdefault(command, LatencyHistogram()).add(time.perf_counter() - start)
+        self.io.setdefault(command, LatencyHistogram()).add(entry[1])
+
+    def add_io(self, method, seconds):
+        # DiscordTransport.on_call callback
+        entry = self.running.get(current_task())
+        if entry:
+            entry[1] += seconds
+            self.io_calls[entry[0]] += 1
+
+    def dump(self):
+        return {'since' : self.since.isoformat(),
+                'commands' : {x : {'calls' : self.calls[x], 'errors' : self.errors[x], 'io_calls' : self.io_calls[x],
+                                   'handler' : self.handler[x].dump(), 'io' : self.io[x].dump()} for x in self.calls}}
+
+    def format(self, commands=None, limit=20):
+        minutes = max((datetime.now() - self.since).total_seconds() / 60, 1 / 60)
+        commands = sorted(commands or self.calls, key=lambda x: self.handler[x].total if x in self.handler else 0, reverse=True)[:limit]
+        lines = ['{:<12} {:>6} {:>6} {:>4} {:>8} {:>8} {:>8} {:>8} {:>8}'.format('command', 'calls', '/min', 'err', 'total s',
+                 'p50 ms', 'p99 ms', 'max ms', 'io %')]
+        for command in commands:
+            if command not in self.handler:
+                continue
+            handler = self.handler[command]
+            io = self.io[command]
+            lines.append('{:<12} {:>6} {:>6.1f} {:>4} {:>8.2f} {:>8.1f} {:>8.1f} {:>8.1f} {:>7.0f}%'.format(command[:12], handler.count,
+                         handler.count / minutes, self.errors[command], handler.total, handler.percentile(0.5) * 1000,
+                         handler.percentile(0.99) * 1000, handler.max * 1000, io.total / handler.total * 100 if handler.total else 0))
+        return '\n'.join(lines)
 
-async def send_lobby(text):
-    for i in range(3):
+command_metrics = CommandMetrics()
+transport.on_call.append(command_metrics.add_io)
+
+def dump_metrics():
+    if METRICS_FILE:
+        _replace_file(METRICS_FILE, json.dumps(command_metrics.dump(), indent=2))
+
+async def metrics_dump_loop():
+    while not client.is_closed:
+        await asyncio.sleep(METRICS_DUMP_INTERVAL)
         try:
-            msg = await send_long_post(client.get_channel(GAME_CHANNEL), text)
-            return msg
-        except:
-            await log(3, "Error in sending message `{}` to lobby: ```py\n{}\n```".format(
-                text, traceback.format_exc()))
-            await asyncio.sleep(5)
-    else:
-        await log(3, "Unable to send message `{}` to lobby: ```py\n{}\n```".format(
-            text, traceback.format_exc()))
+            await client.loop.run_in_executor(None, dump_metrics)
+        except OSError:
+            await log(2, "Could not write metrics to {}:\n```py\n{}\n```".format(METRICS_FILE, traceback.format_exc()))
 
 async def parse_command(commandname, message, parameters):
-    await log(0, 'Parsing command ' + commandname + ' with parameters `' + parameters + '` from ' + message.author.name + ' (' + message.author.id + ')')
+    await log(0, "Parsing command {} with parameters `{}` from {} ({})", commandname, parameters, message.author.name, message.author.id,
+              command=commandname, user=message.author.id)
     if commandname in commands:
         pm = 0
         if message.channel.is_private:
             pm = 1
         if has_privileges(commands[commandname][1][pm], message):
+            metrics = command_metrics.begin(commandname)
             try:
                 await commands[commandname][0](message, parameters)
+                command_metrics.end(metrics)
             except Exception:
+                command_metrics.end(metrics, failed=True)
                 traceback.print_exc()
                 print(session)
-                msg = '```py\n{}\n```\n**session:**```py\n{}\n```'.format(traceback.format_exc(), session)
-                await log(3, msg)
-                await client.send_message(message.channel, "An error has occurred and has been logged.")
+                await log(3, "```py\n{}\n```\n**session:**```py\n{}\n```", traceback.format_exc(), session, command=commandname)
+                await transport.send_message(message.channel, "An error has occurred and has been logged.")
+            if session[0]:
+                signal_phase_event()
+                game_snapshot.request()
+            else:
+                scheduler.notify()
         elif has_privileges(commands[commandname][1][0], message):
             if session[0] and message.author.id in session[1] and session[1][message.author.id][0]:
                 if commandname in COMMANDS_FOR_ROLE and (get_role(message.author.id, 'role') in COMMANDS_FOR_ROLE[commandname]\
@@ -3051,45 +3799,145 @@ async def parse_command(commandname, message, parameters):
             if session[0] and message.author.id in session[1] and session[1][message.author.id][0]:
                 if commandname in COMMANDS_FOR_ROLE and get_role(message.author.id, 'role') in COMMANDS_FOR_ROLE[commandname]:
                     try:
-                        await client.send_message(message.author, "Please use command " + commandname + " in private message.")
+                        await transport.send_message(message.author, "Please use command " + commandname + " in private message.")
                     except discord.Forbidden:
                         pass
             elif message.author.id in ADMINS:
                 await reply(message, "Please use command " + commandname + " in private message.")
         else:
-            await log(2, 'User ' + message.author.name + ' (' + message.author.id + ') tried to use command ' + commandname + ' with parameters `' + parameters + '` without permissions!')
+            await log(2, "User {} ({}) tried to use command {} with parameters `{}` without permissions!", message.author.name, message.author.id,
+                      commandname, parameters, command=commandname, user=message.author.id)
 
 async def send_long_log_helper(channel, post, depth=0):
     max = MAX_MESSAGE_LEN - 50  # Some breathing room for security
     if len(post) <= max:
         if depth:
-            await client.send_message(channel, "[CONTINUED] " + "```py\n" + post[:max])
+            await transport.send_message(channel, "[CONTINUED] " + "```py\n" + post[:max])
         else:
-            await client.send_message(channel, post)
+            await transport.send_message(channel, post)
             return
     else:
         if depth:
-            await client.send_message(channel, "[CONTINUED] " + "```py\n" + post[:max] + "```")
+            await transport.send_message(channel, "[CONTINUED] " + "```py\n" + post[:max] + "```")
         else:
-            await client.send_message(channel, post[:max] + "```")
+            await transport.send_message(channel, post[:max] + "```")
         await send_long_log_helper(channel, post[max:], depth+1)
 
-async def log(loglevel, text):
-    # loglevels
-    # 0 = DEBUG
-    # 1 = INFO
-    # 2 = WARNING
-    # 3 = ERROR
-    levelmsg = {0 : '[DEBUG] ',
-                1 : '[INFO] ',
-                2 : '**[WARNING]** ',
-                3 : '**[ERROR]** <@' + OWNER_ID + '> '
-                }
-    logmsg = levelmsg[loglevel] + str(text)
+def _write_log_file(text):
+    # runs in an executor; rotates LOG_FILE to LOG_FILE.1, .2, ... once it would grow past LOG_MAX_BYTES
+    if LOG_MAX_BYTES and os.path.isfile(LOG_FILE) and os.path.getsize(LOG_FILE) + len(text) > LOG_MAX_BYTES:
+        for i in range(LOG_BACKUP_COUNT - 1, 0, -1):
+            if os.path.isfile('{}.{}'.format(LOG_FILE, i)):
+                os.replace('{}.{}'.format(LOG_FILE, i), '{}.{}'.format(LOG_FILE, i + 1))
+        if LOG_BACKUP_COUNT:
+            os.replace(LOG_FILE, LOG_FILE + '.1')
+        else:
+            os.remove(LOG_FILE)
     with open(LOG_FILE, 'a', encoding='utf-8') as f:
-        f.write("[{}] {}\n".format(datetime.now(), logmsg))
-    if loglevel >= MIN_LOG_LEVEL:
-        await send_long_log_helper(client.get_channel(DEBUG_CHANNEL), logmsg)
+        f.write(text)
+
+class LogWriter:
+    # Holds log lines in a ring buffer and writes them out from a background task, batched every
+    # LOG_FLUSH_INTERVAL seconds or once LOG_FLUSH_SIZE lines are waiting. Debug channel messages are
+    # batched the same way, so a burst of log calls becomes one post instead of one post per line.
+    def __init__(self):
+        self.lines = deque(maxlen=LOG_BUFFER_SIZE)
+        self.posts = deque(maxlen=LOG_BUFFER_SIZE)
+        self.dropped = 0
+        self.wakeup = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.worker = None
+
+    def put(self, line=None, post=None):
+        if line is not None:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(line)
+        if post is not None:
+            self.posts.append(post)
+        if len(self.lines) >= LOG_FLUSH_SIZE:
+            self.wakeup.set()
+        if not self.worker or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        while self.lines or self.posts:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self.lock:
+            if self.dropped:
+                self.lines.appendleft(_format_log_line(2, "log buffer full, dropped {} lines".format(self.dropped), {}))
+                self.dropped = 0
+            if self.lines:
+                text = ''.join(self.lines)
+                self.lines.clear()
+                try:
+                    await client.loop.run_in_executor(None, _write_log_file, text)
+                except OSError:
+                    print("Could not write to log file:\n" + traceback.format_exc())
+            if self.posts:
+                post = '\n'.join(self.posts)
+                self.posts.clear()
+                try:
+                    await send_long_log_helper(transport.get_channel(DEBUG_CHANNEL), post)
+                except Exception:
+                    # connection errors and timeouts as well as discord's own; letting one out would end the
+                    # worker and make flush_log() raise at shutdown
+                    print("Could not send log to debug channel:\n" + traceback.format_exc())
+
+log_writer = LogWriter()
+
+# loglevels
+# 0 = DEBUG
+# 1 = INFO
+# 2 = WARNING
+# 3 = ERROR
+LOG_LEVEL_NAMES = {0 : 'DEBUG', 1 : 'INFO', 2 : 'WARNING', 3 : 'ERROR'}
+LOG_LEVEL_PREFIXES = {0 : '[DEBUG] ',
+                      1 : '[INFO] ',
+                      2 : '**[WARNING]** ',
+                      3 : '**[ERROR]** <@' + OWNER_ID + '> '
+                      }
+
+def _format_log_line(loglevel, text, fields):
+    if LOG_FORMAT == 'json':
+        record = {'time' : datetime.now().isoformat(), 'level' : LOG_LEVEL_NAMES[loglevel], 'message' : text}
+        record.update(fields)
+        return json.dumps(record, default=str) + '\n'
+    return "[{}] {}{}\n".format(datetime.now(), LOG_LEVEL_PREFIXES[loglevel], text)
+
+def log_enabled(loglevel):
+    return loglevel >= LOG_FILE_LEVEL or loglevel >= MIN_LOG_LEVEL
+
+def log_nowait(loglevel, text, *args, **fields):
+    # text is only formatted with args once we know some sink wants this level, and any callable
+    # in args or fields is only called then, so expensive reprs cost nothing when filtered out.
+    # fields are extra keys for the json log format and are ignored by the plain text format.
+    if not log_enabled(loglevel):
+        return
+    to_file = loglevel >= LOG_FILE_LEVEL
+    to_channel = loglevel >= MIN_LOG_LEVEL
+    if args:
+        text = text.format(*[arg() if callable(arg) else arg for arg in args])
+    else:
+        text = str(text)
+    if to_file and LOG_FORMAT == 'json':
+        fields = {k : v() if callable(v) else v for k, v in fields.items()}
+    line = _format_log_line(loglevel, text, fields) if to_file else None
+    post = LOG_LEVEL_PREFIXES[loglevel] + text if to_channel else None
+    log_writer.put(line, post)
+
+async def log(loglevel, text, *args, **fields):
+    log_nowait(loglevel, text, *args, **fields)
+
+async def flush_log():
+    await log_writer.flush()
 
 def balance_roles(massive_role_list, default_role='villager', num_players=-1):
     if num_players == -1:
@@ -3181,7 +4029,7 @@ async def assign_roles(gamemode):
 
     for i in range(gamemode_roles['cursed villager'] if 'cursed villager' in gamemode_roles else 0):
         cursed_choices = [x for x in session[1] if get_role(x, 'role') not in\
-        ACTUAL_WOLVES + ROLES_SEEN_WOLF + ['seer', 'oracle', 'jester', 'fool', 'executioner', 'hot potato'] and 'cursed' not in session[1][x][3]]
+        ACTUAL_WOLVES | ROLES_SEEN_WOLF | {'seer', 'oracle', 'jester', 'fool', 'executioner', 'hot potato'} and 'cursed' not in session[1][x][3]]
         if cursed_choices:
             cursed = random.choice(cursed_choices)
             session[1][cursed][3].append('cursed')
@@ -3235,7 +4083,7 @@ async def assign_roles(gamemode):
             assassin_choices = [x for x in session[1] if 'assassin' not in session[1][x][3]]
         else:
             assassin_choices = [x for x in session[1] if get_role(x, 'role') not in\
-        ACTUAL_WOLVES + NEUTRAL_ROLES_ORDERED + ["traitor", "seer", "augur", "oracle", "harlot", "detective", "guardian angel"] and 'assassin' not in session[1][x][3]]
+        ACTUAL_WOLVES.union(NEUTRAL_ROLES_ORDERED, ["traitor", "seer", "augur", "oracle", "harlot", "detective", "guardian angel"]) and 'assassin' not in session[1][x][3]]
         if assassin_choices:
             assassin = random.choice(assassin_choices)
             session[1][assassin][3].append('assassin')
@@ -3260,10 +4108,15 @@ async def assign_roles(gamemode):
 
 async def end_game(reason, winners=None):
     global faftergame
-    await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.online)
+    await transport.change_presence(game=transport.server.me.game, status=discord.Status.online)
     if not session[0]:
         return
     session[0] = False
+    vote_ledger.stop()
+    scheduler.cancel('game')
+    await phase_bus.publish('game_end', reason, winners)
+    phase_bus.clear()
+    await game_snapshot.clear()
     if session[2]:
         if session[3][1]:
             session[4][1] += datetime.now() - session[3][1]
@@ -3288,7 +4141,8 @@ async def end_game(reason, winners=None):
             msg += "The winners are **{}** and **{}**!".format(get_name(winners[0]), get_name(winners[1]))
         else:
             msg += "The winners are **{}**, and **{}**!".format('**, **'.join(map(get_name, winners[:-1])), get_name(winners[-1]))
-    await send_lobby(msg)
+    await flush_messages()
+    await send_lobby(msg, PRIORITY_PHASE)
     await log(1, "WINNERS: {}".format(winners))
 
     players = list(session[1])
@@ -3311,9 +4165,9 @@ async def end_game(reason, winners=None):
         player_dict[player] = ('game end', "bot")
     await player_deaths(player_dict)
 
-    perms = client.get_channel(GAME_CHANNEL).overwrites_for(client.get_server(WEREWOLF_SERVER).default_role)
+    perms = transport.get_channel(GAME_CHANNEL).overwrites_for(transport.server.default_role)
     perms.send_messages = True
-    await client.edit_channel_permissions(client.get_channel(GAME_CHANNEL), client.get_server(WEREWOLF_SERVER).default_role, perms)
+    await transport.edit_channel_permissions(transport.get_channel(GAME_CHANNEL), transport.server.default_role, perms)
 
     if faftergame:
         # !faftergame <command> [<parameters>]
@@ -3323,98 +4177,153 @@ async def end_game(reason, winners=None):
         await commands[command][0](faftergame, parameters)
         faftergame = None
 
-def win_condition():
-    teams = {'village' : 0, 'wolf' : 0, 'neutral' : 0}
-    injured_wolves = 0
+def _win_contribution(player, lover_refs):
+    # what a single player adds to the counts win_condition() decides on
+    role = session[1][player][1]
+    other = session[1][player][4]
+    contribution = Counter()
+    if role in ['succubus', 'piper', 'serial killer']:
+        contribution[role + ' total'] += 1
+    if not session[1][player][0]:
+        return contribution
+    contribution['alive'] += 1
+    if 'injured' in other:
+        if roles[role][0] == 'wolf' and role not in ['cultist', 'minion'] and 'entranced' not in other:
+            contribution['injured wolf'] += 1
+    else:
+        if role in ['cultist', 'minion'] and session[6] != 'evilvillage':
+            contribution['village'] += 1
+        else:
+            contribution[roles[role][0]] += 1
+    if [x for x in session[1][player].lovers if x in session[1]] or lover_refs.get(player):
+        contribution['lover'] += 1
+    if role == 'succubus' or 'entranced' in other:
+        contribution['succubus'] += 1
+    if role == 'piper' or 'charmed' in other:
+        contribution['piper'] += 1
+    if role in ['serial killer', 'monster', 'cultist', 'minion']:
+        contribution[role] += 1
+    if role in ACTUAL_WOLVES or role == 'traitor':
+        contribution['wolf team'] += 1
+    return contribution
+
+def _count_win_teams():
+    # full scan equivalent of win_tally.counts
+    lover_refs = {}
     for player in session[1]:
-        if session[1][player][0]:
-            if 'injured' in session[1][player][4]:
-                if get_role(player, 'actualteam') == 'wolf' and session[1][player][1] not in ['cultist', 'minion'] and 'entranced' not in session[1][player][4]:
-                    injured_wolves += 1
-            else:
-                if session[1][player][1] in ['cultist', 'minion'] and session[6] != 'evilvillage':
-                    teams['village'] += 1
-                else:
-                    teams[roles[session[1][player][1]][0]] += 1
-    winners = []
-    win_team = ''
-    win_lore = ''
-    win_msg = ''
-    lovers = []
-    players = session[1]
-    for plr in players:
-        for o in players[plr][4]:
-            if o.startswith("lover:"):
-                lvr = o.split(':')[1]
-                if lvr in players:
-                    if plr not in lovers and session[1][plr][0]:
-                        lovers.append(plr)
-                    if lvr not in lovers and session[1][lvr][0]:
-                        lovers.append(lvr)
-    if len([x for x in session[1] if session[1][x][0]]) == 0:
-        win_lore = 'Everyone died. The town sits abandoned, collecting dust.'
-        win_team = 'no win'
-    elif len(lovers) == len([x for x in session[1] if session[1][x][0]]):
-        win_team = 'lovers'
-        win_lore = "Game over! The remaining villagers through their inseparable love for each other have agreed to stop all of this senseless violence and coexist in peace forever more. All remaining players win."
-    elif len([x for x in session[1] if session[1][x][0] and (get_role(x, 'role') == 'succubus' or 'entranced' in session[1][x][4])]) == len([x for x in session[1] if session[1][x][0]]):
-        win_team = 'succubi'
-        win_lore = "Game over! The succub{} completely enthralled the village, making them officers in an ever-growing army set on spreading their control and influence throughout the entire world.".format('i' if len([x for x in session[1] if get_role(x, 'role') == 'succubus']) > 1 else 'us')
-    elif len([x for x in session[1] if session[1][x][0] and (get_role(x, 'role') == 'piper' or 'charmed' in session[1][x][4])]) == len([x for x in session[1] if session[1][x][0]]):
-        win_team = 'pipers'
-        win_lore = "Game over! Everyone has fallen victim to the charms of the piper{0}. The piper{0} lead{1} the villagers away from the village, never to return...".format('' if len([x for x in session[1] if get_role(x, 'role') == 'piper']) < 2 else 's', 's' if len([x for x in session[1] if get_role(x, 'role') == 'piper']) < 2 else '')
-    elif len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'serial killer']) >= len([x for x in session[1] if session[1][x][0]])/2:
-        win_team = 'serial killers'
-        win_lore = "Game over! The serial killer{0} stabbed all those in the village! The serial killer{0} walk{1} off, in the hope to successfully do the same at another location.".format('' if len([x for x in session[1] if get_role(x, 'role') == 'serial killer']) < 2 else 's', 's' if len([x for x in session[1] if get_role(x, 'role') == 'serial killer']) < 2 else '')
-    elif teams['village'] + teams['neutral'] <= teams['wolf'] and not (session[6] == 'evilvillage' and teams['village']):
+        for lover in session[1][player].lovers:
+            lover_refs[lover] = lover_refs.get(lover, 0) + 1
+    counts = Counter()
+    for player in session[1]:
+        counts.update(_win_contribution(player, lover_refs))
+    return counts
+
+class WinTally:
+    # Running totals of _win_contribution() over all players. flush() only recomputes the players that
+    # session[1] marked as changed since the last call, so a "no winner yet" check doesn't scan everyone.
+    def __init__(self):
+        self.players = None
+
+    def rebuild(self):
+        self.players = session[1]
+        self.gamemode = session[6]
+        self.players.dirty.clear()
+        self.lover_flags = {}
+        self.lover_refs = {}
+        for player in self.players:
+            self.lover_flags[player] = self.players[player].lovers
+            for lover in self.lover_flags[player]:
+                self.lover_refs[lover] = self.lover_refs.get(lover, 0) + 1
+        self.contributions = {}
+        self.counts = Counter()
+        for player in self.players:
+            self.contributions[player] = _win_contribution(player, self.lover_refs)
+            self.counts.update(self.contributions[player])
+
+    def flush(self):
+        if self.players is not session[1] or self.gamemode != session[6]:
+            self.rebuild()
+            return
+        dirty = self.players.dirty
+        while dirty:
+            player = dirty.pop()
+            lovers = self.players[player].lovers if player in self.players else []
+            old_lovers = self.lover_flags.pop(player, [])
+            if lovers != old_lovers:
+                # being someone's lover changes that player's counts too
+                for lover in old_lovers:
+                    self.lover_refs[lover] -= 1
+                    dirty.add(lover)
+                for lover in lovers:
+                    self.lover_refs[lover] = self.lover_refs.get(lover, 0) + 1
+                    dirty.add(lover)
+            if player in self.contributions:
+                self.counts.subtract(self.contributions.pop(player))
+            if player in self.players:
+                self.lover_flags[player] = lovers
+                self.contributions[player] = _win_contribution(player, self.lover_refs)
+                self.counts.update(self.contributions[player])
+        if len(self.contributions) != len(self.players):
+            self.rebuild()
+
+win_tally = WinTally()
+
+def _decide_win_team(counts):
+    # returns [win_team, win_lore], or None if the game isn't over
+    if counts['alive'] == 0:
+        return ['no win', 'Everyone died. The town sits abandoned, collecting dust.']
+    elif counts['lover'] == counts['alive']:
+        return ['lovers', "Game over! The remaining villagers through their inseparable love for each other have agreed to stop all of this senseless violence and coexist in peace forever more. All remaining players win."]
+    elif counts['succubus'] == counts['alive']:
+        return ['succubi', "Game over! The succub{} completely enthralled the village, making them officers in an ever-growing army set on spreading their control and influence throughout the entire world.".format('i' if counts['succubus total'] > 1 else 'us')]
+    elif counts['piper'] == counts['alive']:
+        return ['pipers', "Game over! Everyone has fallen victim to the charms of the piper{0}. The piper{0} lead{1} the villagers away from the village, never to return...".format('' if counts['piper total'] < 2 else 's', 's' if counts['piper total'] < 2 else '')]
+    elif counts['serial killer'] >= counts['alive'] / 2:
+        return ['serial killers', "Game over! The serial killer{0} stabbed all those in the village! The serial killer{0} walk{1} off, in the hope to successfully do the same at another location.".format('' if counts['serial killer total'] < 2 else 's', 's' if counts['serial killer total'] < 2 else '')]
+    elif counts['village'] + counts['neutral'] <= counts['wolf'] and not (session[6] == 'evilvillage' and counts['village']):
         if session[6] == 'evilvillage':
-            if not teams['village']:
-                if [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']:
-                    win_team = 'monster'
-                    win_lore = "Game over! All the villagers are dead! As The cultists rejoice, they get destroyed by the monster{0}, causing the monster{0} to win.".format('s' if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']) > 1 else '')
-                elif not [x for x in session[1] if session[1][x][0] and get_role(x, 'role') not in ['cultist', 'minion']]:
-                    win_team = 'no win'
-                    win_lore = "Game over! All the villagers are dead, but the cult needed to sacrifice the wolves to accomplish that. The cult disperses shortly thereafter, and nobody wins."
-                else:
-                    win_team = 'wolf'
-                    win_lore = "Game over! All the villagers are dead! The cultists rejoice with their wolf buddies and start plotting to take over the next village."
-        elif [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']:
-            win_team = 'monster'
-            win_lore = "Game over! The number of uninjured villagers is equal or less than the number of living wolves! The wolves overpower the villagers but then get destroyed by the monster{0}, causing the monster{0} to win.".format('s' if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']) > 1 else '')
+            if counts['monster']:
+                return ['monster', "Game over! All the villagers are dead! As The cultists rejoice, they get destroyed by the monster{0}, causing the monster{0} to win.".format('s' if counts['monster'] > 1 else '')]
+            elif counts['alive'] == counts['cultist'] + counts['minion']:
+                return ['no win', "Game over! All the villagers are dead, but the cult needed to sacrifice the wolves to accomplish that. The cult disperses shortly thereafter, and nobody wins."]
+            else:
+                return ['wolf', "Game over! All the villagers are dead! The cultists rejoice with their wolf buddies and start plotting to take over the next village."]
+        elif counts['monster']:
+            return ['monster', "Game over! The number of uninjured villagers is equal or less than the number of living wolves! The wolves overpower the villagers but then get destroyed by the monster{0}, causing the monster{0} to win.".format('s' if counts['monster'] > 1 else '')]
         else:
-            win_team = 'wolf'
-            win_lore = 'The number of uninjured villagers is equal or less than the number of living wolves! The wolves overpower the remaining villagers and devour them whole.'
-    elif len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') in ACTUAL_WOLVES + ['traitor']]) == 0 and len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'serial killer']) == 0:
+            return ['wolf', 'The number of uninjured villagers is equal or less than the number of living wolves! The wolves overpower the remaining villagers and devour them whole.']
+    elif counts['wolf team'] == 0 and counts['serial killer'] == 0:
         # old version: teams['wolf'] == 0 and injured_wolves == 0:
-        if [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']:
-            win_team = 'monster'
-            win_lore = "Game over! All the wolves are dead! As the villagers start preparing the BBQ, the monster{0} quickly kill{1} the remaining villagers, causing the monster{0} to win.".format('s' if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']) > 1 else '', '' if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']) > 1 else 's')
+        if counts['monster']:
+            return ['monster', "Game over! All the wolves are dead! As the villagers start preparing the BBQ, the monster{0} quickly kill{1} the remaining villagers, causing the monster{0} to win.".format('s' if counts['monster'] > 1 else '', '' if counts['monster'] > 1 else 's')]
+        elif counts['cultist'] + counts['minion'] == counts['wolf'] and session[6] == 'evilvillage':
+            return ['village', "Game over! All the wolves are dead! The villagers round up the remaining cultists, hang them, and live happily ever after."]
         else:
-            if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') in ['cultist', 'minion']]) == teams['wolf'] and session[6] == 'evilvillage':
-                win_team = 'village'
-                win_lore = "Game over! All the wolves are dead! The villagers round up the remaining cultists, hang them, and live happily ever after."
-            else:
-                win_team = 'village'
-                win_lore = 'All the wolves are dead! The surviving villagers gather the bodies of the dead wolves, roast them, and have a BBQ in celebration.'
-    elif teams['village'] >= teams['wolf'] and session[6] == 'evilvillage':
-        if [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']:
-            win_team = 'monster'
-            win_lore = "Game over! The number of uninjured cultists is equal or less than the number of living villagers! as the villagers regain control over the village, the monster{0} quickly kill{1} the remaining villagers, causing the monster{0} to win.".format('s' if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']) > 1 else '', '' if len([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'monster']) > 1 else 's')
-        elif not [x for x in session[1] if session[1][x][0] and get_role(x, 'role') in ['cultist', 'minion']]:
-            win_team = 'village'
-            win_lore = "Game over! All the cultists are dead! The now-exposed wolves are captured and killed by the remaining villagers. A BBQ party commences shortly thereafter."
+            return ['village', 'All the wolves are dead! The surviving villagers gather the bodies of the dead wolves, roast them, and have a BBQ in celebration.']
+    elif counts['village'] >= counts['wolf'] and session[6] == 'evilvillage':
+        if counts['monster']:
+            return ['monster', "Game over! The number of uninjured cultists is equal or less than the number of living villagers! as the villagers regain control over the village, the monster{0} quickly kill{1} the remaining villagers, causing the monster{0} to win.".format('s' if counts['monster'] > 1 else '', '' if counts['monster'] > 1 else 's')]
+        elif counts['cultist'] + counts['minion'] == 0:
+            return ['village', "Game over! All the cultists are dead! The now-exposed wolves are captured and killed by the remaining villagers. A BBQ party commences shortly thereafter."]
         else:
-            win_team = 'village'
-            win_lore = "Game over! The number of uninjured cultists is equal or less than the number of living villagers! They manage to regain control of the village and dispose of the remaining cultists."
-    else:
+            return ['village', "Game over! The number of uninjured cultists is equal or less than the number of living villagers! They manage to regain control of the village and dispose of the remaining cultists."]
+    return None
+
+def win_condition():
+    win_tally.flush()
+    counts = win_tally.counts
+    if WIN_CONDITION_DEBUG:
+        scanned = _count_win_teams()
+        if +counts != +scanned:
+            print("win_condition counts diverged from full scan: {} != {}".format(dict(+counts), dict(+scanned)))
+            counts = scanned
+    result = _decide_win_team(counts)
+    if not result:
         return None
-        
-        
+    win_team, win_lore = result
+    winners = []
     for player in session[1]:
-        lovers = []
-        for n in session[1][player][4]:
-            if n.startswith('lover:'):
-                lovers.append(n.split(':')[1])
+        lovers = session[1][player].lovers
         role = get_role(player, 'role')
         templates = get_role(player, 'templates')
         if get_role(player, 'role') == 'piper' and win_team == 'pipers':
@@ -3425,7 +4334,7 @@ def win_condition():
             winners.append(player)
         if [x for x in lovers if (session[1][x][0] and session[1][player][0])]:
             winners.append(player)
-        if get_role(player, 'role') == 'vengeful ghost' and not session[1][player][0] and [x.split(':')[1] for x in session[1][player][4] if x.startswith("vengeance:")] and [x.split(':')[1] for x in session[1][player][4] if x.startswith("vengeance:")].pop() != win_team:
+        if get_role(player, 'role') == 'vengeful ghost' and not session[1][player][0] and session[1][player][4].values('vengeance') and session[1][player][4].values('vengeance').pop() != win_team:
             winners.append(player)
         if (get_role(player, 'role') == 'amnesiac' or (get_role(player, 'role') == 'vengeful ghost' and session[1][player][0]) and win_team == 'village'):
             winners.append(player)
@@ -3493,10 +4402,8 @@ def end_game_stats():
     lovers = []
 
     for player in session[1]:
-        for o in session[1][player][4]:
-            if o.startswith("lover:"):
-                lover = o.split(':')[1]
-                lovers.append(tuple(sort_players([player, lover])))
+        for lover in session[1][player].lovers:
+            lovers.append(tuple(sort_players([player, lover])))
     lovers = list(set(lovers))
     # create a list of unique lover pairs
     sorted_second_lover = sort_players(x[1] for x in lovers)
@@ -3529,57 +4436,105 @@ def end_game_stats():
     return role_msg
 
 def get_name(player):
-    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+    player_index.refresh()
+    if player in player_index.names:
+        return player_index.names[player]
+    member = transport.server.get_member(player)
     if member:
         return str(member.display_name)
     else:
         return str(player)
 
+class PlayerIndex:
+    # Lookup tables for get_player(), get_name() and sort_players(), rebuilt only when the roster changes
+    # or a player's member info is updated
+    def __init__(self):
+        self.players = None
+
+    def invalidate(self):
+        self.players = None
+
+    def refresh(self):
+        if self.players is session[1] and self.roster_version == session[1].roster_version:
+            return
+        self.players = session[1]
+        self.roster_version = session[1].roster_version
+        self.ids = {}
+        self.users = [] # sorted (lowercased name, player); fake players are indexed by id
+        self.nicks = [] # sorted (lowercased display name, player)
+        self.discriminators = {}
+        self.members = [] # (lowercased name, lowercased display name, player) for substring matches
+        self.names = {}
+        self.sort_keys = {}
+        server = transport.server
+        for player in session[1]:
+            self.ids[player.lower()] = player
+            member = server.get_member(player)
+            if member:
+                self.names[player] = str(member.display_name)
+                self.sort_keys[player] = (0, self.names[player])
+                self.users.append((member.name.lower(), player))
+                self.nicks.append((member.display_name.lower(), player))
+                self.discriminators.setdefault(member.discriminator, []).append(player)
+                self.members.append((member.name.lower(), member.display_name.lower(), player))
+            else:
+                self.names[player] = str(player)
+                self.sort_keys[player] = (1, int(player))
+                self.users.append((player.lower(), player))
+        self.users.sort()
+        self.nicks.sort()
+        self.order = tuple(sorted(session[1], key=self.sort_keys.__getitem__))
+
+    def sort_key(self, player):
+        # real members by display name, then fake players by id
+        if player in self.sort_keys:
+            return self.sort_keys[player]
+        if transport.server.get_member(player):
+            return (0, get_name(player))
+        return (1, int(player))
+
+    def unique_prefix(self, table, string):
+        # the single player with an entry in table starting with string, or None
+        i = bisect_left(table, (string,))
+        match = None
+        while i < len(table) and table[i][0].startswith(string):
+            if match is not None:
+                return None
+            match = table[i][1]
+            i += 1
+        return match
+
+player_index = PlayerIndex()
+
 def get_player(string):
     string = string.lower()
-    users = []
-    discriminators = []
-    nicks = []
-    users_contains = []
-    nicks_contains = []
-    for player in session[1]:
-        if string == player.lower() or string.strip('<@!>') == player:
-            return player
-        member = client.get_server(WEREWOLF_SERVER).get_member(player)
-        if member:
-            if member.name.lower().startswith(string):
-                users.append(player)
-            if string.strip('#') == member.discriminator:
-                discriminators.append(player)
-            if member.display_name.lower().startswith(string):
-                nicks.append(player)
-            if string in member.name.lower():
-                users_contains.append(player)
-            if string in member.display_name.lower():
-                nicks_contains.append(player)
-        elif get_player(player).lower().startswith(string):
-            users.append(player)
-    if len(users) == 1:
-        return users[0]
+    player_index.refresh()
+    if string in player_index.ids:
+        return player_index.ids[string]
+    if string.strip('<@!>') in session[1]:
+        return string.strip('<@!>')
+    player = player_index.unique_prefix(player_index.users, string)
+    if player:
+        return player
+    discriminators = player_index.discriminators.get(string.strip('#'), [])
     if len(discriminators) == 1:
         return discriminators[0]
-    if len(nicks) == 1:
-        return nicks[0]
+    player = player_index.unique_prefix(player_index.nicks, string)
+    if player:
+        return player
+    users_contains = [x[2] for x in player_index.members if string in x[0]]
     if len(users_contains) == 1:
         return users_contains[0]
+    nicks_contains = [x[2] for x in player_index.members if string in x[1]]
     if len(nicks_contains) == 1:
         return nicks_contains[0]
     return None
 
 def sort_players(players):
-    fake = []
-    real = []
-    for player in players:
-        if client.get_server(WEREWOLF_SERVER).get_member(player):
-            real.append(player)
-        else:
-            fake.append(player)
-    return sorted(real, key=get_name) + sorted(fake, key=int)
+    player_index.refresh()
+    if players is session[1]:
+        return list(player_index.order)
+    return sorted(players, key=player_index.sort_key)
 
 def get_role(player, level):
     # level: {team: reveal team only; actualteam: actual team; seen: what the player is seen as; death: role taking into account cursed and cultist and traitor; actual: actual role}
@@ -3588,55 +4543,63 @@ def get_role(player, level):
     # so you always have exactly 1 role, but can have 0 or more templates on top of that
     # revealing totem (and similar powers, like detective id) only reveal roles
     if player in session[1]:
-        role = session[1][player][1]
-        templates = session[1][player][3]
-        if level == 'team':
-            if roles[role][0] == 'wolf':
-                if not role in ROLES_SEEN_VILLAGER:
-                    return "wolf"
-            return "village"
-        elif level == 'actualteam':
-            return roles[role][0]
-        elif level == 'seen':
-            seen_role = None
-            if role in ROLES_SEEN_WOLF:
+        if level == 'role':
+            return session[1][player][1]
+        elif level == 'templates':
+            return session[1][player][3]
+        views = session[1][player].role_views()
+        if level not in views:
+            views[level] = _get_role_view(player, level)
+        return views[level]
+    return None
+
+def _get_role_view(player, level):
+    # uncached part of get_role(); only depends on the player's role and templates
+    role = session[1][player][1]
+    templates = session[1][player][3]
+    if level == 'team':
+        if roles[role][0] == 'wolf':
+            if not role in ROLES_SEEN_VILLAGER:
+                return "wolf"
+        return "village"
+    elif level == 'actualteam':
+        return roles[role][0]
+    elif level == 'seen':
+        seen_role = None
+        if role in ROLES_SEEN_WOLF:
+            seen_role = 'wolf'
+        elif session[1][player][1] in ROLES_SEEN_VILLAGER:
+            seen_role = 'villager'
+        else:
+            seen_role = role
+        for template in templates:
+            if template in ROLES_SEEN_WOLF:
                 seen_role = 'wolf'
-            elif session[1][player][1] in ROLES_SEEN_VILLAGER:
-                seen_role = 'villager'
-            else:
-                seen_role = role
-            for template in templates:
-                if template in ROLES_SEEN_WOLF:
-                    seen_role = 'wolf'
-                    break
-                if template in ROLES_SEEN_VILLAGER:
-                    seen_role = 'villager'
-            return seen_role
-        elif level == 'seenoracle':
-            seen_role = get_role(player, 'seen')
-            if seen_role != 'wolf':
+                break
+            if template in ROLES_SEEN_VILLAGER:
                 seen_role = 'villager'
-            return seen_role
-        elif level == 'death':
-            returnstring = ''
-            if role == 'traitor':
-                returnstring += 'villager'
-            else:
-                returnstring += role
-            return returnstring
-        elif level == 'deathstats':
-            returnstring = ''
-            if role == 'traitor':
-                returnstring += 'villager'
-            else:
-                returnstring += role
-            return returnstring
-        elif level == 'role':
-            return role
-        elif level == 'templates':
-            return templates
-        elif level == 'actual':
-            return ' '.join(templates + [role])
+        return seen_role
+    elif level == 'seenoracle':
+        seen_role = get_role(player, 'seen')
+        if seen_role != 'wolf':
+            seen_role = 'villager'
+        return seen_role
+    elif level == 'death':
+        returnstring = ''
+        if role == 'traitor':
+            returnstring += 'villager'
+        else:
+            returnstring += role
+        return returnstring
+    elif level == 'deathstats':
+        returnstring = ''
+        if role == 'traitor':
+            returnstring += 'villager'
+        else:
+            returnstring += role
+        return returnstring
+    elif level == 'actual':
+        return ' '.join(templates + [role])
     return None
 
 def get_roles(gamemode, players):
@@ -3668,7 +4631,7 @@ def get_roles(gamemode, players):
                     available_roles = [x for x in roles if x not in TEMPLATES_ORDERED\
                                         and x not in ('villager', 'cultist')]
                     gamemode_roles = dict((x, 0) for x in available_roles)
-                    gamemode_roles[random.choice([x for x in ACTUAL_WOLVES if x != 'wolf cub'])] += 1 # ensure at least 1 wolf that can kill
+                    gamemode_roles[random.choice(sorted(x for x in ACTUAL_WOLVES if x != 'wolf cub'))] += 1 # ensure at least 1 wolf that can kill
                     for i in range(players - 1):
                         gamemode_roles[random.choice(available_roles)] += 1
                     gamemode_roles['cursed villager'] = random.randrange(int(players/3))
@@ -3716,6 +4679,112 @@ def get_votes(totem_dict):
                 vote_dict[p] += 1
     return vote_dict
 
+class VoteLedger:
+    # Running lynch tally for the current day, equivalent to get_votes() but updated one player at a time.
+    # refresh(player) must be called whenever a player's vote, life, injury or voting totems change.
+    def __init__(self):
+        self.wakeup = asyncio.Event()
+        self.clear()
+
+    def clear(self):
+        self.active = False
+        self.ballots = {} # player : (alive, able, totem, target, weight)
+        self.tally = {'abstain' : 0}
+        self.impatient = set()
+        self.alive = set()
+        self.able = 0
+        self.pending = 0 # living players who have not voted yet (mudkip)
+
+    def start(self):
+        self.clear()
+        self.active = True
+        for player in session[1]:
+            self.refresh(player)
+        self.wake()
+
+    def stop(self):
+        self.clear()
+        self.wake()
+
+    def wake(self):
+        self.wakeup.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), max(timeout, 0))
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+
+    def _ballot(self, player):
+        if player not in session[1] or not session[1][player][0]:
+            return None
+        other = session[1][player][4]
+        able = 'injured' not in other
+        totem = other.count('impatience_totem') - other.count('pacifism_totem')
+        target = session[1][player][2]
+        weight = 2 if 'influence_totem' in other and target != 'abstain' else 1
+        return (True, able, totem, target, weight)
+
+    def _apply(self, player, ballot, sign):
+        _, able, totem, target, weight = ballot
+        if sign > 0:
+            self.alive.add(player)
+        else:
+            self.alive.discard(player)
+        if not target:
+            self.pending += sign
+        if not able:
+            return
+        self.able += sign
+        if totem > 0:
+            if sign > 0:
+                self.impatient.add(player)
+            else:
+                self.impatient.discard(player)
+        elif totem < 0:
+            self.tally['abstain'] += sign
+        elif target:
+            self.tally[target] = self.tally.get(target, 0) + sign * weight
+
+    def votes_for(self, player):
+        if player == 'abstain':
+            return self.tally['abstain']
+        if player not in self.alive:
+            return 0
+        return self.tally.get(player, 0) + len(self.impatient) - (player in self.impatient)
+
+    def refresh(self, player):
+        if not self.active:
+            return
+        old = self.ballots.pop(player, None)
+        new = self._ballot(player)
+        if old == new:
+            if new:
+                self.ballots[player] = new
+            return
+        before = (self.able, len(self.impatient), len(self.alive))
+        if old:
+            self._apply(player, old, -1)
+        if new:
+            self.ballots[player] = new
+            self._apply(player, new, 1)
+        # only wake the day loop if this change could have settled the vote
+        if (self.able, len(self.impatient), len(self.alive)) != before or self.pending == 0 \
+           or self.tally['abstain'] >= self.able / 2 or (new and self.votes_for(new[3]) >= self.able // 2 + 1):
+            self.wake()
+
+    def totem_dict(self):
+        return {x : self.ballots[x][2] for x in self.ballots}
+
+    def vote_dict(self):
+        vote_dict = {'abstain' : self.tally['abstain']}
+        for player in self.alive:
+            vote_dict[player] = self.votes_for(player)
+        return vote_dict
+
+vote_ledger = VoteLedger()
+
 def _autocomplete(string, lst):
     if string in lst:
         return (string, 1)
@@ -3767,100 +4836,118 @@ def verify_gamemodes(verbose=True):
         return good
 
 async def wolfchat(message, author=''):
-    if isinstance(message, discord.Message):
+    if isinstance(message, str):
+        msg = message
+    else:
         author = message.author.id
         msg = message.content
-    else:
-        msg = str(message)
 
-    member = client.get_server(WEREWOLF_SERVER).get_member(author)
+    member = transport.server.get_member(author)
     if member:
         athr = member.display_name
     else:
         athr = author
-    for wolf in [x for x in session[1] if x != author and session[1][x][0] and session[1][x][1] in WOLFCHAT_ROLES and client.get_server(WEREWOLF_SERVER).get_member(x)]:
-        try:
-            pfx = "**[Wolfchat]**"
-            if athr != '':
-                pfx += " message from **{}**".format(athr)
-            await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(wolf), "{}: {}".format(pfx, msg))
-        except discord.Forbidden:
-            pass
-
-async def player_idle(message):
-    while message.author.id in session[1] and not session[0]:
-        await asyncio.sleep(1)
-    while message.author.id in session[1] and session[0] and session[1][message.author.id][0]:
-        def check(msg):
-            if not message.author.id in session[1] or not session[1][message.author.id][0] or not session[0]:
-                return True
-            if msg.author.id == message.author.id and msg.channel.id == client.get_channel(GAME_CHANNEL).id:
-                return True
-            return False
-        msg = await client.wait_for_message(author=message.author, channel=client.get_channel(GAME_CHANNEL), timeout=PLAYER_TIMEOUT, check=check)
-        if msg == None and message.author.id in session[1] and session[0] and session[1][message.author.id][0]:
-            await send_lobby(message.author.mention + "**, you have been idling for a while. Please say something soon or you might be declared dead.**")
-            try:
-                await client.send_message(message.author, "**You have been idling in #" + client.get_channel(GAME_CHANNEL).name + " for a while. Please say something soon or you might be declared dead.**")
-            except discord.Forbidden:
-                pass
-            msg = await client.wait_for_message(author=message.author, channel=client.get_channel(GAME_CHANNEL), timeout=PLAYER_TIMEOUT2, check=check)
-            if msg == None and message.author.id in session[1] and session[0] and session[1][message.author.id][0]:
-                if session[6] == 'noreveal':
-                    await send_lobby("**" + get_name(message.author.id) + "** didn't get out of bed for a very long time and has been found dead.")
-                else:
-                    await send_lobby("**" + get_name(message.author.id) + "** didn't get out of bed for a very long time and has been found dead. "
-                                          "The survivors bury the **" + get_role(message.author.id, 'death') + '**.')
-                if message.author.id in stasis:
-                    stasis[message.author.id] += QUIT_GAME_STASIS
-                else:
-                    stasis[message.author.id] = QUIT_GAME_STASIS
-                await player_deaths({message.author.id : ('idle', "bot")})
-                await check_traitor()
-                await log(1, "{} ({}) IDLE OUT".format(message.author.display_name, message.author.id))
+    pfx = "**[Wolfchat]**"
+    if athr != '':
+        pfx += " message from **{}**".format(athr)
+    await fan_out(transport.send_message(transport.server.get_member(wolf), "{}: {}".format(pfx, msg))
+                  for wolf in [x for x in session[1] if x != author and session[1][x][0] and session[1][x][1] in WOLFCHAT_ROLES and transport.server.get_member(x)])
+
+def note_activity(message):
+    # anything a living player says in the lobby channel during the game keeps them from idling out
+    if session[0] and message.channel.id == GAME_CHANNEL and message.author.id in session[1]:
+        last_activity[message.author.id] = time.monotonic()
+        idle_warned.pop(message.author.id, None)
+
+async def idle_out(player):
+    member = transport.server.get_member(player)
+    if session[6] == 'noreveal':
+        await send_lobby("**" + get_name(player) + "** didn't get out of bed for a very long time and has been found dead.")
+    else:
+        await send_lobby("**" + get_name(player) + "** didn't get out of bed for a very long time and has been found dead. "
+                              "The survivors bury the **" + get_role(player, 'death') + '**.')
+    add_stasis(player, QUIT_GAME_STASIS)
+    await player_deaths({player : ('idle', "bot")})
+    await check_traitor()
+    await log(1, "{} ({}) IDLE OUT".format(member.display_name if member else get_name(player), player))
+
+async def idle_sweep_loop():
+    # One loop for every player instead of a waiting task each: warns whoever has been quiet in the lobby channel for
+    # PLAYER_TIMEOUT seconds and idles them out if they stay quiet for PLAYER_TIMEOUT2 more, then sleeps until the
+    # next of those deadlines. The clock starts for everyone when the game (or this run of it) does.
+    last_activity.clear()
+    idle_warned.clear()
+    start = time.monotonic()
+    while session[0]:
+        now = time.monotonic()
+        next_check = now + PLAYER_TIMEOUT
+        for player in [x for x in session[1] if session[1][x][0]]:
+            if not session[0]:
+                return
+            if not session[1][player][0]:
+                # died while an earlier player in this sweep was warned or idled out
+                continue
+            if player in idle_warned:
+                deadline = idle_warned[player] + PLAYER_TIMEOUT2
+                if now >= deadline:
+                    del idle_warned[player]
+                    await idle_out(player)
+                    continue
+            else:
+                deadline = last_activity.get(player, start) + PLAYER_TIMEOUT
+                if now >= deadline:
+                    idle_warned[player] = now
+                    deadline = now + PLAYER_TIMEOUT2
+                    member = transport.server.get_member(player)
+                    await send_lobby("<@" + player + ">**, you have been idling for a while. Please say something soon or you might be declared dead.**")
+                    try:
+                        if member:
+                            await transport.send_message(member, "**You have been idling in #" + transport.get_channel(GAME_CHANNEL).name + " for a while. Please say something soon or you might be declared dead.**")
+                    except discord.Forbidden:
+                        pass
+            next_check = min(next_check, deadline)
+        await scheduler.wait(lambda: not session[0], next_check - time.monotonic(), 'game')
 
 def is_online(user_id):
-    member = client.get_server(WEREWOLF_SERVER).get_member(user_id)
+    member = transport.server.get_member(user_id)
     if member:
         if member.status in [discord.Status.online, discord.Status.idle]:
             return True
     return False
 
 async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_team), ...}
+    # their PLAYERS_ROLE is taken away all at once at the end instead of one player at a time
+    unroled = []
     for player in players_dict:
         reason = players_dict[player][0]
         kill_team = players_dict[player][1]
         if player not in session[1]:
-            return
+            break
         ingame = 'IN GAME'
         if session[0] and reason != 'game cancel':
             session[1][player][0] = False
-            lovers = []
-            for o in session[1][player][4]:
-                if o.startswith('lover:'):
-                    lovers.append(o.split(":")[1])
+            vote_ledger.refresh(player)
+            lovers = session[1][player].lovers
             assassin_target = ""
-            for o in session[1][player][4]:
-                if o.startswith('assassinate:') and "assassin" in get_role(player, "templates") and kill_team != "bot":
-                    assassin_target = o.split(":")[1]
-                    break
+            if session[1][player].assassinate_target and "assassin" in get_role(player, "templates") and kill_team != "bot":
+                assassin_target = session[1][player].assassinate_target
                     
             if session[0]:
                 if assassin_target:
-                    if session[1][assassin_target][0] and assassin_target not in players_dict and not ("protection_totem2" in session[1][assassin_target][4] or "guarded" in session[1][assassin_target][4]) and not 'blessed' in get_role(assassin_target, 'templates') and not [x for x in session[1][assassin_target][4] if x.startswith('bodyguard:')]:
+                    if session[1][assassin_target][0] and assassin_target not in players_dict and not ("protection_totem2" in session[1][assassin_target][4] or "guarded" in session[1][assassin_target][4]) and not 'blessed' in get_role(assassin_target, 'templates') and not session[1][assassin_target][4].values('bodyguard'):
                         await send_lobby("Before dying, **{0}** quickly slits **{1}**'s throat. The village mourns the loss of a{2} **{3}**.".format(get_name(player), get_name(assassin_target), "n" if get_role(assassin_target, "death").lower()[0] in ['a', 'e', 'i', 'o', 'u'] else "", get_role(assassin_target, "death")))
                         await player_deaths({assassin_target : ("assassination", get_role(player, 'actualteam'))})
                     elif 'blessed' in get_role(assassin_target, 'templates'):
                         try:
-                            await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(player), "**{0}** seems to be blessed, causing your assassination attempt to fail.".format(get_name(assassin_target)))
+                            await transport.send_message(transport.server.get_member(player), "**{0}** seems to be blessed, causing your assassination attempt to fail.".format(get_name(assassin_target)))
                         except discord.Forbidden:
                             pass
                     elif "protection_totem2" in session[1][assassin_target][4]:
                         await send_lobby("Before dying, **{0}** quickly attempts to slit **{1}**'s throat; however, {1}'s totem emits a brilliant flash of light, causing the attempt to miss.".format(get_name(player), get_name(assassin_target)))
                     elif "guarded" in session[1][assassin_target][4]:
                         await send_lobby("Before dying, **{0}** quickly attempts to slit **{1}**'s throat; however, a guardian angel was on duty and able to foil the attempt.".format(get_name(player), get_name(assassin_target)))
-                    elif [x for x in session[1][assassin_target][4] if x.startswith('bodyguard:')]:
-                        await send_lobby("Sensing danger, **{2}** shoves **{1}** aside to save them from **{0}**.".format(get_name(player), get_name(assassin_target), get_name([x for x in session[1][assassin_target][4] if x.startswith('bodyguard:')].pop().split(':')[1])))
+                    elif session[1][assassin_target][4].values('bodyguard'):
+                        await send_lobby("Sensing danger, **{2}** shoves **{1}** aside to save them from **{0}**.".format(get_name(player), get_name(assassin_target), get_name(session[1][assassin_target][4].values('bodyguard').pop())))
                 for lover in lovers:
                     if session[1][lover][0] and kill_team != "bot" and lover not in players_dict:
                         await send_lobby("Saddened by the loss of their lover, **{0}**, a{1} **{2}**, commits suicide.".format(get_name(lover), "n" if get_role(lover, "death").lower()[0] in ['a', 'e', 'i', 'o', 'u'] else "", get_role(lover, "death")))
@@ -3932,7 +5019,7 @@ async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_te
                 
                 #clone taking the dead's role
                 for clone in [x for x in session[1] if (session[1][x][0] and get_role(x, 'role') == "clone" and "clone:{}".format(player) in session[1][x][4])]:
-                    member = client.get_server(WEREWOLF_SERVER).get_member(clone)
+                    member = transport.server.get_member(clone)
                     role = get_role(player, 'role')
                     cloning = player
                     #finding final target from who the clones were cloning
@@ -3945,14 +5032,14 @@ async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_te
                                 role == get_role(cloning, 'role')
                         if member:
                             try:
-                                await client.send_message(member, "Your target was a clone and you are now cloning their target, **{0}**.".format(get_name(cloning)))
+                                await transport.send_message(member, "Your target was a clone and you are now cloning their target, **{0}**.".format(get_name(cloning)))
                             except discord.Forbidden:
                                 pass
                                 
                     #if the clone target is dead (in case we cloned a clone but their target is alive)
                     if not session[1][cloning][0]:
                         if role == "amnesiac":
-                            role = [x.split(':')[1].replace("_", " ") for x in session[1][player][4] if x.startswith("role:")].pop()
+                            role = [x.replace("_", " ") for x in session[1][player][4].values('role')].pop()
                         if role == "priest" and bless in session[1][player][4]:
                             session[1][clone][4].append("bless")
                         elif role == "hunter" and "hunterbullet" in session[1][player][4]:
@@ -3964,8 +5051,8 @@ async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_te
                         elif role == "executioner":
                             if 'win' in session[1][player][4]:
                                 session[1][clone][4].append('win')
-                            if [x for x in session[1][player][4] if x.startswith('execute:')]:
-                                session[1][clone][4].append([x for x in session[1][player][4] if x.startswith('execute:')][0])
+                            if session[1][player][4].values('execute'):
+                                session[1][clone][4].append('execute:' + session[1][player][4].values('execute')[0])
                             else:
                                 if [x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village']:
                                     session[1][clone][4].append('execute:{}'.format(random.choice([x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village'])))
@@ -3977,7 +5064,7 @@ async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_te
                         session[1][clone][1] = role
                         if member:
                             try:
-                                await client.send_message(member, "You have cloned your target and are now a **{0}**.".format(role))
+                                await transport.send_message(member, "You have cloned your target and are now a **{0}**.".format(role))
                                 if role == 'executioner':
                                     try:
                                         await _send_role_info(clone, sendrole=False)
@@ -4007,33 +5094,33 @@ async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_te
                     else:
                         for entranced in [x for x in session[1] if session[1][x][0] and 'entranced' in session[1][x][4] and x not in players_dict]:
                             session[1][entranced][4].remove('entranced')
-                            member = client.get_server(WEREWOLF_SERVER).get_member(entranced)
+                            member = transport.server.get_member(entranced)
                             if member:
                                 try:
-                                    await client.send_message(member, "You are no longer entranced. **Your win conditions have reset to normal.**")
+                                    await transport.send_message(member, "You are no longer entranced. **Your win conditions have reset to normal.**")
                                 except discord.Forbidden:
                                     pass
                 if get_role(player, 'role') == "vengeful ghost" and (kill_team != "bot" and not reason == 'gunner suicide'):
                     session[1][player][4].append("vengeance:{}".format(kill_team))
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if member:
                         try:
-                            await client.send_message(member, "OOOooooOOOOooo! You are the **vengeful ghost**. It is now your job to exact your revenge on the **{0}** that killed you.".format('villagers' if kill_team == 'village' else 'wolves'))
+                            await transport.send_message(member, "OOOooooOOOOooo! You are the **vengeful ghost**. It is now your job to exact your revenge on the **{0}** that killed you.".format('villagers' if kill_team == 'village' else 'wolves'))
                         except discord.Forbidden:
                             pass
                 if get_role(player, 'role') == 'piper' and not [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'piper']:
                     for player_ in session[1]:
                         session[1][player_][4] = [x for x in session[1][player_][4] if not x in ['charmed', 'tocharm']]
                 for plr in [x for x in session[1] if session[1][x][0]]:
-                    if get_role(plr, 'role') == 'executioner' and 'win' not in session[1][plr][4] and [x for x in session[1][plr][4] if x.startswith('execute:')]:
-                        if [x for x in session[1][plr][4] if x.startswith('execute:')][0].strip('execute:') == player:
+                    if get_role(plr, 'role') == 'executioner' and 'win' not in session[1][plr][4] and session[1][plr].execute_target:
+                        if session[1][plr].execute_target == player:
                             session[1][plr][1] = 'jester'
                             session[1][plr][4].append('executioner')
-                            session[1][plr][4].remove([x for x in session[1][plr][4] if x.startswith('execute:')][0])
-                            member = client.get_server(WEREWOLF_SERVER).get_member(plr)
+                            session[1][plr][4].remove('execute:' + session[1][plr][4].values('execute')[0])
+                            member = transport.server.get_member(plr)
                             if member:
                                 try:
-                                    await client.send_message(member, 'Your target has died, not via lynch. You have now become a **jester**.')
+                                    await transport.send_message(member, 'Your target has died, not via lynch. You have now become a **jester**.')
                                 except discord.Forbidden:
                                     pass
                 #timelord stuff
@@ -4053,20 +5140,28 @@ async def player_deaths(players_dict): # players_dict = {dead : (reason, kill_te
         else:
             ingame = 'NOT IN GAME'
             del session[1][player]
-        member = client.get_server(WEREWOLF_SERVER).get_member(player)
+        member = transport.server.get_member(player)
         if member:
-            await client.remove_roles(member, PLAYERS_ROLE)
+            unroled.append(member)
         if session[0] and kill_team != "bot":
             if get_role(player, 'role') == 'wolf cub':
                 for p in session[1]:
-                    if session[1][p][0] and get_role(p, 'role') in ACTUAL_WOLVES + ['traitor']:
+                    if session[1][p][0] and get_role(p, 'role') in ACTUAL_WOLVES | {'traitor'}:
                         session[1][p][4].append('angry')
         for p in [x for x in session[1] if "assassin" in get_role(x, "templates") and "assassinate:{}".format(player) in session[1][x][4]]:
             session[1][p][4] = [x for x in session[1][p][4] if x != "assassinate:{}".format(player)]
             if get_role(p, 'role') == 'village drunk':
                 session[1][p][4].append('assassinate:{}'.format(random.choice([x for x in session[1] if x != p])))
                 
-        await log(0, "{} ({}) PLAYER DEATH {} FOR {}".format(get_name(player), player, ingame, reason))
+        signal_phase_event()
+        await phase_bus.publish('death', player, reason, kill_team)
+        if reason == 'lynch':
+            await phase_bus.publish('lynch', player, kill_team)
+        await log(0, "{} ({}) PLAYER DEATH {} FOR {}", lambda: get_name(player), player, ingame, reason, user=player)
+    if not session[1]:
+        # nobody left to wait for
+        scheduler.cancel('lobby')
+    await apply_role_changes(PLAYERS_ROLE, remove=unroled)
 
 async def check_traitor():
     if not session[0] and win_condition() == None:
@@ -4076,8 +5171,8 @@ async def check_traitor():
         if 'traitor' in other:
             # traitor already turned
             return
-    wolf_team_alive = [x for x in session[1] if session[1][x][0] and get_role(x, 'role') in [
-        'traitor'] + ACTUAL_WOLVES]
+    wolf_team_alive = [x for x in session[1] if session[1][x][0] and get_role(x, 'role') in
+        ACTUAL_WOLVES | {'traitor'}]
     if len(wolf_team_alive) == 0:
         # no wolves alive; don't play traitor turn message
         return
@@ -4090,10 +5185,10 @@ async def check_traitor():
             for cub in cubs:
                 session[1][cub][4].append('wolf_cub')
                 session[1][cub][1] = 'wolf'
-                member = client.get_server(WEREWOLF_SERVER).get_member(cub)
+                member = transport.server.get_member(cub)
                 if member:
                     try:
-                        await client.send_message(member, "You have grown up into a wolf and vowed to take revenge for your dead parents!")
+                        await transport.send_message(member, "You have grown up into a wolf and vowed to take revenge for your dead parents!")
                     except discord.Forbidden:
                         pass
                     await send_lobby("**The villagers listen horrified as they hear growling deepen in pitch. The wolf will do whatever it takes to avenge their parents!**")
@@ -4103,10 +5198,10 @@ async def check_traitor():
         for traitor in traitors:
             session[1][traitor][4].append('traitor')
             session[1][traitor][1] = 'wolf'
-            member = client.get_server(WEREWOLF_SERVER).get_member(traitor)
+            member = transport.server.get_member(traitor)
             if member:
                 try:
-                    await client.send_message(member, "HOOOOOOOOOWL. You have become... a wolf!\nIt is up to you to avenge your fallen leaders!")
+                    await transport.send_message(member, "HOOOOOOOOOWL. You have become... a wolf!\nIt is up to you to avenge your fallen leaders!")
                 except discord.Forbidden:
                     pass
         if session[6] != 'noreveal':
@@ -4119,10 +5214,104 @@ def sort_roles(role_list):
         result += [role] * role_list.count(role)
     return result
 
+class GameSnapshot:
+    # Keeps GAME_SNAPSHOT_FILE in step with the running game so it can be picked up again after a restart.
+    # save() writes right away and is used at phase changes; request() is for commands and writes once
+    # GAME_SNAPSHOT_DELAY seconds after the first change, so a burst of commands costs one write.
+    VERSION = 1
+
+    def __init__(self):
+        self.requested = False
+        self.lock = asyncio.Lock()
+        self.worker = None
+
+    @staticmethod
+    def dump():
+        phase = 1 if session[2] else 0
+        return {'version' : GameSnapshot.VERSION,
+                'day' : session[2],
+                # time already spent in the current phase, so the phase timer carries on where it was
+                'phase_elapsed' : (datetime.now() - session[3][phase]).total_seconds() if session[3][phase] else 0,
+                'elapsed' : [x.total_seconds() for x in session[4]],
+                'gamemode' : session[6],
+                'original_roles' : session[7],
+                'timers' : [day_warning, day_timeout, night_warning, night_timeout],
+                'night' : night,
+                'sunset_done' : sunset_done,
+                'sunrise_done' : sunrise_done,
+                'players' : [[player, state.alive, state.role, state.action, list(state.templates), list(state.other)]
+                             for player, state in session[1].items()]}
+
+    @staticmethod
+    def load(data):
+        global day_warning, day_timeout, night_warning, night_timeout, night, sunset_done, sunrise_done
+        if data.get('version') != GameSnapshot.VERSION:
+            return False
+        now = datetime.now()
+        phase_start = [now, now]
+        phase_start[1 if data['day'] else 0] = now - timedelta(seconds=data['phase_elapsed'])
+        players = PlayerDict()
+        for player, alive, role, action, templates, other in data['players']:
+            players[player] = PlayerState(alive, role, action, templates, other)
+        session[1] = players
+        session[2] = data['day']
+        session[3] = phase_start
+        session[4] = [timedelta(seconds=x) for x in data['elapsed']]
+        session[6] = data['gamemode']
+        session[7] = data['original_roles']
+        day_warning, day_timeout, night_warning, night_timeout = data['timers']
+        # older snapshots go back through sunset, as they did before these were saved
+        night = data.get('night', 1)
+        sunset_done = data.get('sunset_done', False)
+        sunrise_done = data.get('sunrise_done', False)
+        session[0] = True
+        return True
+
+    def request(self):
+        self.requested = True
+        if not self.worker or self.worker.done():
+            self.worker = asyncio.ensure_future(self.run())
+
+    async def run(self):
+        await asyncio.sleep(GAME_SNAPSHOT_DELAY)
+        if self.requested:
+            await self.save()
+
+    async def save(self):
+        self.requested = False
+        if not session[0]:
+            return
+        text = json.dumps(self.dump())
+        async with self.lock:
+            try:
+                await client.loop.run_in_executor(None, _replace_file, GAME_SNAPSHOT_FILE, text)
+            except OSError:
+                await log(2, "Could not save game snapshot: ```py\n{}\n```", traceback.format_exc())
+
+    async def clear(self):
+        self.requested = False
+        async with self.lock:
+            if os.path.isfile(GAME_SNAPSHOT_FILE):
+                await client.loop.run_in_executor(None, os.remove, GAME_SNAPSHOT_FILE)
+
+    def restore(self):
+        # called from on_ready before any commands are handled
+        if session[0] or not os.path.isfile(GAME_SNAPSHOT_FILE):
+            return False
+        try:
+            with open(GAME_SNAPSHOT_FILE, 'r') as f:
+                return self.load(json.load(f))
+        except (ValueError, KeyError, TypeError):
+            print("Could not restore game snapshot:\n" + traceback.format_exc())
+            return False
+
+game_snapshot = GameSnapshot()
+
 async def run_game():
-    await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.dnd)
+    await transport.change_presence(game=transport.server.me.game, status=discord.Status.dnd)
     session[0] = True
     session[2] = False
+    scheduler.notify()
     if session[6] == '':
         vote_dict = {}
         for player in session[1]:
@@ -4188,19 +5377,19 @@ async def run_game():
     for player in session[1]:
         session[1][player][1] = ''
         session[1][player][2] = ''
-    perms = client.get_channel(GAME_CHANNEL).overwrites_for(client.get_server(WEREWOLF_SERVER).default_role)
+    perms = transport.get_channel(GAME_CHANNEL).overwrites_for(transport.server.default_role)
     perms.send_messages = False
-    await client.edit_channel_permissions(client.get_channel(GAME_CHANNEL), client.get_server(WEREWOLF_SERVER).default_role, perms)
+    await transport.edit_channel_permissions(transport.get_channel(GAME_CHANNEL), transport.server.default_role, perms)
     if not get_roles(session[6], len(session[1])):
         session[6] = 'default' # Fallback if invalid number of players for gamemode or invalid gamemode somehow
 
     for stasised in [x for x in stasis if stasis[x] > 0]:
-        stasis[stasised] -= 1
+        set_stasis(stasised, stasis[stasised] - 1)
     await send_lobby("<@{}>, Welcome to Werewolf, the popular detective/social party game (a theme of Mafia). "
                               "Using the **{}** game mode with **{}** players.\nAll players check for PMs from me for instructions. "
                               "If you did not receive a pm, please let {} know.".format('> <@'.join(sort_players(session[1])),
                               'roles' if session[6].startswith('roles') else session[6], len(session[1]),
-                              client.get_server(WEREWOLF_SERVER).get_member(OWNER_ID).name))
+                              transport.server.get_member(OWNER_ID).name))
     for i in range(RETRY_RUN_GAME):
         try:
             if datetime.now().date() == __import__('datetime').date(2018, 4, 1):
@@ -4212,15 +5401,25 @@ async def run_game():
         except:
             await log(2, "Role attribution failed with error: ```py\n{}\n```".format(traceback.format_exc()))
     else:
-        msg = await send_lobby("<@{}>, role attribution failed 3 times. Cancelling game. "
+        await flush_messages()
+        msg = await transport.send_message(transport.get_channel(GAME_CHANNEL), "<@{}>, role attribution failed 3 times. Cancelling game. "
                                                                           "Here is some debugging info:```py\n{}\n```".format(
                   '> <@'.join(sort_players(session[1])), session))
         await cmd_fstop(msg, '-force')
         return
 
+    await run_game_loop()
+
+async def resume_game():
+    await transport.change_presence(game=transport.server.me.game, status=discord.Status.dnd)
+    await log(2, "Resuming {} game with {} players from snapshot", session[6], len(session[1]))
+    await run_game_loop(resume=True)
+
+async def run_game_loop(resume=False):
+    client.loop.create_task(idle_sweep_loop())
     for i in range(RETRY_RUN_GAME):
         try:
-            if i == 0:
+            if i == 0 and not resume:
                 await game_loop()
             else:
                 await game_loop(session)
@@ -4230,7 +5429,8 @@ async def run_game():
                 '> <@'.join(sort_players(session[1])), session))
             await log(3, "Game loop broke with error: ```py\n{}\n```".format(traceback.format_exc()))
     else:
-        msg = await send_lobby("<@{}>, game loop broke 3 times. Cancelling game.".format(
+        await flush_messages()
+        msg = await transport.send_message(transport.get_channel(GAME_CHANNEL), "<@{}>, game loop broke 3 times. Cancelling game.".format(
                   '> <@'.join(sort_players(session[1])), session))
         await cmd_fstop(msg, '-force')
 
@@ -4240,79 +5440,100 @@ async def game_loop(ses=None):
                               "Using the **{}** game mode with **{}** players.\nAll players check for PMs from me for instructions. "
                               "If you did not receive a pm, please let {} know.".format('> <@'.join(sort_players(session[1])),
                               'roles' if session[6].startswith('roles') else session[6], len(session[1]),
-                              client.get_server(WEREWOLF_SERVER).get_member(OWNER_ID).name))
+                              transport.server.get_member(OWNER_ID).name))
         globals()['session'] = ses
-    await log(1, "Game object: ```py\n{}\n```".format(session))
-    night = 1
+        # pick the phase timer up where it was instead of restarting it
+        resume_elapsed = datetime.now() - session[3][1 if session[2] else 0]
+    else:
+        resume_elapsed = timedelta(0)
+    await log(1, "Game object: ```py\n{}\n```", session)
     global day_warning
     global day_timeout
     global night_warning
     global night_timeout
+    global night
+    global sunset_done
+    global sunrise_done
+    if not ses:
+        night = 1
+        sunset_done = False
+        sunrise_done = False
     # GAME START
     while win_condition() == None and session[0]:
         if not session[2]: # NIGHT
-            session[3][0] = datetime.now()
-            log_msg = ['SUNSET LOG:']
             num_kills = 1
-            for player in session[1]:
-                member = client.get_server(WEREWOLF_SERVER).get_member(player)
-                role = get_role(player, 'role')
-                if "silence_totem2" not in session[1][player][4]:
-                    if role in ['crazed shaman', 'wolf shaman'] and session[1][player][0]:
-                        if role == 'wolf shaman':
-                            if session[6] == "mudkip":
-                                session[1][player][4].append("totem:{}".format(random.choice(["protection_totem", "misdirection_totem"])))
-                            else:
-                                session[1][player][4].append("totem:{}".format(random.choice(WOLF_SHAMAN_TOTEMS)))
-                        elif role == 'crazed shaman':
-                            session[1][player][2] = random.choice(list(totems))
-                        log_msg.append("{} ({}) HAS {}".format(get_name(player), player, (session[1][player][2] if role != "wolf shaman" else [x.split(":")[1] for x in session[1][player][4] if x.startswith("totem:")].pop())))
-                    elif role == 'doomsayer':
-                        session[1][player][4].append('doom:{}'.format(random.choice(['sick', 'lycan', 'death'])))
-                    elif role == 'piper':
-                        session[1][player][4].append('charm')
-                else:
-                    if role in ['crazed shaman', 'piper'] and session[1][player][0]:
-                        session[1][player][2] = player
-                if role == 'shaman' and session[1][player][0]:
-                    if session[6] == "mudkip":
-                        session[1][player][2] = random.choice(
-                            ["pestilence_totem", "death_totem"]) if not night == 1 else "death_totem"
-                    elif session[6] == 'aleatoire':
-                        # protection (40%), death (20%), retribution (20%), silence (10%), desperation (5%), pestilence (5%).
-                        session[1][player][2] = random.choice(
-                            ["protection_totem"] * 8 + ["death_totem"] * 4 + ["retribution_totem"] * 4 + [
-                                "silence_totem"] * 2 + ["desperation_totem"] + ["pestilence_totem"])
-                    else:
-                        session[1][player][2] = random.choice(SHAMAN_TOTEMS)
-                    log_msg.append("{} ({}) HAS {}".format(get_name(player), player, session[1][player][2]))
-                elif role == 'hunter' and session[1][player][0] and 'hunterbullet' not in session[1][player][4]:
-                    session[1][player][2] = player
-                elif role == 'executioner' and session[1][player][0] and not [x for x in session[1][player][4] if x.startswith('execute:')]:
-                    if [x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village']:
-                        session[1][player][4].append('execute:{}'.format(random.choice([x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village'])))
+            # a game resumed from a snapshot taken during the night already went through this and announced the night
+            announce = not sunset_done
+            if not sunset_done:
+                session[3][0] = datetime.now()
+                log_msg = ['SUNSET LOG:']
+                role_info = []
+                for player in session[1]:
+                    member = transport.server.get_member(player)
+                    role = get_role(player, 'role')
+                    if "silence_totem2" not in session[1][player][4]:
+                        if role in ['crazed shaman', 'wolf shaman'] and session[1][player][0]:
+                            if role == 'wolf shaman':
+                                if session[6] == "mudkip":
+                                    session[1][player][4].append("totem:{}".format(random.choice(["protection_totem", "misdirection_totem"])))
+                                else:
+                                    session[1][player][4].append("totem:{}".format(random.choice(WOLF_SHAMAN_TOTEMS)))
+                            elif role == 'crazed shaman':
+                                session[1][player][2] = random.choice(list(totems))
+                            log_msg.append("{} ({}) HAS {}".format(get_name(player), player, (session[1][player][2] if role != "wolf shaman" else session[1][player][4].values('totem').pop())))
+                        elif role == 'doomsayer':
+                            session[1][player][4].append('doom:{}'.format(random.choice(['sick', 'lycan', 'death'])))
+                        elif role == 'piper':
+                            session[1][player][4].append('charm')
                     else:
-                        session[1][player][1] = 'jester'
-                        session[1][player][4].append('executioner')
-                        if night != 1:
-                            member = client.get_server(WEREWOLF_SERVER).get_member(player)
-                            if member:
-                                try:
-                                    await client.send_message(member, 'There are no available targets. You have now become a **jester**.')
-                                    await _send_role_info(player)
-                                except discord.Forbidden:
-                                    pass
-                if night == 1:
-                    await _send_role_info(player)
-                else:
-                    if role == 'executioner':
-                        pass
+                        if role in ['crazed shaman', 'piper'] and session[1][player][0]:
+                            session[1][player][2] = player
+                    if role == 'shaman' and session[1][player][0]:
+                        if session[6] == "mudkip":
+                            session[1][player][2] = random.choice(
+                                ["pestilence_totem", "death_totem"]) if not night == 1 else "death_totem"
+                        elif session[6] == 'aleatoire':
+                            # protection (40%), death (20%), retribution (20%), silence (10%), desperation (5%), pestilence (5%).
+                            session[1][player][2] = random.choice(
+                                ["protection_totem"] * 8 + ["death_totem"] * 4 + ["retribution_totem"] * 4 + [
+                                    "silence_totem"] * 2 + ["desperation_totem"] + ["pestilence_totem"])
+                        else:
+                            session[1][player][2] = random.choice(SHAMAN_TOTEMS)
+                        log_msg.append("{} ({}) HAS {}".format(get_name(player), player, session[1][player][2]))
+                    elif role == 'hunter' and session[1][player][0] and 'hunterbullet' not in session[1][player][4]:
+                        session[1][player][2] = player
+                    elif role == 'executioner' and session[1][player][0] and not session[1][player][4].values('execute'):
+                        if [x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village']:
+                            session[1][player][4].append('execute:{}'.format(random.choice([x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village'])))
+                        else:
+                            session[1][player][1] = 'jester'
+                            session[1][player][4].append('executioner')
+                            if night != 1:
+                                member = transport.server.get_member(player)
+                                if member:
+                                    try:
+                                        await transport.send_message(member, 'There are no available targets. You have now become a **jester**.')
+                                        await _send_role_info(player)
+                                    except discord.Forbidden:
+                                        pass
+                    if night == 1:
+                        role_info.append(_send_role_info(player))
                     else:
-                        await _send_role_info(player, sendrole=False)
-            await log(1, '\n'.join(log_msg))
+                        if role == 'executioner':
+                            pass
+                        else:
+                            role_info.append(_send_role_info(player, sendrole=False))
+                await fan_out(role_info)
+                await log(1, '\n'.join(log_msg))
+                sunset_done = True
             
-            session[3][0] = datetime.now()
-            await send_lobby("It is now **nighttime**.")
+            await flush_messages()
+            # the clock starts once the sunset backlog is out, so pacing it doesn't eat into the night
+            session[3][0] = datetime.now() - resume_elapsed
+            resume_elapsed = timedelta(0)
+            if announce:
+                await send_lobby("It is now **nighttime**.", PRIORITY_PHASE)
+            await game_snapshot.save()
             warn = False
             # NIGHT LOOP
             while win_condition() == None and not session[2] and session[0]:
@@ -4330,7 +5551,7 @@ async def game_loop(ses=None):
                         if role in ['shaman', 'crazed shaman'] and 'silence_totem2' not in session[1][player][4]:
                             end_night = end_night and (session[1][player][2] in session[1])
                         if role == "wolf shaman":
-                            end_night = end_night and not [x for x in session[1][player][4] if x.startswith("totem:")]
+                            end_night = end_night and not session[1][player].totem
                         if role == 'matchmaker':
                             end_night = end_night and 'match' not in session[1][player][4]
                         if role == 'clone':
@@ -4338,9 +5559,9 @@ async def game_loop(ses=None):
                         if role == 'piper':
                             end_night = end_night and 'charm' not in session[1][player][4]
                         if "assassin" in templates:
-                            end_night = end_night and [x for x in session[1][player][4] if x.startswith("assassinate:")]
+                            end_night = end_night and session[1][player].assassinate_target
                         if role == 'doomsayer':
-                            end_night = end_night and not [x for x in session[1][player][4] if x.startswith("doom:")]
+                            end_night = end_night and not session[1][player].doom
                         if roles[role][0] == 'wolf' and role in COMMANDS_FOR_ROLE['kill']:
                             num_wolves += 1
                             num_wolves -=  len([x for x in [y for y in session[1] if session[1][y][0] and roles[get_role(y, 'role')][0] == 'wolf' and get_role(y, 'role') in COMMANDS_FOR_ROLE['kill']] if 'silence_totem2' in session[1][x][4]])
@@ -4353,27 +5574,35 @@ async def game_loop(ses=None):
                                     wolf_kill_dict[target] += 1
                                 except KeyError:
                                     wolf_kill_dict[target] = 1
-                    if role == "vengeful ghost" and [x for x in session[1][player][4] if x.startswith("vengeance:")] and not session[1][player][0]:
+                    if role == "vengeful ghost" and session[1][player][4].values('vengeance') and not session[1][player][0]:
                         end_night = end_night and session[1][player][2] != ''
                 if num_wolves > 0:
                     end_night = end_night and len(wolf_kill_dict) == num_kills
                     for t in wolf_kill_dict:
                         end_night = end_night and wolf_kill_dict[t] == num_wolves
                         # night will only end if all wolves select same target(s)
-                end_night = end_night or (datetime.now() - session[3][0]).total_seconds() > night_timeout
+                elapsed = (datetime.now() - session[3][0]).total_seconds()
+                end_night = end_night or elapsed > night_timeout
                 if end_night:
                     session[2] = True
                     session[3][1] = datetime.now() # attempted fix for using !time right as night ends
-                if (datetime.now() - session[3][0]).total_seconds() > night_warning and warn == False:
+                if elapsed > night_warning and warn == False:
                     warn = True
                     await send_lobby("**A few villagers awake early and notice it is still dark outside. "
                                             "The night is almost over and there are still whispers heard in the village.**")
-                await asyncio.sleep(0.1)
+                if not end_night:
+                    # nothing to do until someone acts or the next deadline passes
+                    next_deadline = night_timeout if warn else min(night_warning, night_timeout)
+                    await wait_phase_event(next_deadline - elapsed)
             night_elapsed = datetime.now() - session[3][0]
             session[4][0] += night_elapsed
+            if session[2]:
+                # whether every action was in, the night timed out or an admin used fday
+                await phase_bus.publish('sunrise')
 
             # BETWEEN NIGHT AND DAY
             session[3][1] = datetime.now() # fixes using !time screwing stuff up
+            sunrise_done = False
             killed_msg = ''
             killed_dict = {}
             for player in session[1]:
@@ -4382,15 +5611,15 @@ async def game_loop(ses=None):
                 else:
                     killed_dict[player] = 0
             killed_players = []
-            alive_players = [x for x in session[1] if (session[1][x][0] or (get_role(x, 'role') == "vengeful ghost" and [a for a in session[1][x][4] if a.startswith("vengeance:")]))]
+            alive_players = [x for x in session[1] if (session[1][x][0] or (get_role(x, 'role') == "vengeful ghost" and session[1][x][4].values('vengeance')))]
             log_msg = ["SUNRISE LOG:"]
             if session[0]:
                 for player in alive_players:
                     role = get_role(player, 'role')
                     templates = get_role(player, 'templates')
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if "silence_totem2" in session[1][player][4] and (role != 'matchmaker'):
-                        if "assassin" in templates and not [x for x in session[1][player][4] if x.startswith("assassinate:")]:
+                        if "assassin" in templates and not session[1][player][4].values('assassinate'):
                             if "misdirection_totem2" in session[1][player][4]:
                                 target = misdirect(player)
                             else:
@@ -4400,15 +5629,15 @@ async def game_loop(ses=None):
 
                             if member:
                                 try:
-                                    await client.send_message(member, "Because you forgot to select a target at night, you are now targeting **{0}**.".format(get_name(target)))
+                                    await transport.send_message(member, "Because you forgot to select a target at night, you are now targeting **{0}**.".format(get_name(target)))
                                 except discord.Forbidden:
                                     pass
                         continue
                     if role == 'doomsayer':
-                        session[1][player][4] = [x for x in session[1][player][4] if not x.startswith('doom:')]
+                        session[1][player][4].remove_prefix('doom')
                     if role == 'piper':
                         session[1][player][4] = [x for x in session[1][player][4] if not x == 'charm']
-                    if (role in ['shaman', 'crazed shaman'] and session[1][player][2] in totems) or (role == "wolf shaman" and [x for x in session[1][player][4] if x.startswith("totem:")]):
+                    if (role in ['shaman', 'crazed shaman'] and session[1][player][2] in totems) or (role == "wolf shaman" and session[1][player][4].values('totem')):
                         if "misdirection_totem2" in session[1][player][4]:
                             totem_target = misdirect(player)
                         else:
@@ -4416,13 +5645,14 @@ async def game_loop(ses=None):
                         if role in ['shaman', 'crazed shaman']:
                             totem = session[1][player][2]
                         else:
-                            totem = [x for x in session[1][player][4] if x.startswith("totem:")][0].split(":")[1]
+                            totem = session[1][player][4].values('totem')[0]
                         session[1][totem_target][4].append(totem)
                         if role in ['shaman', 'crazed shaman']:
                             session[1][player][2] = totem_target
                         else:
-                            session[1][player][4] = [x for x in session[1][player][4] if not x.startswith("totem:")]
-                        session[1][player][4] = [x for x in session[1][player][4] if not x.startswith("lasttarget")] + ["lasttarget:{}".format(totem_target)]
+                            session[1][player][4].remove_prefix('totem')
+                        session[1][player][4].remove_prefix('lasttarget')
+                        session[1][player][4].append("lasttarget:{}".format(totem_target))
                         log_msg.append(player + '\'s ' + totem + ' given to ' + totem_target)
                         if member:
                             try:
@@ -4432,7 +5662,7 @@ async def game_loop(ses=None):
                                         totem.replace('_', ' '), get_name(totem_target))
                                 elif role == 'crazed shaman':
                                     random_given = "Because you forgot to give your totem out at night, your totem was randomly given to **{0}**.".format(get_name(totem_target))
-                                await client.send_message(member, random_given)
+                                await transport.send_message(member, random_given)
                             except discord.Forbidden:
                                 pass
                     elif role == 'matchmaker' and 'match' in session[1][player][4] and str(session[4][1]) == "0:00:00":
@@ -4446,13 +5676,13 @@ async def game_loop(ses=None):
                                 session[1][player1][4].append('lover:' + player2)
                                 session[1][player2][4].append('lover:' + player1)
                                 try:
-                                    await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(player1),
+                                    await transport.send_message(transport.server.get_member(player1),
                                                         "You are in love with **{0}**. If that player dies for any reason, the pain will be too much for you to bear and you will commit suicide.".format(
                                                             get_name(player2)))
                                 except:
                                     pass
                                 try:
-                                    await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(player2),
+                                    await transport.send_message(transport.server.get_member(player2),
                                                         "You are in love with **{0}**. If that player dies for any reason, the pain will be too much for you to bear and you will commit suicide.".format(
                                                             get_name(player1)))
                                 except:
@@ -4465,7 +5695,7 @@ async def game_loop(ses=None):
                             if trycount >= (len([x for x in session[1] if session[1][x][0]])*(len([x for x in session[1] if session[1][x][0]]) - 1)): #all possible lover sets are done
                                 break
                         try:
-                            await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(player),
+                            await transport.send_message(transport.server.get_member(player),
                                                       "Because you forgot to choose lovers at night, two lovers have been selected for you.")
                         except:
                             pass
@@ -4474,7 +5704,7 @@ async def game_loop(ses=None):
                         log_msg.append("{0} ({1}) STAY HOME".format(get_name(player), player))
                         if member:
                             try:
-                                await client.send_message(member, "You will stay home tonight.")
+                                await transport.send_message(member, "You will stay home tonight.")
                             except discord.Forbidden:
                                 pass
                     elif role == 'succubus' and session[1][player][2] == '':
@@ -4482,7 +5712,7 @@ async def game_loop(ses=None):
                         log_msg.append("{0} ({1}) STAY HOME".format(get_name(player), player))
                         if member:
                             try:
-                                await client.send_message(member, "You have chosen to not entrance anyone tonight.")
+                                await transport.send_message(member, "You have chosen to not entrance anyone tonight.")
                             except discord.Forbidden:
                                 pass
                     elif role == 'hunter' and session[1][player][2] == '':
@@ -4490,7 +5720,7 @@ async def game_loop(ses=None):
                         log_msg.append("{0} ({1}) PASS".format(get_name(player), player))
                         if member:
                             try:
-                                await client.send_message(member, "You have chosen to not kill anyone tonight.")
+                                await transport.send_message(member, "You have chosen to not kill anyone tonight.")
                             except discord.Forbidden:
                                 pass
                     elif role == 'serial killer' and session[1][player][2] == '':
@@ -4498,24 +5728,24 @@ async def game_loop(ses=None):
                         log_msg.append("{0} ({1}) PASS".format(get_name(player), player))
                         if member:
                             try:
-                                await client.send_message(member, "You have chosen to not kill anyone tonight.")
+                                await transport.send_message(member, "You have chosen to not kill anyone tonight.")
                             except discord.Forbidden:
                                 pass
                     elif role == 'guardian angel' and session[1][player][2] in ['pass', '']:
                         session[1][player][2] = ''
-                        session[1][player][4][:] = [x for x in session[1][player][4] if not x.startswith('lasttarget:')]
+                        session[1][player][4].remove_prefix('lasttarget')
                         # clear previous target since no target selected
                         log_msg.append("{0} ({1}) NO GUARD".format(get_name(player), player))
                         if member and not session[1][player][2]:
                             try:
-                                await client.send_message(member, "You have chosen to not guard anyone tonight.")
+                                await transport.send_message(member, "You have chosen to not guard anyone tonight.")
                             except discord.Forbidden:
                                 pass
                                 
-                    elif role == 'vengeful ghost' and [x for x in session[1][player][4] if x.startswith('vengeance:')] and not session[1][player][0] and session[1][player][2] == '' and 'consecrated' not in session[1][player][4] and 'driven' not in session[1][player][4]:
+                    elif role == 'vengeful ghost' and session[1][player][4].values('vengeance') and not session[1][player][0] and session[1][player][2] == '' and 'consecrated' not in session[1][player][4] and 'driven' not in session[1][player][4]:
                         against = 'wolf'
-                        if [x for x in session[1][player][4] if x.startswith("vengeance:")]:
-                            against = [x.split(':')[1] for x in session[1][player][4] if x.startswith('vengeance:')].pop()
+                        if session[1][player][4].values('vengeance'):
+                            against = session[1][player][4].values('vengeance').pop()
                         if "misdirection_totem2" in session[1][player][4]:
                             target = misdirect(player, alive_players=[x for x in alive_players if x != player and get_role(x, 'actualteam') == against and 'luck_totem2' not in session[1][x][4]])
                         else:
@@ -4528,7 +5758,7 @@ async def game_loop(ses=None):
                         session[1][player][4].append("clone:{}".format(target))
                         if member:
                             try:
-                                await client.send_message(member, "Because you did not choose someone to clone, you are cloning **{}**. If they die you will take their role.".format(get_name(target)))
+                                await transport.send_message(member, "Because you did not choose someone to clone, you are cloning **{}**. If they die you will take their role.".format(get_name(target)))
                             except discord.Forbidden:
                                 pass
                         session[1][player][4].remove('clone')
@@ -4547,7 +5777,7 @@ async def game_loop(ses=None):
                             if 'side:wolves' in session[1][player][4]:
                                 session[1][player][4].remove('side:wolves')
                     
-                    if "assassin" in templates and not [x for x in session[1][player][4] if x.startswith("assassinate:")]:
+                    if "assassin" in templates and not session[1][player][4].values('assassinate'):
                         if "misdirection_totem2" in session[1][player][4]:
                             target = misdirect(player)
                         else:
@@ -4556,7 +5786,7 @@ async def game_loop(ses=None):
                         log_msg.append("{0} ({1}) TARGET RANDOMLY {2} ({3})".format(get_name(player), player, get_name(target), target))
                         if member:
                             try:
-                                await client.send_message(member, "Because you forgot to select a target at night, you are now targeting **{0}**.".format(get_name(target)))
+                                await transport.send_message(member, "Because you forgot to select a target at night, you are now targeting **{0}**.".format(get_name(target)))
                             except discord.Forbidden:
                                 pass
 
@@ -4638,11 +5868,11 @@ async def game_loop(ses=None):
             # Doomsayer stuff
             doom_deaths = []
 
-            for doomsayer in [x for x in session[1] if get_role(x, 'role') == 'doomsayer' and [a for a in session[1][x][4] if a.startswith('doomdeath:')]]:
-                target = [a.split(':')[1] for a in session[1][doomsayer][4] if a.startswith('doomdeath:')].pop()
+            for doomsayer in [x for x in session[1] if get_role(x, 'role') == 'doomsayer' and session[1][x][4].values('doomdeath')]:
+                target = session[1][doomsayer][4].values('doomdeath').pop()
                 killed_dict[target] += 1
                 doom_deaths.append(target)
-                session[1][doomsayer][4] = [a for a in session[1][doomsayer][4] if not a.startswith('doomdeath:')]
+                session[1][doomsayer][4].remove_prefix('doomdeath')
 
             # Hunter stuff
             for hunter in [x for x in session[1] if get_role(x, 'role') == 'hunter']:
@@ -4662,7 +5892,7 @@ async def game_loop(ses=None):
                     sk_deaths.append(target)
 
             # Vengeful ghost stuff
-            for ghost in [x for x in session[1] if get_role(x, 'role') == 'vengeful ghost' and not session[1][x][0] and [a for a in session[1][x][4] if a.startswith('vengeance:')]]:
+            for ghost in [x for x in session[1] if get_role(x, 'role') == 'vengeful ghost' and not session[1][x][0] and session[1][x][4].values('vengeance')]:
                 target = session[1][ghost][2]
                 if target:
                     killed_dict[target] += 1
@@ -4730,9 +5960,9 @@ async def game_loop(ses=None):
                             else:
                                 lycan_message = "You awake to a sharp pain, and realize you are being attacked by a werewolf! Your totem emits a bright flash of light, and you find yourself turning into a werewolf!"
                             try:
-                                member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                                member = transport.server.get_member(player)
                                 if member:
-                                    await client.send_message(member, lycan_message)
+                                    await transport.send_message(member, lycan_message)
                             except discord.Forbidden:
                                 pass
                     elif "pestilence_totem2" in session[1][player][4]:
@@ -4789,10 +6019,10 @@ async def game_loop(ses=None):
                             if not 'gunner' in get_role(give_gun, 'templates'):
                                 session[1][give_gun][3].append('gunner')
                             session[1][give_gun][4].append('bullet')
-                            member = client.get_server(WEREWOLF_SERVER).get_member(give_gun)
+                            member = transport.server.get_member(give_gun)
                             if member:
                                 try:
-                                    await client.send_message(member, "While searching through **{}**'s belongings, you discover a gun loaded with 1 "
+                                    await transport.send_message(member, "While searching through **{}**'s belongings, you discover a gun loaded with 1 "
                                     "silver bullet! You may only use it during the day. If you shoot at a wolf, you will intentionally miss. If you "
                                     "shoot a villager, it is likely that they will be injured.".format(get_name(player)))
                                 except discord.Forbidden:
@@ -4905,24 +6135,24 @@ async def game_loop(ses=None):
                         session[1][potato][3] = templates
                         session[1][potato][4] = other
                         try:
-                            target_member = client.get_server(WEREWOLF_SERVER).get_member(target)
+                            target_member = transport.server.get_member(target)
                             if target_member:
-                                await client.send_message(target_member, 'You are now a **hot potato**!')
-                            potato_member = client.get_server(WEREWOLF_SERVER).get_member(potato)
+                                await transport.send_message(target_member, 'You are now a **hot potato**!')
+                            potato_member = transport.server.get_member(potato)
                             if potato_member:
-                                await client.send_message(potato_member, 'You are now a **{}**!'.format(role))
+                                await transport.send_message(potato_member, 'You are now a **{}**!'.format(role))
                         except discord.Forbidden:
                             pass
                         for player in [x for x in session[1] if session[1][x][0]]:
                             if session[1][player][4]:
-                                member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                                member = transport.server.get_member(player)
                                 for other in session[1][player][4]:
                                     if other == 'lover:{}'.format(target):
                                         session[1][player][4].remove('lover:{}'.format(target))
                                         session[1][player][4].append('lover:{}'.format(potato))
                                         try:
                                             if member:
-                                                await client.send_message(member, 'Your lover had their identity swapped, so you are now in love with **{}**!'.format(get_name(potato)))
+                                                await transport.send_message(member, 'Your lover had their identity swapped, so you are now in love with **{}**!'.format(get_name(potato)))
                                         except discord.Forbidden:
                                             pass
                                     elif other == 'lover:{}'.format(potato):
@@ -4930,72 +6160,72 @@ async def game_loop(ses=None):
                                         session[1][player][4].append('lover:{}'.format(target))
                                         try:
                                             if member:
-                                                await client.send_message(member, 'Your lover had their identity swapped, so you are now in love with **{}**!'.format(get_name(target)))
+                                                await transport.send_message(member, 'Your lover had their identity swapped, so you are now in love with **{}**!'.format(get_name(target)))
                                         except discord.Forbidden:
                                             pass
-                        member = client.get_server(WEREWOLF_SERVER).get_member(potato)
+                        member = transport.server.get_member(potato)
                         if member:
                             if role == 'hunter':
                                 if 'hunterbullet' in session[1][potato][4]:
                                     try:
-                                        await client.send_message(member, 'You have **not** shot anyone yet.')
+                                        await transport.send_message(member, 'You have **not** shot anyone yet.')
                                     except discord.Forbidden:
                                         pass
                                 else:
                                     try:
-                                        await client.send_message(member, 'You have **already** shot someone this game.')
+                                        await transport.send_message(member, 'You have **already** shot someone this game.')
                                     except discord.Forbidden:
                                         pass                                    
                             elif role == 'priest':
                                 if 'bless' in session[1][potato][4]:
                                     try:
-                                        await client.send_message(member, 'You have **not** blessed anyone yet.')
+                                        await transport.send_message(member, 'You have **not** blessed anyone yet.')
                                     except discord.Forbidden:
                                         pass
                                 else:
                                     try:
-                                        await client.send_message(member, 'You have **already** blessed someone this game.')
+                                        await transport.send_message(member, 'You have **already** blessed someone this game.')
                                     except discord.Forbidden:
                                         pass
                             elif role == 'clone':
                                 if session[1][potato][4]:
-                                    if [x for x in session[1][potato][4] if x.startswith('clone:')]:
+                                    if session[1][potato][4].values('clone'):
                                         try:
-                                            await client.send_message(member, "You are cloning **{}**. If they die you will take their role.".format(get_name([x for x in session[1][potato][4] if x.startswith('clone:')][0].strip('clone:'))))
+                                            await transport.send_message(member, "You are cloning **{}**. If they die you will take their role.".format(get_name(session[1][potato][4].values('clone')[0])))
                                         except discord.Forbidden:
                                             pass
                             elif role == 'turncoat':
                                 if 'side:villagers' in session[1][potato][4]:
                                     try:
-                                        await client.send_message(member, 'You are currently siding with the village.')
+                                        await transport.send_message(member, 'You are currently siding with the village.')
                                     except discord.Forbidden:
                                         pass
                                 elif 'side:wolves' in session[1][potato][4]:
                                     try:
-                                        await client.send_message(member, 'You are currently siding with the wolves.')
+                                        await transport.send_message(member, 'You are currently siding with the wolves.')
                                     except discord.Forbidden:
                                         pass
                                 if 'sided2' in session[1][potato][4]:
                                     try:
-                                        await client.send_message(member, 'You will be able to switch sides in two nights.')
+                                        await transport.send_message(member, 'You will be able to switch sides in two nights.')
                                     except discord.Forbidden:
                                         pass
                                 else:
                                     try:
-                                        await client.send_message(member, 'You will be able to switch sides during the upcoming night.')
+                                        await transport.send_message(member, 'You will be able to switch sides during the upcoming night.')
                                     except discord.Forbidden:
                                         pass
                             elif role == 'executioner':
-                                if [x for x in session[1][potato][4] if x.startswith('execute:')]:
-                                    exe_target = [x for x in session[1][potato][4] if x.startswith('execute:')][0].strip('execute:')
+                                if session[1][potato][4].values('execute'):
+                                    exe_target = session[1][potato][4].values('execute')[0]
                                     if 'win' in session[1][potato][4]:
                                         try:
-                                            await client.send_message(member, 'Your target was **{}**. This player was lynched, so you won.'.format(get_name(exe_target)))
+                                            await transport.send_message(member, 'Your target was **{}**. This player was lynched, so you won.'.format(get_name(exe_target)))
                                         except discord.Forbidden:
                                             pass
                                     else:
                                         try:
-                                            await client.send_message(member, 'Your target for lynch is **{}**.'.format(get_name(exe_target)))
+                                            await transport.send_message(member, 'Your target for lynch is **{}**.'.format(get_name(exe_target)))
                                         except discord.Forbidden:
                                             pass
                                 else:
@@ -5003,34 +6233,34 @@ async def game_loop(ses=None):
                                         exe_target = random.choice([x for x in [y for y in session[1] if session[1][y][0]] if get_role(x, 'actualteam') == 'village'])
                                         session[1][potato][4].append('execute:{}'.format(exe_target))
                                         try:
-                                            await client.send_message(member, 'Your target for lynch is **{}**.'.format(get_name(exe_target)))
+                                            await transport.send_message(member, 'Your target for lynch is **{}**.'.format(get_name(exe_target)))
                                         except discord.Forbidden:
                                             pass
                                     else:
                                         session[1][potato][1] = 'jester'
                                         session[1][potato][4].append('executioner')
                                         try:
-                                            await client.send_message(member, 'There are no available targets. You have now become a **jester**.')
+                                            await transport.send_message(member, 'There are no available targets. You have now become a **jester**.')
                                         except discord.Forbidden:
                                             pass
                         for player in [potato, target]:
-                            member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                            member = transport.server.get_member(player)
                             if member:
                                 if 'gunner' in session[1][player][3]:
                                     try:
-                                        await client.send_message(member, 'You have a gun and **{}** bullet{}. Use the command `{}role gunner` for more information.'.format(session[1][player][4].count('bullet'), '' if session[1][player][4].count('bullet') == 1 else 's', BOT_PREFIX))
+                                        await transport.send_message(member, 'You have a gun and **{}** bullet{}. Use the command `{}role gunner` for more information.'.format(session[1][player][4].count('bullet'), '' if session[1][player][4].count('bullet') == 1 else 's', BOT_PREFIX))
                                     except discord.Forbidden:
                                         pass
                                 if 'sharpshooter' in session[1][player][3]:
                                     try:
-                                        await client.send_message(member, 'You have a gun and **{}** bullet{}. Use the command `{}role sharpshooter` for more information.'.format(session[1][player][4].count('bullet'), '' if session[1][player][4].count('bullet') == 1 else 's', BOT_PREFIX))
+                                        await transport.send_message(member, 'You have a gun and **{}** bullet{}. Use the command `{}role sharpshooter` for more information.'.format(session[1][player][4].count('bullet'), '' if session[1][player][4].count('bullet') == 1 else 's', BOT_PREFIX))
                                     except discord.Forbidden:
                                         pass
                                 if 'assassin' in session[1][player][3]:
-                                    if [x for x in session[1][player][4] if x.startswith('assassinate:')]:
-                                        assassinate = [x for x in session[1][player][4] if x.startswith('assassinate:')][0].strip('assassinate:')
+                                    if session[1][player][4].values('assassinate'):
+                                        assassinate = session[1][player][4].values('assassinate')[0]
                                         try:
-                                            await client.send_message(member, 'Your target is **{0}**. Use the command `{1}role assassin` for more information.'.format(get_name(assassinate), BOT_PREFIX))
+                                            await transport.send_message(member, 'Your target is **{0}**. Use the command `{1}role assassin` for more information.'.format(get_name(assassinate), BOT_PREFIX))
                                         except discord.Forbidden:
                                             pass
                                 if session[1][player][4]:
@@ -5039,12 +6269,12 @@ async def game_loop(ses=None):
                                             if [x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'succubus']:
                                                 succubus = random.choice([x for x in session[1] if session[1][x][0] and get_role(x, 'role') == 'succubus'])
                                                 try:
-                                                    await client.send_message(member, "You have become entranced, and are now on **{}**'s team. From this point on, you must vote along with them or risk dying. You **cannot win with your own team**, but you will win should all alive players become entranced.".format(get_name(succubus)))
+                                                    await transport.send_message(member, "You have become entranced, and are now on **{}**'s team. From this point on, you must vote along with them or risk dying. You **cannot win with your own team**, but you will win should all alive players become entranced.".format(get_name(succubus)))
                                                 except discord.Forbidden:
                                                     pass
                                         elif element.startswith('lover:'):
                                             try:
-                                                await client.send_message(member, 'You are in love with **{}**. If that player dies for any reason, the pain will be too much for you to bear and you will commit suicide.'.format(get_name(element.strip('lover:'))))
+                                                await transport.send_message(member, 'You are in love with **{}**. If that player dies for any reason, the pain will be too much for you to bear and you will commit suicide.'.format(get_name(element.strip('lover:'))))
                                             except discord.Forbidden:
                                                 pass
                         if role in WOLFCHAT_ROLES:
@@ -5054,9 +6284,9 @@ async def game_loop(ses=None):
                                 pass
                     else:
                         try:
-                            member = client.get_server(WEREWOLF_SERVER).get_member(potato)
+                            member = transport.server.get_member(potato)
                             if member:
-                                await client.send_message(member, '**{}** died this night, so you are still a **hot potato**.'.format(get_name(target)))
+                                await transport.send_message(member, '**{}** died this night, so you are still a **hot potato**.'.format(get_name(target)))
                         except discord.Forbidden:
                             pass
 
@@ -5075,9 +6305,9 @@ async def game_loop(ses=None):
                 elif len(charmed_total) == 1:
                     piper_message += "You find out that **{}** is also charmed!".format(get_name(charmed_total[0]))
                 try:
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if member and piper_message:
-                        await client.send_message(member,piper_message)
+                        await transport.send_message(member,piper_message)
                 except discord.Forbidden:
                     pass
             fullcharmed = charmed + tocharm
@@ -5091,9 +6321,9 @@ async def game_loop(ses=None):
                 elif len(fullcharmed) == 0:
                     piper_message = "You are the only charmed villager."
                 try:
-                    member = client.get_server(WEREWOLF_SERVER).get_member(player)
+                    member = transport.server.get_member(player)
                     if member and piper_message:
-                        await client.send_message(member,piper_message)
+                        await transport.send_message(member,piper_message)
                 except discord.Forbidden:
                     pass
                 fullcharmed.append(player)
@@ -5102,49 +6332,10 @@ async def game_loop(ses=None):
             if session[0] and win_condition() == None:
                 totem_holders = []
                 for player in sort_players(session[1]):
-                    if [x for x in session[1][player][4] if x in totems]:
+                    if [x for x in totems if x in session[1][player][4]]:
                         totem_holders.append(player)
-                    other = session[1][player][4][:]
-                    for o in other[:]:
-                        # hacky way to get specific mechanisms to last 2 nights
-                        if o in ['death_totem', 'cursed_totem', 'retribution_totem', 'lycanthropy_totem2',
-                                'deceit_totem2', 'angry', 'silence_totem2', 'luck_totem2', 'misdirection_totem2',
-                                'pestilence_totem2', 'consecrated', 'illness', 'disobey', 'lycanthropy2','sided2']:
-                            other.remove(o)
-                        elif o.startswith('given:'):
-                            other.remove(o)
-                        elif o == 'protection_totem':
-                            other.remove(o)
-                            other.append('protection_totem2') # only protects from assassin and mad
-                        elif o in ['lycanthropy_totem']:
-                            other.remove(o)
-                            other.append('lycanthropy_totem2')
-                        elif o == 'lycanthropy':
-                            other.remove(o)
-                            other.append('lycanthropy2')
-                        elif o == 'deceit_totem':
-                            other.remove(o)
-                            other.append('deceit_totem2')
-                        elif o in ['silence_totem', 'hex']:
-                            other.remove(o)
-                            other.append('silence_totem2')
-                        elif o == 'misdirection_totem':
-                            other.remove(o)
-                            other.append('misdirection_totem2')
-                        elif o == 'luck_totem':
-                            other.remove(o)
-                            other.append('luck_totem2')
-                        elif o == 'pestilence_totem':
-                            other.remove(o)
-                            other.append('pestilence_totem2')
-                        elif o == 'sick':
-                            other.remove(o)
-                            other.append('silence_totem2')
-                            other.append('illness')
-                        elif o == 'sided':
-                            other.remove(o)
-                            other.append('sided2')
-                    session[1][player][4] = other
+                    # hacky way to get specific mechanisms to last 2 nights
+                    session[1][player][4].age(EXPIRING_FLAGS, AGED_FLAGS)
                 totem_holders = sort_players(totem_holders)
                 if len(totem_holders) == 0:
                     pass
@@ -5162,60 +6353,72 @@ async def game_loop(ses=None):
                 await check_traitor()
                 
         else: # DAY
-            session[3][1] = datetime.now()
-            if session[0] and win_condition() == None:
+            # a game resumed from a snapshot taken during the day already went through this and announced the day
+            announce = not sunrise_done
+            if not sunrise_done:
+                if session[0] and win_condition() == None:
+                    for player in session[1]:
+                        session[1][player][4] = [x for x in session[1][player][4] if x not in ["guarded", "protection_totem2"] and not x.startswith('bodyguard:')]
                 for player in session[1]:
-                    session[1][player][4] = [x for x in session[1][player][4] if x not in ["guarded", "protection_totem2"] and not x.startswith('bodyguard:')]
-                await send_lobby("It is now **daytime**. Use `{}lynch <player>` to vote to lynch <player>.".format(BOT_PREFIX))
-
-            for player in session[1]:
-                if session[1][player][0] and 'blinding_totem' in session[1][player][4]:
-                    if 'injured' not in session[1][player][4]:
+                    if session[1][player][0] and 'blinding_totem' in session[1][player][4]:
+                        if 'injured' not in session[1][player][4]:
+                            session[1][player][4].append('injured')
+                            session[1][player][4].remove_all('blinding_totem')
+                            try:
+                                member = transport.server.get_member(player)
+                                if member:
+                                    await transport.send_message(member, "Your totem emits a brilliant flash of light. "
+                                                                    "It seems like you cannot see anything! Perhaps "
+                                                                    "you should just rest during the day...")
+                            except discord.Forbidden:
+                                pass
+                    if 'illness' in session[1][player][4]:
                         session[1][player][4].append('injured')
-                        for i in range(session[1][player][4].count('blinding_totem')):
-                            session[1][player][4].remove('blinding_totem')
-                        try:
-                            member = client.get_server(WEREWOLF_SERVER).get_member(player)
-                            if member:
-                                await client.send_message(member, "Your totem emits a brilliant flash of light. "
-                                                                "It seems like you cannot see anything! Perhaps "
-                                                                "you should just rest during the day...")
-                        except discord.Forbidden:
-                            pass
-                if 'illness' in session[1][player][4]:
-                    session[1][player][4].append('injured')
-                if get_role(player, 'role') == 'doomsayer':
-                    session[1][player][4] = [x for x in session[1][player][4] if not x.startswith('doom:')]
+                    if get_role(player, 'role') == 'doomsayer':
+                        session[1][player][4].remove_prefix('doom')
+                sunrise_done = True
+            if session[0] and win_condition() == None:
+                await flush_messages()
+            # same for the sunrise backlog and the day
+            session[3][1] = datetime.now() - resume_elapsed
+            resume_elapsed = timedelta(0)
+            if session[0] and win_condition() == None:
+                if announce:
+                    await send_lobby("It is now **daytime**. Use `{}lynch <player>` to vote to lynch <player>.".format(BOT_PREFIX), PRIORITY_PHASE)
+                await game_snapshot.save()
             if session[6] != 'mudkip':
                 lynched_player = None
                 warn = False
-                totem_dict = {} # For impatience and pacifism
+                vote_ledger.start()
                 # DAY LOOP
                 while win_condition() == None and session[2] and lynched_player == None and session[0]:
-                    for player in [x for x in session[1]]:
-                        totem_dict[player] = session[1][player][4].count('impatience_totem') - session[1][player][4].count('pacifism_totem')
-                    vote_dict = get_votes(totem_dict)
-                    if vote_dict['abstain'] >= len([x for x in session[1] if session[1][x][0] and 'injured' not in session[1][x][4]]) / 2:
+                    vote_dict = vote_ledger.vote_dict()
+                    if vote_dict['abstain'] >= vote_ledger.able / 2:
                         lynched_player = 'abstain'
                     max_votes = max([vote_dict[x] for x in vote_dict])
                     max_voted = []
-                    if max_votes >= len([x for x in session[1] if session[1][x][0] and 'injured' not in session[1][x][4]]) // 2 + 1:
+                    if max_votes >= vote_ledger.able // 2 + 1:
                         for voted in vote_dict:
                             if vote_dict[voted] == max_votes:
                                 max_voted.append(voted)
                         lynched_player = random.choice(max_voted)
-                    if (datetime.now() - session[3][1]).total_seconds() > day_timeout:
+                    elapsed = (datetime.now() - session[3][1]).total_seconds()
+                    if elapsed > day_timeout:
                         session[3][0] = datetime.now() # hopefully a fix for time being weird
                         session[2] = False
-                    if (datetime.now() - session[3][1]).total_seconds() > day_warning and warn == False:
+                    if elapsed > day_warning and warn == False:
                         warn = True
                         await send_lobby("**As the sun sinks inexorably toward the horizon, turning the lanky pine "
                                                 "trees into fire-edged silhouettes, the villagers are reminded that very little time remains for them to reach a "
                                                 "decision; if darkness falls before they have done so, the majority will win the vote. No one will be lynched if "
                                                 "there are no votes or an even split.**")
-                    await asyncio.sleep(0.1)
+                    if session[2] and lynched_player == None:
+                        # the ledger wakes us when a vote, death or totem change could settle the lynch
+                        next_deadline = day_timeout if warn else min(day_warning, day_timeout)
+                        await vote_ledger.wait(next_deadline - elapsed)
+                totem_dict = vote_ledger.totem_dict() # For impatience and pacifism
                 if not lynched_player and win_condition() == None and session[0]:
-                    vote_dict = get_votes(totem_dict)
+                    vote_dict = vote_ledger.vote_dict()
                     max_votes = max([vote_dict[x] for x in vote_dict])
                     max_voted = []
                     for voted in vote_dict:
@@ -5243,11 +6446,11 @@ async def game_loop(ses=None):
                                 lynched_msg += 'As the villagers prepare to lynch **{0}**, their totem emits a brilliant flash of light! When the villagers are able to see again, '
                                 lynched_msg += 'they discover that {0} has escaped! The left-behind totem seems to have taken on the shape of a **{1}**.'
                                 if get_role(lynched_player, 'role') == 'amnesiac':
-                                    role = [x.split(':')[1].replace("_", " ") for x in session[1][lynched_player][4] if x.startswith("role:")].pop()
+                                    role = [x.replace("_", " ") for x in session[1][lynched_player][4].values('role')].pop()
                                     session[1][lynched_player][1] = role
-                                    session[1][lynched_player][4] = [x for x in session[1][lynched_player][4] if not x.startswith("role:")]
+                                    session[1][lynched_player][4].remove_prefix('role')
                                     try:
-                                        await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(lynched_player), "Your totem clears your amnesia and you now fully remember who you are!")
+                                        await transport.send_message(transport.server.get_member(lynched_player), "Your totem clears your amnesia and you now fully remember who you are!")
                                         await _send_role_info(lynched_player)
                                         if role in WOLFCHAT_ROLES:
                                             await wolfchat("{0} is now a **{1}**!".format(get_name(lynched_player), role))
@@ -5270,8 +6473,8 @@ async def game_loop(ses=None):
                                 if get_role(lynched_player, 'role') == 'jester':
                                     session[1][lynched_player][4].append('lynched')
                                 for player in [x for x in session[1] if session[1][x][0]]:
-                                    if get_role(player, 'role') == 'executioner' and 'win' not in session[1][player][4] and [x for x in session[1][player][4] if x.startswith('execute:')]:
-                                        if [x for x in session[1][player][4] if x.startswith('execute:')][0].strip('execute:') == lynched_player:
+                                    if get_role(player, 'role') == 'executioner' and 'win' not in session[1][player][4] and session[1][player].execute_target:
+                                        if session[1][player].execute_target == lynched_player:
                                             session[1][player][4].append('win')
                                             try:
                                                 await _send_role_info(player, sendrole=False)
@@ -5296,32 +6499,34 @@ async def game_loop(ses=None):
             else:
                 lynched_players = []
                 warn = False
-                totem_dict = {} # For impatience and pacifism
+                vote_ledger.start()
                 # DAY LOOP
                 while win_condition() == None and session[2] and not lynched_players and session[0]:
-                    for player in [x for x in session[1]]:
-                        totem_dict[player] = session[1][player][4].count('impatience_totem') - session[1][player][4].count('pacifism_totem')
-                    vote_dict = get_votes(totem_dict)
+                    vote_dict = vote_ledger.vote_dict()
                     max_votes = max([vote_dict[x] for x in vote_dict])
                     max_voted = []
-                    if vote_dict['abstain'] >= len([x for x in session[1] if session[1][x][0] and 'injured' not in session[1][x][4]]) / 2:
+                    if vote_dict['abstain'] >= vote_ledger.able / 2:
                         lynched_players = 'abstain'
-                    elif max_votes >= len([x for x in session[1] if session[1][x][0] and 'injured' not in session[1][x][4]]) // 2 + 1 or not [x for x in session[1] if not session[1][x][2] and session[1][x][0]]:
+                    elif max_votes >= vote_ledger.able // 2 + 1 or vote_ledger.pending == 0:
                         for voted in vote_dict:
                             if vote_dict[voted] == max_votes:
                                 lynched_players.append(voted)
-                    if (datetime.now() - session[3][1]).total_seconds() > day_timeout:
+                    elapsed = (datetime.now() - session[3][1]).total_seconds()
+                    if elapsed > day_timeout:
                         session[3][0] = datetime.now() # hopefully a fix for time being weird
                         session[2] = False
-                    if (datetime.now() - session[3][1]).total_seconds() > day_warning and warn == False:
+                    if elapsed > day_warning and warn == False:
                         warn = True
                         await send_lobby("**As the sun sinks inexorably toward the horizon, turning the lanky pine "
                                                 "trees into fire-edged silhouettes, the villagers are reminded that very little time remains for them to reach a "
                                                 "decision; if darkness falls before they have done so, the majority will win the vote. No one will be lynched if "
                                                 "there are no votes or an even split.**")
-                    await asyncio.sleep(0.1)
+                    if session[2] and not lynched_players:
+                        next_deadline = day_timeout if warn else min(day_warning, day_timeout)
+                        await vote_ledger.wait(next_deadline - elapsed)
+                totem_dict = vote_ledger.totem_dict() # For impatience and pacifism
                 if not lynched_players and win_condition() == None and session[0]:
-                    vote_dict = get_votes(totem_dict)
+                    vote_dict = vote_ledger.vote_dict()
                     max_votes = max([vote_dict[x] for x in vote_dict])
                     max_voted = []
                     for voted in vote_dict:
@@ -5349,11 +6554,11 @@ async def game_loop(ses=None):
                                     lynched_msg += 'As the villagers prepare to lynch **{0}**, their totem emits a brilliant flash of light! When the villagers are able to see again, '
                                     lynched_msg += 'they discover that {0} has escaped! The left-behind totem seems to have taken on the shape of a **{1}**.'
                                     if get_role(lynched_player, 'role') == 'amnesiac':
-                                        role = [x.split(':')[1].replace("_", " ") for x in session[1][lynched_player][4] if x.startswith("role:")].pop()
+                                        role = [x.replace("_", " ") for x in session[1][lynched_player][4].values('role')].pop()
                                         session[1][lynched_player][1] = role
-                                        session[1][lynched_player][4] = [x for x in session[1][lynched_player][4] if not x.startswith("role:")]
+                                        session[1][lynched_player][4].remove_prefix('role')
                                         try:
-                                            await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(lynched_player), "Your totem clears your amnesia and you now fully remember who you are!")
+                                            await transport.send_message(transport.server.get_member(lynched_player), "Your totem clears your amnesia and you now fully remember who you are!")
                                             await _send_role_info(lynched_player)
                                             if role in WOLFCHAT_ROLES:
                                                 await wolfchat("{0} is now a **{1}**!".format(get_name(lynched_player), role))
@@ -5390,7 +6595,10 @@ async def game_loop(ses=None):
                     await send_lobby("Not enough votes were cast to lynch a player.")
             # BETWEEN DAY AND NIGHT
             session[2] = False
+            vote_ledger.stop()
+            await phase_bus.publish('sunset')
             night += 1
+            sunset_done = False
             if session[0] and win_condition() == None:
                 await send_lobby("Day lasted **{0:02d}:{1:02d}**. The villagers, exhausted from the day's events, go to bed.".format(
                                                                     day_elapsed.seconds // 60, day_elapsed.seconds % 60))
@@ -5399,16 +6607,16 @@ async def game_loop(ses=None):
                         session[1][player][4].append('disobey')
                 for player in session[1]:
                     session[1][player][4][:] = [x for x in session[1][player][4] if x not in [
-                        'revealing_totem', 'influence_totem', 'impatience_totem', 'pacifism_totem', 'injured', 'desperation_totem']]
+                        'revealing_totem', 'influence_totem', 'impatience_totem', 'pacifism_totem', 'injured', 'desperation_totem', 'investigate']]
                     session[1][player][2] = ''
-                    session[1][player][4] = [x for x in session[1][player][4] if not x.startswith('vote:')]
+                    session[1][player][4].remove_prefix('vote')
                     if get_role(player, 'role') == 'amnesiac' and night == 3 and session[1][player][0]:
-                        role = [x.split(':')[1].replace("_", " ") for x in session[1][player][4] if x.startswith("role:")].pop()
+                        role = [x.replace("_", " ") for x in session[1][player][4].values('role')].pop()
                         session[1][player][1] = role
-                        session[1][player][4] = [x for x in session[1][player][4] if not x.startswith("role:")]
+                        session[1][player][4].remove_prefix('role')
                         session[1][player][4].append('amnesiac')
                         try:
-                            await client.send_message(client.get_server(WEREWOLF_SERVER).get_member(player), "Your amnesia clears and you now remember that you are a{0} **{1}**!".format("n" if role.lower()[0] in ['a', 'e', 'i', 'o', 'u'] else "", role))
+                            await transport.send_message(transport.server.get_member(player), "Your amnesia clears and you now remember that you are a{0} **{1}**!".format("n" if role.lower()[0] in ['a', 'e', 'i', 'o', 'u'] else "", role))
                             if role in WOLFCHAT_ROLES:
                                 await wolfchat("{0} is now a **{1}**!".format(get_name(player), role))
                         except:
@@ -5423,30 +6631,45 @@ async def game_loop(ses=None):
         
 
 async def start_votes(player):
-    start = datetime.now()
-    while (datetime.now() - start).total_seconds() < 60:
+    def decided():
         votes_needed = max(2, min(len(session[1]) // 4 + 1, 4))
         votes = len([x for x in session[1] if session[1][x][1] == 'start'])
-        if votes >= votes_needed or session[0] or votes == 0:
-            break
-        await asyncio.sleep(0.1)
-    else:
+        return votes >= votes_needed or session[0] or votes == 0
+    if await scheduler.wait(decided, 60, 'lobby') is False:
         for player in session[1]:
             session[1][player][1] = ''
         await send_lobby("Not enough votes to start, resetting start votes.")
 
+def take_token(user):
+    # Token bucket per user holding up to TOKENS_GIVEN tokens, refilled continuously at TOKENS_GIVEN per TOKEN_RESET
+    # seconds. Every command takes one, even when there are none left, so the balance goes negative while someone
+    # keeps spamming. Buckets that have filled back up are the same as no bucket and are dropped, which keeps the
+    # dict down to the users seen in the last few TOKEN_RESETs. Returns the balance after taking the token.
+    now = time.monotonic()
+    refill = TOKENS_GIVEN / TOKEN_RESET
+    while ratelimit_buckets:
+        oldest = next(iter(ratelimit_buckets.values()))
+        if oldest[0] + (now - oldest[1]) * refill < TOKENS_GIVEN:
+            break
+        ratelimit_buckets.popitem(last=False)
+    if user in ratelimit_buckets:
+        bucket = ratelimit_buckets.pop(user)
+        bucket[0] = min(TOKENS_GIVEN, bucket[0] + (now - bucket[1]) * refill)
+        bucket[1] = now
+    else:
+        bucket = [TOKENS_GIVEN, now]
+    bucket[0] -= 1
+    ratelimit_buckets[user] = bucket
+    return bucket[0]
+
 async def rate_limit(message):
     if not (message.channel.is_private or message.content.startswith(BOT_PREFIX)) or message.author.id in ADMINS or message.author.id == OWNER_ID:
         return False
-    global ratelimit_dict
-    global IGNORE_LIST
-    if message.author.id not in ratelimit_dict:
-        ratelimit_dict[message.author.id] = 1
-    else:
-        ratelimit_dict[message.author.id] += 1
-    if ratelimit_dict[message.author.id] > IGNORE_THRESHOLD:
+    tokens = take_token(message.author.id)
+    # in a burst, the first TOKENS_GIVEN commands go through, the rest up to IGNORE_THRESHOLD are dropped and the next gets you ignored
+    if tokens < TOKENS_GIVEN - IGNORE_THRESHOLD:
         if not message.author.id in IGNORE_LIST:
-            IGNORE_LIST.append(message.author.id)
+            IGNORE_LIST.add(message.author.id)
             await log(2, message.author.name + " (" + message.author.id + ") was added to the ignore list for rate limiting.")
         try:
             await reply(message, "You've used {0} commands in the last {1} seconds; I will ignore you from now on.".format(IGNORE_THRESHOLD, TOKEN_RESET))
@@ -5455,32 +6678,24 @@ async def rate_limit(message):
                                       " used {0} commands in the last {1} seconds and will be ignored from now on.".format(IGNORE_THRESHOLD, TOKEN_RESET))
         finally:
             return True
-    if message.author.id in IGNORE_LIST or ratelimit_dict[message.author.id] > TOKENS_GIVEN:
-        if ratelimit_dict[message.author.id] > TOKENS_GIVEN:
+    if message.author.id in IGNORE_LIST or tokens < 0:
+        if tokens < 0:
             await log(2, "Ignoring message from " + message.author.name + " (" + message.author.id + "): `" + message.content + "` since no tokens remaining")
         return True
     return False
 
-async def do_rate_limit_loop():
-    await client.wait_until_ready()
-    global ratelimit_dict
-    while not client.is_closed:
-        for user in ratelimit_dict:
-            ratelimit_dict[user] = 0
-        await asyncio.sleep(TOKEN_RESET)
-
 async def game_start_timeout_loop():
     session[5] = datetime.now()
-    while not session[0] and len(session[1]) > 0 and datetime.now() - session[5] < timedelta(seconds=GAME_START_TIMEOUT):
-        await asyncio.sleep(0.1)
+    if await scheduler.wait(lambda: session[0] or not session[1], GAME_START_TIMEOUT, 'lobby') is not False:
+        return
     if not session[0] and len(session[1]) > 0:
         session[0] = True
-        await client.change_presence(game=client.get_server(WEREWOLF_SERVER).me.game, status=discord.Status.online)
+        await transport.change_presence(game=transport.server.me.game, status=discord.Status.online)
         await send_lobby("{}, the game has taken too long to start and has been cancelled. "
                           "If you are still here and would like to start a new game, please do `{}join` again.".format(PLAYERS_ROLE.mention, BOT_PREFIX))
-        perms = client.get_channel(GAME_CHANNEL).overwrites_for(client.get_server(WEREWOLF_SERVER).default_role)
+        perms = transport.get_channel(GAME_CHANNEL).overwrites_for(transport.server.default_role)
         perms.send_messages = True
-        await client.edit_channel_permissions(client.get_channel(GAME_CHANNEL), client.get_server(WEREWOLF_SERVER).default_role, perms)
+        await transport.edit_channel_permissions(transport.get_channel(GAME_CHANNEL), transport.server.default_role, perms)
         player_dict = {}
         for player in list(session[1]):
             player_dict[player] = ('game cancel', "bot")
@@ -5493,20 +6708,20 @@ async def game_start_timeout_loop():
 
 async def wait_timer_loop():
     global wait_bucket
-    timer = datetime.now()
-    while not session[0] and len(session[1]) > 0:
-        if datetime.now() - timer > timedelta(seconds=WAIT_BUCKET_DELAY):
-            timer = datetime.now()
-            wait_bucket = min(wait_bucket + 1, WAIT_BUCKET_MAX)
-        await asyncio.sleep(0.5)
+    while await scheduler.wait(lambda: session[0] or not session[1], WAIT_BUCKET_DELAY, 'lobby') is False:
+        wait_bucket = min(wait_bucket + 1, WAIT_BUCKET_MAX)
+
+async def backup_settings():
+    try:
+        if await state_journal.compact():
+            print("BACKED UP SETTINGS")
+    except OSError:
+        state_journal.dirty = True
+        await log(3, "Could not back up settings: ```py\n{}\n```", traceback.format_exc())
 
 async def backup_settings_loop():
     while not client.is_closed:
-        print("BACKING UP SETTINGS")
-        with open(NOTIFY_FILE, 'w') as notify_file:
-            notify_file.write(','.join([x for x in notify_me if x != '']))
-        with open(STASIS_FILE, 'w') as stasis_file:
-            json.dump(stasis, stasis_file)
+        await backup_settings()
         await asyncio.sleep(BACKUP_INTERVAL)
 
 ############## POST-DECLARATION STUFF ###############
@@ -6400,31 +7615,49 @@ totems = {'death_totem' : 'The player who is given this totem will die tonight.'
                                'them will also die.'}
 SHAMAN_TOTEMS = ['death_totem', 'protection_totem', 'revealing_totem', 'influence_totem', 'impatience_totem', 'pacifism_totem', 'silence_totem', 'desperation_totem']
 WOLF_SHAMAN_TOTEMS = ['protection_totem', 'impatience_totem', 'pacifism_totem', 'deceit_totem', 'lycanthropy_totem', 'luck_totem', 'misdirection_totem', 'silence_totem']
-ROLES_SEEN_VILLAGER = ['werekitten', 'traitor', 'sorcerer', 'warlock', 'minion', 'cultist', 'villager', 'jester', 'fool', 'amnesiac', 'vengeful ghost', 'hag', 'piper', 'clone', 'lycan', 'time lord', 'turncoat', 'executioner']
-ROLES_SEEN_WOLF = ['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'wolf shaman', 'wolf mystic', 'cursed', 'monster', 'succubus', 'mad scientist']
-ACTUAL_WOLVES = ['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'werekitten', 'wolf shaman', 'wolf mystic']
-WOLFCHAT_ROLES = ['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'werekitten', 'wolf shaman', 'wolf mystic', 'traitor', 'sorcerer', 'warlock', 'hag']
+# flags dropped at sunrise, and flags that turn into their second-night form
+EXPIRING_FLAGS = frozenset(['death_totem', 'cursed_totem', 'retribution_totem', 'lycanthropy_totem2', 'deceit_totem2', 'angry', 'silence_totem2',
+                            'luck_totem2', 'misdirection_totem2', 'pestilence_totem2', 'consecrated', 'illness', 'disobey', 'lycanthropy2', 'sided2', 'given:', 'observe'])
+AGED_FLAGS = {'protection_totem' : ['protection_totem2'], # only protects from assassin and mad
+              'lycanthropy_totem' : ['lycanthropy_totem2'],
+              'lycanthropy' : ['lycanthropy2'],
+              'deceit_totem' : ['deceit_totem2'],
+              'silence_totem' : ['silence_totem2'],
+              'hex' : ['silence_totem2'],
+              'misdirection_totem' : ['misdirection_totem2'],
+              'luck_totem' : ['luck_totem2'],
+              'pestilence_totem' : ['pestilence_totem2'],
+              'sick' : ['silence_totem2', 'illness'],
+              'sided' : ['sided2']}
+ROLES_SEEN_VILLAGER = frozenset(['werekitten', 'traitor', 'sorcerer', 'warlock', 'minion', 'cultist', 'villager', 'jester', 'fool', 'amnesiac', 'vengeful ghost', 'hag', 'piper', 'clone', 'lycan', 'time lord', 'turncoat', 'executioner'])
+ROLES_SEEN_WOLF = frozenset(['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'wolf shaman', 'wolf mystic', 'cursed', 'monster', 'succubus', 'mad scientist'])
+ACTUAL_WOLVES = frozenset(['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'werekitten', 'wolf shaman', 'wolf mystic'])
+WOLFCHAT_ROLES = frozenset(['wolf', 'werecrow', 'doomsayer', 'wolf cub', 'werekitten', 'wolf shaman', 'wolf mystic', 'traitor', 'sorcerer', 'warlock', 'hag'])
 
 ########### END POST-DECLARATION STUFF #############
-client.loop.create_task(do_rate_limit_loop())
-client.loop.create_task(backup_settings_loop())
-try:
-    client.loop.run_until_complete(client.start(TOKEN))
-finally:
+if __name__ == '__main__':
+    client.loop.create_task(backup_settings_loop())
+    if METRICS_FILE:
+        client.loop.create_task(metrics_dump_loop())
     try:
+        client.loop.run_until_complete(client.start(TOKEN))
+    finally:
         try:
-            client.loop.run_until_complete(client.logout())
-        except:
-            pass
-        pending = asyncio.Task.all_tasks()
-        gathered = asyncio.gather(*pending)
+            try:
+                client.loop.run_until_complete(backup_settings())
+                client.loop.run_until_complete(flush_log())
+                client.loop.run_until_complete(client.logout())
+            except:
+                pass
+            pending = asyncio.Task.all_tasks()
+            gathered = asyncio.gather(*pending)
 
-        try:
-            gathered.cancel()
-            client.loop.run_until_complete(gathered)
-            gathered.exception()
+            try:
+                gathered.cancel()
+                client.loop.run_until_complete(gathered)
+                gathered.exception()
+            except:
+                pass
         except:
-            pass
-    except:
-        print("Error in cleanup:\n" + traceback.format_exc())
-    client.loop.close()
+            print("Error in cleanup:\n" + traceback.format_exc())
+        client.loop.close()
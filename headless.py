@@ -0,0 +1,225 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import tempfile
+import bot
+from transport import InMemoryTransport
+
+# Runs whole games of bot.py against an InMemoryTransport with scripted players instead of people on discord.
+# Phase timeouts are cut down to HEADLESS_PHASE_TIMEOUT so a phase where the players can't agree still ends quickly;
+# most phases end as soon as every player has acted, like they do on discord.
+#
+#   python headless.py [<players>] [<gamemode>] [<games>] [<random|heuristic>]
+
+HEADLESS_PHASE_TIMEOUT = 0.2
+HEADLESS_MAX_NIGHTS = 30
+
+# commands a scripted player sends in pm at night; everything else in COMMANDS_FOR_ROLE is day-only or a no-op
+NIGHT_COMMANDS = ['see', 'kill', 'give', 'visit', 'observe', 'id', 'choose', 'guard', 'target', 'entrance', 'hex', 'curse', 'charm', 'clone']
+
+# what cmd_see tells a seer or oracle who saw a wolf, after totems had their say
+SEEN_WOLF = re.compile(r'in your vision you see that \*\*(.+?)\*\* is a \*\*wolf\*\*!')
+
+def install(workdir=None, fast=True):
+    # points bot.py at a fresh InMemoryTransport with its files in workdir; fast also strips out the pacing and
+    # rate limiting that only exist to be nice to discord, and shortens the phase timers
+    transport = InMemoryTransport(bot.WEREWOLF_SERVER)
+    transport.add_role(bot.PLAYERS_ROLE_NAME)
+    transport.add_role(bot.ADMINS_ROLE_NAME)
+    transport.add_role(bot.WEREWOLF_NOTIFY_ROLE_NAME)
+    transport.add_member(bot.OWNER_ID, 'owner')
+    bot.transport = transport
+    workdir = workdir or tempfile.mkdtemp()
+    for name in ['LOG_FILE', 'NOTIFY_FILE', 'STASIS_FILE', 'JOURNAL_FILE', 'GAME_SNAPSHOT_FILE']:
+        setattr(bot, name, os.path.join(workdir, os.path.basename(getattr(bot, name))))
+    bot.LOG_FILE_LEVEL = bot.MIN_LOG_LEVEL = len(bot.LOG_LEVEL_NAMES)
+    if not fast:
+        return transport
+    bot.CHANNEL_RATE_LIMIT = 10 ** 9
+    bot.TOKENS_GIVEN = bot.IGNORE_THRESHOLD = 10 ** 9
+    for name in ['DEFAULT_DAY_WARNING', 'DEFAULT_DAY_TIMEOUT', 'DEFAULT_NIGHT_WARNING', 'DEFAULT_NIGHT_TIMEOUT']:
+        setattr(bot, name, HEADLESS_PHASE_TIMEOUT)
+        setattr(bot, name[len('DEFAULT_'):].lower(), HEADLESS_PHASE_TIMEOUT)
+    return transport
+
+class RandomAgent:
+    # Every player uses every night command their role has on a random living player and lynches a random
+    # living player by day. Wolves agree on one kill target per night so the night doesn't have to time out.
+    def __init__(self, rng):
+        self.rng = rng
+        self.wolf_target = None
+
+    def begin_phase(self, day, alive):
+        targets = [x for x in alive if bot.get_role(x, 'role') not in bot.WOLFCHAT_ROLES]
+        self.wolf_target = self.rng.choice(targets or alive)
+
+    def pick(self, player, alive):
+        targets = [x for x in alive if x != player] or alive
+        return self.rng.choice(targets)
+
+    def night_actions(self, player, role, alive):
+        actions = []
+        for command in NIGHT_COMMANDS:
+            if role not in bot.COMMANDS_FOR_ROLE[command]:
+                continue
+            if command == 'kill' and role in bot.ACTUAL_WOLVES:
+                actions.append('kill {}'.format(self.wolf_target))
+            elif command in ['choose', 'charm']:
+                actions.append('{} {} and {}'.format(command, self.pick(player, alive), self.pick(player, alive)))
+            else:
+                actions.append('{} {}'.format(command, self.pick(player, alive)))
+        return actions
+
+    def day_actions(self, player, role, alive):
+        return ['lynch {}'.format(self.pick(player, alive))]
+
+    def told(self, player, content):
+        # called with everything the bot says to player in pm
+        pass
+
+class HeuristicAgent(RandomAgent):
+    # Plays roughly like a cooperative table: each seer remembers who their visions showed as a wolf and votes for
+    # them, wolves never vote for wolfchat, and everyone else goes only by what the table can see, joining whichever
+    # lynch already has the most votes. A seer's knowledge dies with them.
+    def __init__(self, rng):
+        RandomAgent.__init__(self, rng)
+        self.known_wolves = {} # seer id -> set of players their visions showed as a wolf
+        self.votes = {}
+
+    def begin_phase(self, day, alive):
+        RandomAgent.begin_phase(self, day, alive)
+        self.votes = {}
+        self.known_wolves = {x : self.known_wolves[x] & set(alive) for x in self.known_wolves if x in alive}
+
+    def told(self, player, content):
+        for match in SEEN_WOLF.finditer(content):
+            target = bot.get_player(match.group(1))
+            if target:
+                self.known_wolves.setdefault(player, set()).add(target)
+
+    def day_actions(self, player, role, alive):
+        targets = [x for x in alive if x != player]
+        known_wolves = self.known_wolves.get(player, set()) & set(targets)
+        if role in bot.WOLFCHAT_ROLES:
+            targets = [x for x in targets if bot.get_role(x, 'role') not in bot.WOLFCHAT_ROLES] or targets
+        elif known_wolves:
+            targets = list(known_wolves)
+        voted = [x for x in targets if x in self.votes]
+        if voted:
+            target = max(voted, key=lambda x: self.votes[x])
+        else:
+            target = self.rng.choice(targets or alive)
+        self.votes[target] = self.votes.get(target, 0) + 1
+        return ['lynch {}'.format(target)]
+
+AGENTS = {'random' : RandomAgent, 'heuristic' : HeuristicAgent}
+
+class HeadlessGame:
+    def __init__(self, transport, num_players, gamemode='', agent=None, rng=None):
+        self.transport = transport
+        self.rng = rng or random.Random()
+        self.agent = agent or RandomAgent(self.rng)
+        self.gamemode = gamemode
+        self.members = [transport.server.get_member(str(x)) or transport.add_member(str(x), 'player{}'.format(x))
+                        for x in range(1, num_players + 1)]
+        self.game_channel = transport.get_channel(bot.GAME_CHANNEL)
+        self.owner = transport.server.get_member(bot.OWNER_ID)
+        self.nights = 0
+        self.result = None
+
+    async def send(self, member, content, channel=None):
+        message = self.transport.make_message(member, bot.BOT_PREFIX + content, channel)
+        self.transport.deliver(message)
+        await bot.on_message(message)
+
+    def on_send(self, destination, content):
+        if getattr(destination, 'is_private', False):
+            self.agent.told(destination.recipient.id, content)
+            return
+        if destination is not self.game_channel:
+            return
+        if content.startswith("It is now **nighttime**"):
+            self.nights += 1
+            if self.nights > HEADLESS_MAX_NIGHTS:
+                asyncio.ensure_future(self.send(self.owner, 'fstop', self.game_channel))
+            else:
+                asyncio.ensure_future(self.act(False))
+        elif content.startswith("It is now **daytime**"):
+            asyncio.ensure_future(self.act(True))
+
+    async def act(self, day):
+        alive = [x for x in bot.session[1] if bot.session[1][x][0]]
+        if not alive:
+            return
+        self.agent.begin_phase(day, alive)
+        for player in alive:
+            member = self.transport.server.get_member(player)
+            role = bot.get_role(player, 'role')
+            if day:
+                for action in self.agent.day_actions(player, role, alive):
+                    await self.send(member, action, self.game_channel)
+            else:
+                for action in self.agent.night_actions(player, role, alive):
+                    await self.send(member, action)
+
+    def record(self, reason, winners):
+        win = bot.win_condition()
+        players = bot.session[1]
+        if win:
+            team = win[0]
+        elif winners:
+            # a lynch win like the fool's ends the game without win_condition() deciding it
+            team = bot.get_role(winners[0], 'role')
+        else:
+            team = 'none'
+        self.result = {'gamemode' : bot.session[6],
+                       'players' : len(players),
+                       'team' : team,
+                       'winners' : list(winners or []),
+                       'roles' : {x : bot.get_role(x, 'role') for x in players},
+                       'alive' : [x for x in players if players[x][0]],
+                       'nights' : self.nights,
+                       'seconds' : sum(x.total_seconds() for x in bot.session[4])}
+
+    async def play(self):
+        original_end_game = bot.end_game
+        async def end_game(reason, winners=None):
+            if bot.session[0]:
+                self.record(reason, winners)
+            await original_end_game(reason, winners)
+        bot.end_game = end_game
+        self.transport.on_send.append(self.on_send)
+        try:
+            for member in self.members:
+                await self.send(member, 'join', self.game_channel)
+            if self.gamemode:
+                await self.send(self.owner, 'fgame ' + self.gamemode, self.game_channel)
+            # fstart runs the whole game before it returns
+            await self.send(self.owner, 'fstart', self.game_channel)
+        finally:
+            bot.end_game = original_end_game
+            self.transport.on_send.remove(self.on_send)
+        return self.result
+
+async def run_games(num_players, gamemode='', games=1, seed=None, agent='random'):
+    transport = bot.transport if isinstance(bot.transport, InMemoryTransport) else install()
+    if not bot.starttime:
+        await bot.on_ready()
+    rng = random.Random(seed)
+    results = []
+    for i in range(games):
+        random.seed(rng.random())
+        results.append(await HeadlessGame(transport, num_players, gamemode, AGENTS[agent](rng), rng).play())
+    await bot.flush_messages()
+    return results
+
+if __name__ == '__main__':
+    num_players = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    gamemode = sys.argv[2] if len(sys.argv) > 2 else ''
+    games = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    agent = sys.argv[4] if len(sys.argv) > 4 else 'random'
+    loop = asyncio.get_event_loop()
+    for result in loop.run_until_complete(run_games(num_players, gamemode, games, agent=agent)):
+        print("{gamemode}: {team} won after {nights} nights with {players} players".format(**result))
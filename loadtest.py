@@ -0,0 +1,124 @@
+import argparse
+import asyncio
+import io
+import random
+import re
+import sys
+from collections import Counter, deque
+from contextlib import redirect_stdout
+import bot
+import headless
+from transport import DiscordTransport, FakeClient
+
+# Drives bot.py through a FakeClient, so every call goes through DiscordTransport with some latency and discord's
+# rate limits, while --players simulated people send commands to the game channel at random. Each command is
+# timed from the moment the bot sees it until the reply mentioning its author is sent, and the percentiles are
+# printed along with how many api calls the bot made, how often it hit a rate limit and the !metrics table.
+#
+#   python loadtest.py --players 50 --duration 30 --rate 0.2 --latency 0.05 --jitter 0.1
+
+# only commands that answer through reply(), which mentions the author
+LOADTEST_COMMANDS = ['ping', 'info', 'list', 'admins', 'coin']
+
+# (calls, seconds) per method, roughly what discord allowed a bot account around discord.py 0.16
+DISCORD_RATE_LIMITS = {'send_message' : (5, 5),
+                       'delete_message' : (5, 1),
+                       'add_roles' : (10, 10),
+                       'remove_roles' : (10, 10),
+                       'edit_channel_permissions' : (10, 10),
+                       'change_presence' : (5, 60)}
+
+MENTION = re.compile(r'^<@(\d+)>, ', re.MULTILINE)
+
+def percentile(values, fraction):
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+class LoadTest:
+    def __init__(self, num_players, duration, rate, rng):
+        self.num_players = num_players
+        self.duration = duration
+        self.rate = rate
+        self.rng = rng
+        self.pending = {} # author id -> deque of times their unanswered commands were sent
+        self.latencies = []
+        self.commands = Counter()
+        self.errors = 0
+
+    def on_send(self, destination, content):
+        now = bot.client.loop.time()
+        for author in MENTION.findall(content):
+            if self.pending.get(author):
+                self.latencies.append(now - self.pending[author].popleft())
+
+    async def player(self, inmem, member, channel):
+        end = bot.client.loop.time() + self.duration
+        while True:
+            await asyncio.sleep(self.rng.expovariate(self.rate))
+            if bot.client.loop.time() >= end:
+                break
+            command = self.rng.choice(LOADTEST_COMMANDS)
+            self.commands[command] += 1
+            message = inmem.make_message(member, bot.BOT_PREFIX + command, channel)
+            self.pending.setdefault(member.id, deque()).append(bot.client.loop.time())
+            inmem.deliver(message)
+            try:
+                await bot.on_message(message)
+            except Exception:
+                # discord.py would log it from its event dispatch and carry on
+                self.errors += 1
+
+    async def run(self, inmem):
+        channel = inmem.get_channel(bot.GAME_CHANNEL)
+        members = [inmem.add_member(str(x), 'player{}'.format(x)) for x in range(1, self.num_players + 1)]
+        inmem.on_send.append(self.on_send)
+        try:
+            await asyncio.gather(*[self.player(inmem, x, channel) for x in members])
+            await bot.flush_messages()
+        finally:
+            inmem.on_send.remove(self.on_send)
+
+    def report(self):
+        sent = sum(self.commands.values())
+        unanswered = sum(len(x) for x in self.pending.values())
+        client = bot.client
+        lines = ['{} players, {} commands in {}s ({})'.format(self.num_players, sent, self.duration,
+                 ', '.join('{} {}'.format(x, y) for x, y in sorted(self.commands.items()))),
+                 'latency p50 {:.3f}s  p90 {:.3f}s  p99 {:.3f}s  max {:.3f}s'.format(percentile(self.latencies, 0.5),
+                 percentile(self.latencies, 0.9), percentile(self.latencies, 0.99), max(self.latencies or [0])),
+                 'unanswered {} (rate limited, ignored or failed), ignored players {}, errors {}'.format(unanswered, len(bot.IGNORE_LIST), self.errors),
+                 'api calls: ' + ', '.join('{} {}'.format(x, y) for x, y in sorted(client.calls.items())),
+                 'rate limited: ' + (', '.join('{} {}'.format(x, y) for x, y in sorted(client.rate_limited.items())) or 'never'),
+                 '', bot.command_metrics.format()]
+        return '\n'.join(lines)
+
+async def run(args):
+    inmem = headless.install(fast=False)
+    bot.client = FakeClient(inmem, args.latency, args.jitter, DISCORD_RATE_LIMITS, args.raise_rate_limits, random.Random(args.seed))
+    bot.transport = DiscordTransport(bot.client, bot.WEREWOLF_SERVER)
+    bot.transport.on_call.append(bot.command_metrics.add_io)
+    with redirect_stdout(io.StringIO()):
+        await bot.on_ready()
+    test = LoadTest(args.players, args.duration, args.rate, random.Random(args.seed))
+    try:
+        await test.run(inmem)
+    finally:
+        await bot.client.logout()
+    return test.report()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Measures command latency with many players talking to the bot at once.")
+    parser.add_argument('--players', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=20, help="seconds the players keep sending commands")
+    parser.add_argument('--rate', type=float, default=0.2, help="commands per second from each player")
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds every api call takes")
+    parser.add_argument('--jitter', type=float, default=0.05, help="up to this many seconds added to each api call")
+    parser.add_argument('--raise-rate-limits', action='store_true', help="answer calls over a rate limit with a 429 instead of waiting")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    print(asyncio.get_event_loop().run_until_complete(run(args)))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,89 @@
+import argparse
+import io
+import json
+import os
+import sys
+from contextlib import redirect_stdout
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+# Plays many headless games per (gamemode, player count) across all cores and prints how often each team won,
+# how long games lasted and how often each role survived, so a change to the gamemode tables or balance_roles
+# shows up as a diff of the output.
+#
+#   python simulate.py --gamemodes default foolish --players 8 12 16 --games 200 --agent heuristic
+
+GAMES_PER_TASK = 10
+
+def simulate(gamemode, num_players, games, seed, agent):
+    # runs in a worker process; bot.py is only imported here so every worker gets its own copy
+    import asyncio
+    import bot
+    import headless
+    if gamemode not in bot.gamemodes or not bot.gamemodes[gamemode]['min_players'] <= num_players <= bot.gamemodes[gamemode]['max_players']:
+        return []
+    # the bot prints plenty on its own; keep it out of the table
+    with redirect_stdout(io.StringIO()):
+        results = asyncio.get_event_loop().run_until_complete(headless.run_games(num_players, gamemode, games, seed, agent))
+    return [x for x in results if x]
+
+def summarize(results):
+    teams = Counter(x['team'] for x in results)
+    roles = Counter()
+    survived = Counter()
+    for result in results:
+        for player, role in result['roles'].items():
+            roles[role] += 1
+            if player in result['alive']:
+                survived[role] += 1
+    return OrderedDict([('games', len(results)),
+                        ('teams', OrderedDict((x, teams[x] / len(results)) for x in sorted(teams))),
+                        ('nights', sum(x['nights'] for x in results) / len(results)),
+                        ('survival', OrderedDict((x, survived[x] / roles[x]) for x in sorted(roles)))])
+
+def format_table(summaries):
+    teams = sorted(set(team for summary in summaries.values() for team in summary['teams']))
+    lines = ['{:<12} {:>7} {:>6} {:>6}  {}'.format('gamemode', 'players', 'games', 'nights', ' '.join('{:>14}'.format(x) for x in teams))]
+    for (gamemode, num_players), summary in summaries.items():
+        lines.append('{:<12} {:>7} {:>6} {:>6.2f}  {}'.format(gamemode, num_players, summary['games'], summary['nights'],
+                     ' '.join('{:>13.1f}%'.format(summary['teams'].get(x, 0) * 100) for x in teams)))
+    lines.append('')
+    lines.append('role survival')
+    for (gamemode, num_players), summary in summaries.items():
+        lines.append('{} {}: {}'.format(gamemode, num_players, ', '.join('{} {:.0f}%'.format(x, y * 100) for x, y in summary['survival'].items())))
+    return '\n'.join(lines)
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Plays headless games and reports win rates per gamemode and player count.")
+    parser.add_argument('--gamemodes', nargs='+', default=['default'])
+    parser.add_argument('--players', nargs='+', type=int, default=[8, 12, 16])
+    parser.add_argument('--games', type=int, default=100, help="games per gamemode and player count")
+    parser.add_argument('--agent', choices=['random', 'heuristic'], default='random')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--json', action='store_true', help="print the summaries as json instead of a table")
+    args = parser.parse_args(argv)
+
+    tasks = OrderedDict()
+    with ProcessPoolExecutor(args.workers) as pool:
+        for gamemode in args.gamemodes:
+            for num_players in args.players:
+                futures = []
+                for i in range(0, args.games, GAMES_PER_TASK):
+                    # seeds only depend on the arguments; phases that time out still make runs differ slightly
+                    seed = '{}:{}:{}:{}'.format(args.seed, gamemode, num_players, i)
+                    futures.append(pool.submit(simulate, gamemode, num_players, min(GAMES_PER_TASK, args.games - i), seed, args.agent))
+                tasks[(gamemode, num_players)] = futures
+        summaries = OrderedDict()
+        for key, futures in tasks.items():
+            results = [result for future in futures for result in future.result()]
+            if results:
+                summaries[key] = summarize(results)
+
+    if args.json:
+        print(json.dumps([OrderedDict([('gamemode', x[0]), ('players', x[1])] + list(y.items())) for x, y in summaries.items()], indent=2))
+    else:
+        print(format_table(summaries))
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
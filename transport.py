@@ -0,0 +1,332 @@
+import asyncio
+import discord
+import random
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+# Everything the game does on discord goes through a transport: looking up the server, members and channels,
+# sending messages and changing roles, channel permissions and presence. bot.py talks to DiscordTransport when
+# it is actually connected; InMemoryTransport keeps the same shape without a network so games can be run
+# headless (see headless.py).
+
+class DiscordTransport:
+    # on_call callbacks get the name of every api call and the seconds it took, which is how bot.py tells the
+    # time commands spend waiting on discord apart from the rest
+    def __init__(self, client, server_id):
+        self.client = client
+        self.server_id = server_id
+        self.on_call = []
+
+    async def _timed(self, method, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            for callback in self.on_call:
+                callback(method, time.perf_counter() - start)
+
+    @property
+    def server(self):
+        return self.client.get_server(self.server_id)
+
+    @property
+    def user(self):
+        return self.client.user
+
+    def get_channel(self, channel_id):
+        return self.client.get_channel(channel_id)
+
+    async def send_message(self, destination, content):
+        return await self._timed('send_message', self.client.send_message(destination, content))
+
+    async def delete_message(self, message):
+        await self._timed('delete_message', self.client.delete_message(message))
+
+    async def wait_for_message(self, timeout=None, author=None, channel=None, check=None):
+        # waiting on a person, not on discord, so it isn't timed
+        return await self.client.wait_for_message(timeout=timeout, author=author, channel=channel, check=check)
+
+    async def add_roles(self, member, *roles):
+        await self._timed('add_roles', self.client.add_roles(member, *roles))
+
+    async def remove_roles(self, member, *roles):
+        await self._timed('remove_roles', self.client.remove_roles(member, *roles))
+
+    async def edit_channel_permissions(self, channel, target, overwrite):
+        await self._timed('edit_channel_permissions', self.client.edit_channel_permissions(channel, target, overwrite))
+
+    async def change_presence(self, game=None, status=None):
+        await self._timed('change_presence', self.client.change_presence(game=game, status=status))
+
+############## IN-MEMORY STAND-INS ###############
+# Just enough of the discord.py 0.16 objects for bot.py: ids are strings, mentions look like the real ones.
+
+class FakeRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+        self.mention = '<@&{}>'.format(role_id)
+
+class FakeMember:
+    def __init__(self, member_id, name, discriminator='0000', bot=False):
+        self.id = member_id
+        self.name = name
+        self.nick = None
+        self.discriminator = discriminator
+        self.bot = bot
+        self.roles = []
+        self.status = discord.Status.online
+        self.game = None
+        self.server = None
+
+    @property
+    def display_name(self):
+        return self.nick or self.name
+
+    @property
+    def mention(self):
+        return '<@{}>'.format(self.id)
+
+class FakeChannel:
+    def __init__(self, channel_id, name, is_private=False, recipient=None):
+        self.id = channel_id
+        self.name = name
+        self.is_private = is_private
+        self.recipient = recipient
+        self.server = None
+        self.overwrites = {}
+
+    def overwrites_for(self, target):
+        return self.overwrites.get(target.id, discord.PermissionOverwrite())
+
+class FakeServer:
+    def __init__(self, server_id, me):
+        self.id = server_id
+        self.me = me
+        self.default_role = FakeRole(server_id, '@everyone')
+        self.role_hierarchy = [self.default_role]
+        self._members = {}
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def get_member(self, member_id):
+        return self._members.get(member_id)
+
+    def get_member_named(self, name):
+        for member in self._members.values():
+            if name in (member.name, member.display_name, '{}#{}'.format(member.name, member.discriminator)):
+                return member
+        return None
+
+class FakeMessage:
+    def __init__(self, message_id, author, channel, content):
+        self.id = message_id
+        self.author = author
+        self.channel = channel
+        self.server = channel.server
+        self.content = content
+        self.clean_content = content
+        self.timestamp = datetime.utcnow()
+        self.mentions = []
+
+class InMemoryTransport:
+    # sent holds (destination, content) for every message the bot sent, in order; on_send callbacks are called
+    # with the same pair, which is how scripted players notice phase changes without polling.
+    def __init__(self, server_id, bot_id='0', bot_name='werewolf'):
+        self.me = FakeMember(bot_id, bot_name, bot=True)
+        self._server = FakeServer(server_id, self.me)
+        self._server._members[bot_id] = self.me
+        self.me.server = self._server
+        self.channels = {}
+        self.private_channels = {}
+        self.sent = []
+        self.on_send = []
+        self.waiters = []
+        self.next_id = 1000
+
+    @property
+    def server(self):
+        return self._server
+
+    @property
+    def user(self):
+        return self.me
+
+    def _new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    def add_role(self, name):
+        role = FakeRole(self._new_id(), name)
+        self._server.role_hierarchy.append(role)
+        return role
+
+    def add_member(self, member_id, name, discriminator='0000'):
+        member = FakeMember(member_id, name, discriminator)
+        member.server = self._server
+        self._server._members[member_id] = member
+        return member
+
+    def get_channel(self, channel_id):
+        if channel_id not in self.channels:
+            channel = FakeChannel(channel_id, channel_id)
+            channel.server = self._server
+            self.channels[channel_id] = channel
+        return self.channels[channel_id]
+
+    def private_channel(self, member):
+        if member.id not in self.private_channels:
+            self.private_channels[member.id] = FakeChannel(self._new_id(), member.name, is_private=True, recipient=member)
+        return self.private_channels[member.id]
+
+    def make_message(self, author, content, channel=None):
+        # a message from author in channel, or in their pm with the bot if channel is None
+        return FakeMessage(self._new_id(), author, channel or self.private_channel(author), content)
+
+    def deliver(self, message):
+        # hands message to anything blocked in wait_for_message; the caller still passes it to on_message
+        for waiter in list(self.waiters):
+            future, author, channel, check = waiter
+            if future.done():
+                self.waiters.remove(waiter)
+            elif (author is None or author.id == message.author.id) and (channel is None or channel.id == message.channel.id)\
+            and (check is None or check(message)):
+                self.waiters.remove(waiter)
+                future.set_result(message)
+
+    async def send_message(self, destination, content):
+        if isinstance(destination, FakeMember):
+            channel = self.private_channel(destination)
+        else:
+            channel = destination
+        self.sent.append((destination, content))
+        for callback in self.on_send:
+            callback(destination, content)
+        return FakeMessage(self._new_id(), self.me, channel, content)
+
+    async def delete_message(self, message):
+        pass
+
+    async def wait_for_message(self, timeout=None, author=None, channel=None, check=None):
+        future = asyncio.get_event_loop().create_future()
+        waiter = (future, author, channel, check)
+        self.waiters.append(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    async def add_roles(self, member, *roles):
+        for role in roles:
+            if role not in member.roles:
+                member.roles.append(role)
+
+    async def remove_roles(self, member, *roles):
+        member.roles = [x for x in member.roles if x not in roles]
+
+    async def edit_channel_permissions(self, channel, target, overwrite):
+        channel.overwrites[target.id] = overwrite
+
+    async def change_presence(self, game=None, status=None):
+        self.me.game = game
+        self.me.status = status
+
+class FakeResponse:
+    # what discord.HTTPException reads off an aiohttp response
+    def __init__(self, status, reason):
+        self.status = status
+        self.reason = reason
+
+class FakeClient:
+    # Stands in for the parts of a discord.py 0.16 Client that bot.py uses, on top of an InMemoryTransport, so the
+    # bot can be driven through DiscordTransport exactly as in production. Every API call takes `latency` seconds
+    # plus up to `jitter`. rate_limits maps a method name to (calls, seconds); send_message is limited per
+    # channel like discord does, everything else per client. Going over either waits out the limit, which is
+    # what discord.py does with a 429, or with raise_rate_limits raises HTTPException carrying retry_after.
+    def __init__(self, transport, latency=0.0, jitter=0.0, rate_limits=None, raise_rate_limits=False, rng=None):
+        self.transport = transport
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limits = rate_limits or {}
+        self.raise_rate_limits = raise_rate_limits
+        self.rng = rng or random.Random()
+        self.loop = asyncio.get_event_loop()
+        self.is_closed = False
+        self.buckets = {}
+        self.calls = Counter()
+        self.rate_limited = Counter()
+
+    @property
+    def user(self):
+        return self.transport.user
+
+    def get_server(self, server_id):
+        server = self.transport.server
+        return server if server.id == server_id else None
+
+    def get_channel(self, channel_id):
+        return self.transport.get_channel(channel_id)
+
+    async def wait_until_ready(self):
+        pass
+
+    async def logout(self):
+        self.is_closed = True
+
+    async def _call(self, method, key=None):
+        self.calls[method] += 1
+        if method in self.rate_limits:
+            calls, seconds = self.rate_limits[method]
+            bucket = self.buckets.setdefault((method, key), deque())
+            limited = False
+            while True:
+                now = self.loop.time()
+                while bucket and bucket[0] <= now - seconds:
+                    bucket.popleft()
+                if len(bucket) < calls:
+                    break
+                if not limited:
+                    self.rate_limited[method] += 1
+                    limited = True
+                retry_after = bucket[0] + seconds - now
+                if self.raise_rate_limits:
+                    e = discord.HTTPException(FakeResponse(429, 'TOO MANY REQUESTS'), {'message' : 'You are being rate limited.', 'code' : 0})
+                    e.retry_after = retry_after
+                    raise e
+                await asyncio.sleep(retry_after)
+            bucket.append(now)
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.random() * self.jitter)
+
+    async def send_message(self, destination, content):
+        await self._call('send_message', destination.id)
+        return await self.transport.send_message(destination, content)
+
+    async def delete_message(self, message):
+        await self._call('delete_message')
+        await self.transport.delete_message(message)
+
+    async def wait_for_message(self, timeout=None, author=None, channel=None, check=None):
+        return await self.transport.wait_for_message(timeout=timeout, author=author, channel=channel, check=check)
+
+    async def add_roles(self, member, *roles):
+        await self._call('add_roles')
+        await self.transport.add_roles(member, *roles)
+
+    async def remove_roles(self, member, *roles):
+        await self._call('remove_roles')
+        await self.transport.remove_roles(member, *roles)
+
+    async def edit_channel_permissions(self, channel, target, overwrite):
+        await self._call('edit_channel_permissions')
+        await self.transport.edit_channel_permissions(channel, target, overwrite)
+
+    async def change_presence(self, game=None, status=None):
+        await self._call('change_presence')
+        await self.transport.change_presence(game=game, status=status)